@@ -0,0 +1,566 @@
+import os
+import re
+import json
+import uuid
+import pickle
+import shutil
+import logging
+import asyncio
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are only locked within the process.
+    fcntl = None
+from flask import request, jsonify, current_app
+from flask.views import MethodView
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from error_logger import ClaimValidator, PREVIOUS_COUNTS
+from file_reader import FileProcessor
+from result_store import get_result_store
+
+# ==============================
+# Chunked, Resumable Uploads
+# ==============================
+# Protocol:
+#   POST   /api/uploads                         {"filename": ..., "total_chunks": n, "purpose": "validate"|"columns",
+#                                                "summary": true for aggregate error counts instead of every error}
+#   PUT    /api/uploads/<upload_id>/chunks/<i>  raw chunk bytes, i starting at 0
+#   GET    /api/uploads/<upload_id>             status, including next_chunk to resume from
+#   POST   /api/uploads/<upload_id>/finalize    validation result (or column list for "columns")
+#   DELETE /api/uploads/<upload_id>             abort
+# Chunks are appended to a spool file in order and validated as they arrive.
+# Chunks that arrive ahead of a gap are parked until the gap is filled.
+# Under a multi-worker server consecutive chunks may reach different processes, so
+# every operation takes a file lock on the session and first catches up with data
+# another worker appended. The validator is pickled into the session after every
+# chunk, so catching up means loading it rather than validating the data again.
+# Errors are spooled in the session as they are found and only become a ResultStore
+# run on finalize; they are kept out of the pickle and read back from the spool.
+#
+# A compressed upload cannot be resumed that way, because decompressor state cannot
+# be pickled. Its validation stays with the worker that started it (meta's
+# validator_id); chunks that reach other workers are only stored, and that worker
+# validates them when it next holds the session. If it never does (or has been
+# restarted), the stored data is validated once more on finalize, skipping the rows
+# already validated. Status from other workers lags behind in the meantime.
+# Sessions that receive no chunk for UPLOAD_SESSION_TTL seconds are deleted.
+
+SESSION_DIR_NAME = ".sessions"
+DEFAULT_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+PURPOSES = ["validate", "columns"]
+REPLAY_CHUNK_SIZE = 1024 * 1024
+SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+SWEEP_INTERVAL = 600
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+class ErrorSpool:
+    """
+    Stands in for a RunRecorder while an upload is in progress. Errors are appended
+    to a file in the session; finish() records them in the ResultStore as one run.
+    """
+
+    def __init__(self, path, file, size=0):
+        self.path = path
+        self.file = file
+        self.run_id = None
+        self._buffer = []
+        with open(path, "ab") as f:
+            f.truncate(size)  # drop errors spooled after the state being resumed
+
+    def __call__(self, row, column, message):
+        self._buffer.append([row, column, message])
+
+    def flush(self):
+        """Writes out the buffered errors and returns the size of the spool file."""
+        with open(self.path, "ab") as f:
+            for error in self._buffer:
+                f.write(json.dumps(error).encode() + b"\n")
+            self._buffer = []
+            return f.tell()
+
+    def finish(self, claim_count, error_count):
+        self.flush()
+        recorder = get_result_store().recorder(self.file)
+        with open(self.path, "rb") as f:
+            for line in f:
+                recorder(*json.loads(line))
+        recorder.finish(claim_count, error_count)
+        self.run_id = recorder.run_id
+
+
+class UploadSession:
+    def __init__(self, upload_id, session_dir, meta):
+        self.upload_id = upload_id
+        self.session_dir = session_dir
+        self.meta = meta
+        self.lock = threading.Lock()
+        self.validator = None
+        self.validator_id = None  # meta["validator_id"] while self.validator is the one the session follows
+        self.deferred = False  # self.validator is a snapshot; another worker validates (see above)
+        self._current = True  # False until a loaded session has caught up under the lock
+        # The validator's file_errors, and how much of the error spool they cover.
+        self._messages = set()
+        self._spool_read = 0
+
+    def _new_validator(self):
+        filename = self.meta["filename"]
+        validator = ClaimValidator(f"uploaded file {filename}", PREVIOUS_COUNTS.get(filename),
+                                   summary=self.meta.get("summary", False))
+        validator.recorder = ErrorSpool(self.errors_path, validator.description)
+        self._messages, self._spool_read = set(), 0
+        validator.file_errors = self._messages
+        return validator
+
+    def _spooled_messages(self, size):
+        """
+        The distinct error messages in the first size bytes of the error spool. Only
+        the part of the spool this process has not read yet is read.
+        """
+        if self.meta.get("summary"):
+            return set()
+        if size < self._spool_read:
+            self._messages, self._spool_read = set(), 0  # the spool was cut back
+        with open(self.errors_path, "rb") as f:
+            f.seek(self._spool_read)
+            data = f.read(size - self._spool_read)
+        self._messages.update(json.loads(line)[2] for line in data.splitlines())
+        self._spool_read = size
+        return self._messages
+
+    @property
+    def data_path(self):
+        return os.path.join(self.session_dir, "data.part")
+
+    @property
+    def state_path(self):
+        return os.path.join(self.session_dir, "validator.pkl")
+
+    @property
+    def errors_path(self):
+        return os.path.join(self.session_dir, "errors.jsonl")
+
+    def chunk_path(self, index):
+        return os.path.join(self.session_dir, f"chunk_{index}.part")
+
+    @classmethod
+    def create(cls, root, filename, total_chunks=None, purpose="validate", persist=True, summary=False):
+        upload_id = uuid.uuid4().hex
+        session_dir = os.path.join(root, upload_id)
+        os.makedirs(session_dir)
+        meta = {
+            "filename": filename,
+            "total_chunks": total_chunks,
+            "purpose": purpose,
+            "persist": persist,
+            "summary": summary,
+            "next_chunk": 0,
+            "bytes_received": 0,
+            "bytes_validated": 0,
+        }
+        session = cls(upload_id, session_dir, meta)
+        open(session.data_path, "wb").close()
+        if purpose == "validate":
+            session._follow(session._new_validator())
+        session.save_meta()
+        return session
+
+    @classmethod
+    def load(cls, root, upload_id):
+        """
+        Reopens a session after a restart or in another worker process. The data and
+        the validator are only brought up to date under the session lock (see refresh).
+        """
+        session_dir = os.path.join(root, upload_id)
+        with open(os.path.join(session_dir, "meta.json")) as f:
+            meta = json.load(f)
+        session = cls(upload_id, session_dir, meta)
+        session._current = False
+        return session
+
+    def save_state(self):
+        """Pickles the validator, and its parser where possible, as of the validated data."""
+        validator = self.validator
+        parser = validator._parser if validator._parser is not None and validator._parser.picklable else None
+        state = {"bytes_validated": self.meta["bytes_validated"], "validator": validator, "parser": parser,
+                 "errors_size": validator.recorder.flush()}
+        if validator.file_errors is self._messages:
+            self._spool_read = state["errors_size"]
+        # The distinct errors are in the spool already; pickling them would make every
+        # chunk of a bad file cost as much as all of its errors so far.
+        file_errors, validator.file_errors = validator.file_errors, set()
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            validator.file_errors = file_errors
+        os.replace(tmp_path, self.state_path)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        if state["bytes_validated"] > self.meta["bytes_received"]:
+            return None  # written for data that was never acknowledged
+        return state
+
+    def _follow(self, validator):
+        """Makes validator, in this process, the one the session follows."""
+        self.validator = validator
+        self.validator_id = uuid.uuid4().hex
+        self.deferred = False
+        self.meta["validator_id"] = self.validator_id
+
+    def _restore(self, take_over=False):
+        """
+        Brings the validator up to the acknowledged data: by validating only what other
+        workers stored if this process holds the session's validator, else from the
+        pickled state. A compressed upload validated by another worker is left to it
+        (self.deferred) unless take_over is set.
+        """
+        if self.meta["purpose"] != "validate" or self.meta.get("failed"):
+            self.validator = None
+            return
+        if self.validator is not None and not self.deferred and self.validator_id == self.meta.get("validator_id"):
+            self._validate_stored(self.meta["bytes_validated"])
+            return
+        state = self._load_state()
+        if state is None:
+            # No usable state (the process stopped between writing the state and the
+            # meta): validate all the data again.
+            self._follow(self._new_validator())
+            self._validate_stored(0)
+            return
+        validator = state["validator"]
+        if state["parser"] is None and state["bytes_validated"] and not take_over:
+            validator.file_errors = self._spooled_messages(state["errors_size"])
+            self.validator, self.validator_id, self.deferred = validator, None, True
+            return
+        validator.recorder = ErrorSpool(self.errors_path, validator.description, state["errors_size"])
+        validator.file_errors = self._spooled_messages(state["errors_size"])
+        validator._parser = state["parser"]
+        self._follow(validator)
+        start = state["bytes_validated"]
+        if validator._parser is None and start:
+            # Decompressor state cannot be pickled: parse compressed input again, but
+            # skip the rows that were already validated.
+            validator._skip_rows = validator.row_count
+            start = 0
+        self._validate_stored(start)
+
+    def _validate_stored(self, start):
+        """Feeds the stored data from offset start to the validator and records the progress."""
+        end = self.meta["bytes_received"]
+        if start < end:
+            with open(self.data_path, "rb") as data:
+                data.seek(start)
+                while start < end:
+                    block = data.read(min(REPLAY_CHUNK_SIZE, end - start))
+                    if not block:
+                        break
+                    start += len(block)
+                    if not self._feed(block):
+                        return
+        self.meta["bytes_validated"] = end
+        self.save_state()
+        self.save_meta()
+
+    def _feed(self, data):
+        try:
+            self.validator.feed(data)
+        except Exception as e:
+            # The validator cannot be rewound, so the session cannot continue.
+            logging.error(f"Upload session {self.upload_id} failed: {str(e)}")
+            self.meta["failed"] = str(e)
+            self.validator = None
+            self.save_meta()
+            return False
+        return True
+
+    @contextmanager
+    def locked(self):
+        """Holds the session against other threads and, where flock exists, other worker processes."""
+        with self.lock:
+            with open(os.path.join(self.session_dir, "lock"), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.refresh()
+                yield
+
+    def refresh(self):
+        """Catches up when the session was just loaded or another worker process has moved it on."""
+        with open(os.path.join(self.session_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if self._current and meta == self.meta:
+            return
+        if self._current:
+            logging.info(f"Upload session {self.upload_id} was advanced by another worker, catching up")
+        else:
+            logging.info(f"Resumed upload session {self.upload_id} at chunk {meta['next_chunk']}")
+        self.meta = meta
+        self._current = True
+        # Anything past the last acknowledged byte was written by a worker that stopped
+        # before acknowledging it; whoever holds the lock has finished appending.
+        with open(self.data_path, "r+b") as data:
+            data.truncate(meta["bytes_received"])
+        self._restore()
+
+    def save_meta(self):
+        tmp_path = os.path.join(self.session_dir, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.session_dir, "meta.json"))
+
+    def put_chunk(self, index, data):
+        """Stores chunk `index`. Returns False if it was already acknowledged."""
+        if index < self.meta["next_chunk"]:
+            return False
+        if index > self.meta["next_chunk"]:
+            with open(self.chunk_path(index), "wb") as f:
+                f.write(data)
+            return True
+
+        self._append(data)
+        # Drain chunks that were parked waiting for this one.
+        while os.path.exists(self.chunk_path(self.meta["next_chunk"])):
+            path = self.chunk_path(self.meta["next_chunk"])
+            with open(path, "rb") as f:
+                self._append(f.read())
+            os.remove(path)
+        return True
+
+    def _append(self, data):
+        following = self.validator is not None and not self.deferred
+        if following and not self._feed(data):
+            raise ValueError(self.meta["failed"])
+        with open(self.data_path, "ab") as f:
+            f.write(data)
+        self.meta["next_chunk"] += 1
+        self.meta["bytes_received"] += len(data)
+        if following:
+            self.meta["bytes_validated"] = self.meta["bytes_received"]
+            self.save_state()
+        self.save_meta()
+
+    def parked_chunks(self):
+        return sorted(int(name[6:-5]) for name in os.listdir(self.session_dir)
+                      if name.startswith("chunk_") and name.endswith(".part"))
+
+    def status(self):
+        status = {
+            "upload_id": self.upload_id,
+            "filename": self.meta["filename"],
+            "purpose": self.meta["purpose"],
+            "next_chunk": self.meta["next_chunk"],
+            "total_chunks": self.meta["total_chunks"],
+            "bytes_received": self.meta["bytes_received"],
+            "parked_chunks": self.parked_chunks(),
+        }
+        if self.meta.get("failed"):
+            status["failed"] = self.meta["failed"]
+        if self.validator is not None:
+            status["rows_validated"] = self.validator.row_count
+            status["errors_so_far"] = self.validator.error_count
+        return status
+
+    def discard(self):
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+
+
+def _session_root():
+    root = os.path.join(current_app.config["UPLOAD_FOLDER"], SESSION_DIR_NAME)
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def _get_session(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return None
+    with _sessions_lock:
+        session = _sessions.get(upload_id)
+    if session is not None:
+        return session
+    # Loading only reads the meta; catching up happens under the session's own lock.
+    try:
+        session = UploadSession.load(_session_root(), upload_id)
+    except FileNotFoundError:
+        return None
+    with _sessions_lock:
+        return _sessions.setdefault(upload_id, session)
+
+
+def _forget_session(upload_id):
+    with _sessions_lock:
+        _sessions.pop(upload_id, None)
+
+
+def sweep_sessions(root, ttl=SESSION_TTL):
+    """Deletes sessions whose meta.json, rewritten on every chunk, is older than ttl. Returns their ids."""
+    swept = []
+    cutoff = time.time() - ttl
+    for upload_id in os.listdir(root):
+        session_dir = os.path.join(root, upload_id)
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            continue
+        try:
+            if os.path.getmtime(os.path.join(session_dir, "meta.json")) >= cutoff:
+                continue
+            with open(os.path.join(session_dir, "lock"), "a") as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # in use right now
+                shutil.rmtree(session_dir, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+        _forget_session(upload_id)
+        swept.append(upload_id)
+    if swept:
+        logging.info(f"Deleted {len(swept)} abandoned upload session(s): {swept}")
+    return swept
+
+
+def _maybe_sweep(root):
+    global _last_sweep
+    now = time.monotonic()
+    with _sessions_lock:
+        if _last_sweep and now - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+    sweep_sessions(root, current_app.config.get("UPLOAD_SESSION_TTL", SESSION_TTL))
+
+
+class ChunkedUploadAPI(MethodView):
+    def post(self, upload_id=None, action=None):
+        if upload_id is None:
+            return self.create_session()
+        if action == "finalize":
+            return self.finalize(upload_id)
+        return jsonify({"error": "Invalid action"}), 400
+
+    def create_session(self):
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get("filename", ""))
+        if filename == "":
+            return jsonify({"error": "No selected file"}), 400
+        purpose = data.get("purpose", "validate")
+        if purpose not in PURPOSES:
+            return jsonify({"error": f"purpose must be one of {PURPOSES}"}), 400
+        total_chunks = data.get("total_chunks")
+        if total_chunks is not None and (not isinstance(total_chunks, int) or total_chunks < 1):
+            return jsonify({"error": "total_chunks must be a positive integer"}), 400
+
+        root = _session_root()
+        _maybe_sweep(root)
+        session = UploadSession.create(root, filename, total_chunks, purpose, bool(data.get("persist", True)),
+                                       bool(data.get("summary", False)))
+        with _sessions_lock:
+            _sessions[session.upload_id] = session
+        logging.info(f"Created upload session {session.upload_id} for {filename} ({purpose})")
+        return jsonify(session.status()), 201
+
+    def get(self, upload_id):
+        session = _get_session(upload_id)
+        if session is None:
+            return jsonify({"error": "Upload session not found"}), 404
+        try:
+            with session.locked():
+                return jsonify(session.status())
+        except FileNotFoundError:
+            _forget_session(upload_id)
+            return jsonify({"error": "Upload session not found"}), 404
+
+    def put(self, upload_id, index):
+        session = _get_session(upload_id)
+        if session is None:
+            return jsonify({"error": "Upload session not found"}), 404
+        total_chunks = session.meta["total_chunks"]
+        if total_chunks is not None and index >= total_chunks:
+            return jsonify({"error": f"Chunk index {index} is beyond total_chunks {total_chunks}"}), 400
+        max_chunk_size = current_app.config.get("MAX_CHUNK_SIZE", DEFAULT_MAX_CHUNK_SIZE)
+        if request.content_length is not None and request.content_length > max_chunk_size:
+            return jsonify({"error": f"Chunk exceeds {max_chunk_size} bytes"}), 413
+
+        data = request.get_data(cache=False)
+        try:
+            with session.locked():
+                if session.meta.get("failed"):
+                    return jsonify(session.status()), 422
+                try:
+                    stored = session.put_chunk(index, data)
+                except Exception as e:
+                    logging.error(f"Error storing chunk {index} of upload {upload_id}: {str(e)}")
+                    return jsonify({"error": f"Chunk could not be processed: {str(e)}"}), 422
+                status = session.status()
+        except FileNotFoundError:
+            _forget_session(upload_id)
+            return jsonify({"error": "Upload session not found"}), 404
+        status["acknowledged"] = index
+        status["duplicate"] = not stored
+        return jsonify(status)
+
+    def delete(self, upload_id):
+        session = _get_session(upload_id)
+        if session is None:
+            return jsonify({"error": "Upload session not found"}), 404
+        try:
+            with session.locked():
+                session.discard()
+        except FileNotFoundError:
+            pass
+        _forget_session(upload_id)
+        return jsonify({"upload_id": upload_id, "deleted": True})
+
+    def finalize(self, upload_id):
+        session = _get_session(upload_id)
+        if session is None:
+            return jsonify({"error": "Upload session not found"}), 404
+        try:
+            with session.locked():
+                return self._finalize_locked(session)
+        except FileNotFoundError:
+            _forget_session(upload_id)
+            return jsonify({"error": "Upload session not found"}), 404
+
+    def _finalize_locked(self, session):
+        meta = session.meta
+        if meta.get("failed"):
+            status = session.status()
+            status["error"] = "Upload failed and cannot be finalized"
+            return jsonify(status), 422
+        missing = session.parked_chunks()
+        if missing or (meta["total_chunks"] is not None and meta["next_chunk"] != meta["total_chunks"]):
+            status = session.status()
+            status["error"] = f"Upload incomplete, resume from chunk {meta['next_chunk']}"
+            return jsonify(status), 409
+
+        if meta["purpose"] == "columns":
+            with open(session.data_path, "rb") as data:
+                result = asyncio.run(FileProcessor.process_file(FileStorage(data, filename=meta["filename"])))
+        else:
+            if session.deferred:
+                session._restore(take_over=True)
+                if meta.get("failed"):
+                    status = session.status()
+                    status["error"] = "Upload failed and cannot be finalized"
+                    return jsonify(status), 422
+            result = session.validator.finish()
+            if result is None:
+                result = {"error": "Uploaded file is empty"}
+
+        if meta["persist"]:
+            os.replace(session.data_path, os.path.join(current_app.config["UPLOAD_FOLDER"], meta["filename"]))
+        session.discard()
+        _forget_session(session.upload_id)
+        return jsonify(result)
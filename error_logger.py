@@ -1,9 +1,29 @@
 #!/usr/bin/env python3
 import os
-import csv
+import sys
+import io
+import json
 import re
 import logging
+import heapq
+import time
+import uuid
+import random
+import pickle
+import hashlib
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from bisect import bisect_left
+from itertools import repeat
 from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows: checkpoints are not locked against a second run of the same file.
+    fcntl = None
+from input_stream import (IncrementalRowParser, JsonRecordReader, MappedClaimFile, UnparsableRecord, open_claim_stream,
+                          parse_records)
+from memory_budget import AdaptiveBatch, JobMemory, estimate_size, row_size
 
 # ==============================
 # Setup Logging (to file and console)
@@ -15,8 +35,9 @@ logger.setLevel(logging.INFO)
 if logger.hasHandlers():
     logger.handlers.clear()
 
-# File handler
-fh = logging.FileHandler("smart_parser.log")
+# File handler; the log file is only opened when the first record is written.
+LOG_FILE = "smart_parser.log"
+fh = logging.FileHandler(LOG_FILE, delay=True)
 fh.setLevel(logging.INFO)
 fh_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 fh.setFormatter(fh_formatter)
@@ -48,6 +69,12 @@ ALLOWED_STATES = [
     "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"
 ]
 
+# Amounts are fixed-point: "scale" digits after the point (2 = cents) and at most
+# "precision" significant digits in all. They are parsed to integer units, never float.
+AMOUNT_SCALE = 2
+AMOUNT_PRECISION = 15
+POWERS_OF_TEN = [10 ** i for i in range(19)]  # precision is at most 18 so units fit in int64
+
 CLAIM_SCHEMA = [
     {"name": "RecordID", "required": True, "expected": "CLM", "max_length": 3, "type": "text"},
     {"name": "RecordNumber", "required": True, "type": "integer", "unique": True},
@@ -83,12 +110,12 @@ CLAIM_SCHEMA = [
     {"name": "Quantity", "required": True, "type": "integer"},
     {"name": "Dosage Form", "required": False, "type": "text", "max_length": 20},
     {"name": "Formulary", "required": True, "type": "text", "max_length": 1, "allowed": ["Y", "N"]},
-    {"name": "Total_Billed_Amount", "required": True, "type": "decimal", "min": 0},
-    {"name": "Plan_Paid_Amount", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Copay_Coins", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Deductible", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Other_Cost", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Total_Paid_Amount", "required": True, "type": "decimal", "min": 0},
+    {"name": "Total_Billed_Amount", "required": True, "type": "amount", "scale": AMOUNT_SCALE, "min": 0},
+    {"name": "Plan_Paid_Amount", "required": True, "type": "amount", "scale": AMOUNT_SCALE, "min": 0},
+    {"name": "Member_Copay_Coins", "required": True, "type": "amount", "scale": AMOUNT_SCALE, "min": 0},
+    {"name": "Member_Deductible", "required": True, "type": "amount", "scale": AMOUNT_SCALE, "min": 0},
+    {"name": "Member_Other_Cost", "required": True, "type": "amount", "scale": AMOUNT_SCALE, "min": 0},
+    {"name": "Member_Total_Paid_Amount", "required": True, "type": "amount", "scale": AMOUNT_SCALE, "min": 0},
     {"name": "Paid_Date", "required": True, "type": "date", "max_length": 10},
     {"name": "Status", "required": False, "type": "text", "max_length": 1, "allowed": ["A", "D", "R"]}
 ]
@@ -98,6 +125,18 @@ TRAILER_SCHEMA = [
     {"name": "Record Count", "required": True, "type": "integer"}
 ]
 
+# Cross-field rules over claim rows, checked after the single-field schema rules.
+#   order: each column must be on or after the one before it ("strict": strictly after).
+#   sum:   total must equal the sum of parts, within tolerance (exact for amount columns).
+# Rows where any involved value is missing or invalid are skipped; the schema reports those.
+CLAIM_RULES = [
+    {"name": "service_fill_paid_order", "check": "order",
+     "columns": ["Date_of_Service", "Prescription_Filled_Date", "Paid_Date"]},
+    {"name": "born_before_service", "check": "order", "columns": ["DoB", "Date_of_Service"], "strict": True},
+    {"name": "member_total_paid", "check": "sum", "total": "Member_Total_Paid_Amount",
+     "parts": ["Member_Copay_Coins", "Member_Deductible", "Member_Other_Cost"], "tolerance": 0.005},
+]
+
 EXPECTED_HEADER_FIELDS = len(HEADER_SCHEMA)
 EXPECTED_CLAIM_FIELDS = 42
 EXPECTED_TRAILER_FIELDS = len(TRAILER_SCHEMA)
@@ -126,6 +165,34 @@ def is_valid_decimal(value):
     except ValueError:
         return False, f"Not a valid decimal: {value}"
 
+def parse_amount(value, scale=AMOUNT_SCALE, precision=AMOUNT_PRECISION):
+    """
+    Parses a fixed-point amount like "12.5" or "-3.07" into an integer count of
+    10**-scale units (1250 and -307 cents for scale 2) in one pass, without float.
+    Returns (units, None), or (None, error) for malformed or over-precise values.
+    """
+    whole, _, frac = value.partition(".")
+    digits = whole + frac
+    negative = False
+    if not (digits.isdigit() and digits.isascii()):
+        sign = whole[:1]
+        digits = whole[1:] + frac
+        if sign not in ("-", "+") or not (digits.isdigit() and digits.isascii()):
+            return None, f"Not a valid amount: {value}"
+        negative = sign == "-"
+    if len(frac) > scale:
+        return None, f"Value '{value}' has more than {scale} decimal places."
+    units = int(digits) * POWERS_OF_TEN[scale - len(frac)]
+    if units >= POWERS_OF_TEN[precision]:
+        return None, f"Value '{value}' has more than {precision} significant digits."
+    return (-units if negative else units), None
+
+def format_amount(units, scale=AMOUNT_SCALE):
+    """Inverse of parse_amount: integer units back to a decimal string."""
+    sign = "-" if units < 0 else ""
+    whole, frac = divmod(abs(int(units)), 10 ** scale)
+    return f"{sign}{whole}.{frac:0{scale}d}" if scale else f"{sign}{whole}"
+
 def check_length(value, max_length):
     if len(value) > max_length:
         return False, f"Length {len(value)} exceeds max length {max_length}"
@@ -179,6 +246,13 @@ def validate_field(field_schema, value):
                 converted_value = float(value)
             except Exception as e:
                 errors.append(f"Conversion to decimal failed: {e}")
+    elif ftype == "amount":
+        scale = field_schema.get("scale", AMOUNT_SCALE)
+        units, err = parse_amount(value, scale, field_schema.get("precision", AMOUNT_PRECISION))
+        if err:
+            errors.append(err)
+        elif "min" in field_schema and units < round(field_schema["min"] * POWERS_OF_TEN[scale]):
+            errors.append(f"Value {value} is less than minimum {field_schema['min']}.")
 
     if "allowed" in field_schema:
         allowed_list = field_schema["allowed"]
@@ -190,7 +264,7 @@ def validate_field(field_schema, value):
             if not valid:
                 errors.append(err)
 
-    if "pattern" in field_schema and ftype not in ["integer", "decimal"]:
+    if "pattern" in field_schema and ftype not in ["integer", "decimal", "amount"]:
         valid, err = check_pattern(value, field_schema["pattern"])
         if not valid:
             errors.append(err)
@@ -200,519 +274,1324 @@ def validate_field(field_schema, value):
         if not valid:
             errors.append(err)
 
-    if ftype in ["integer", "decimal"] and "min" in field_schema:
+    # converted_value is still the raw string when the value did not parse.
+    if ftype in ["integer", "decimal"] and "min" in field_schema and not isinstance(converted_value, str):
         if converted_value < field_schema["min"]:
             errors.append(f"Value {value} is less than minimum {field_schema['min']}.")
 
     return errors
 
-def validate_row(row, schema, row_number):
-    errors = []
+def preload_validators():
+    """
+    Compiles the schema patterns into the re cache and loads the strptime machinery.
+    Called before a prefork server forks, so workers share the result copy-on-write.
+    """
+    for schema in (HEADER_SCHEMA, CLAIM_SCHEMA, TRAILER_SCHEMA):
+        for field_schema in schema:
+            if "pattern" in field_schema:
+                re.compile(field_schema["pattern"])
+    is_valid_date("2000-01-01")
+    CrossFieldRules()  # checks the rules refer to real columns
+    import numpy  # noqa: F401  used by the rule engine
+
+def row_field_errors(row, schema, cache=None):
+    """
+    Validates a row without formatting row numbers into the messages.
+    Returns (column_name, message) pairs; column_name is None for a column count mismatch.
+    If a SchemaValidationCache for the schema is given, field results are memoized.
+    """
     if len(row) != len(schema):
-        errors.append(f"Row {row_number}: Expected {len(schema)} columns, found {len(row)} columns.")
+        return [(None, f"Expected {len(schema)} columns, found {len(row)} columns.")]
+    errors = []
+    if cache is None:
+        for idx, field_schema in enumerate(schema):
+            field_value = row[idx].strip()
+            for err in validate_field(field_schema, field_value):
+                errors.append((field_schema["name"], err))
         return errors
-    for idx, field_schema in enumerate(schema):
-        field_value = row[idx].strip()
-        field_errors = validate_field(field_schema, field_value)
+    for field_cache, value in zip(cache.fields, row):
+        field_errors = field_cache.validate(value.strip())
         if field_errors:
+            name = field_cache.name
             for err in field_errors:
-                errors.append(f"Row {row_number}, Column '{field_schema['name']}': {err}")
+                errors.append((name, err))
     return errors
 
-# ==============================
-# File Processing Functions
-# ==============================
-def process_file(file_path, previous_record_count=None):
-    logger.info(f"Processing file: {file_path}")
-    print(f"\nProcessing file: {file_path}")
-
-    if not os.path.exists(file_path):
-        err_msg = f"File not found: {file_path}"
-        logger.error(err_msg)
-        print(err_msg)
-        return
+def format_row_error(row_number, column, err):
+    if column is None:
+        return f"Row {row_number}: {err}"
+    return f"Row {row_number}, Column '{column}': {err}"
 
-    file_errors = set()
-    unique_record_numbers = set()
-    claim_count = 0
+def format_row_errors(field_errors, row_number):
+    return [format_row_error(row_number, column, err) for column, err in field_errors]
 
-    try:
-        with open(file_path, newline="", encoding="utf-8") as csvfile:
-            reader = csv.reader(csvfile)
-            rows = list(reader)
-    except Exception as e:
-        err_msg = f"Error reading file {file_path}: {str(e)}"
-        logger.error(err_msg)
-        print(err_msg)
-        return
+def validate_row(row, schema, row_number, cache=None):
+    return format_row_errors(row_field_errors(row, schema, cache), row_number)
 
-    if not rows:
-        err_msg = f"File {file_path} is empty."
-        logger.error(err_msg)
-        print(err_msg)
-        return
+# ==============================
+# Validation Cache
+# ==============================
+class FieldValidationCache:
+    """
+    Bounded memo of validate_field results for one column.
+
+    Columns such as State, Pharmacy_Name or the dates repeat a few hundred values
+    across millions of rows, so the outcome for a raw value is computed once.
+    Every SAMPLE_SIZE cached lookups the miss rate is checked. A window that mostly
+    misses (SSN, ClaimID) switches caching off for the next window, after which it is
+    tried again; each further failed window doubles the pause, up to MAX_BACKOFF
+    windows, and a good one resets it. Columns marked unique are never cached.
+    """
+    MAX_ENTRIES = 4096
+    SAMPLE_SIZE = 2048
+    MAX_MISS_RATIO = 0.5
+    MAX_BACKOFF = 64
+
+    def __init__(self, field_schema, max_entries=MAX_ENTRIES):
+        self.field_schema = field_schema
+        self.name = field_schema["name"]
+        self.max_entries = max_entries
+        self.enabled = not field_schema.get("unique", False)
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._window_misses = 0
+        self._paused_for = 0  # lookups left before caching is tried again
+        self._backoff = 1  # windows the next pause lasts
+
+    def validate(self, value):
+        if not self.enabled:
+            if self._paused_for:
+                self._paused_for -= 1
+                self.enabled = not self._paused_for
+            return validate_field(self.field_schema, value)
+        errors = self._entries.get(value)
+        if errors is not None:
+            self.hits += 1
+        else:
+            errors = tuple(validate_field(self.field_schema, value))
+            self.misses += 1
+            self._window_misses += 1
+            if len(self._entries) < self.max_entries:
+                self._entries[value] = errors
+        # Every window ends on its last lookup, hit or miss.
+        if (self.hits + self.misses) % self.SAMPLE_SIZE == 0:
+            if self._window_misses > self.SAMPLE_SIZE * self.MAX_MISS_RATIO:
+                self.enabled = False
+                self._entries = {}
+                self._paused_for = self.SAMPLE_SIZE * self._backoff
+                self._backoff = min(self._backoff * 2, self.MAX_BACKOFF)
+            else:
+                self._backoff = 1
+            self._window_misses = 0
+        return errors
 
-    # Detect header and trailer rows.
-    has_header = (rows[0][0].strip() == "HDR") if rows[0] else False
-    has_trailer = (rows[-1][0].strip() == "TRL") if rows[-1] else False
-
-    if has_header:
-        header_row = rows[0]
-        header_errors = validate_row(header_row, HEADER_SCHEMA, row_number=1)
-        if header_errors:
-            file_errors.update(header_errors)
-            logger.error(f"Header errors in {file_path}: {header_errors}")
-            print("Header errors:")
-            for err in header_errors:
-                print(err)
-    else:
-        warning_msg = f"File {file_path} does not have a header row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print("Warning: No header row found. Treating all rows as claim records.")
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+class ColumnwiseField:
+    """
+    Stands in for the FieldValidationCache of a column that is validated a batch
+    at a time instead of cell by cell (see ClaimValidator.check_rules).
+    """
+    hits = 0
+    misses = 0
 
-    if has_trailer:
-        trailer_row = rows[-1]
-        trailer_errors = validate_row(trailer_row, TRAILER_SCHEMA, row_number=len(rows))
-        if trailer_errors:
-            file_errors.update(trailer_errors)
-            logger.error(f"Trailer errors in {file_path}: {trailer_errors}")
-            print("Trailer errors:")
-            for err in trailer_errors:
-                print(err)
-    else:
-        warning_msg = f"File {file_path} does not have a trailer row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print("Warning: No trailer row found. Treating all rows as claim records.")
+    def __init__(self, field_schema):
+        self.field_schema = field_schema
+        self.name = field_schema["name"]
 
-    # Determine claim rows.
-    start_idx = 1 if has_header else 0
-    end_idx = -1 if has_trailer else len(rows)
-    claim_rows = rows[start_idx:end_idx]
+    def validate(self, value):
+        return ()
 
-    for idx, row in enumerate(claim_rows, start=start_idx+1):
-        if len(row) != EXPECTED_CLAIM_FIELDS:
-            err = f"Row {idx}: Expected {EXPECTED_CLAIM_FIELDS} columns, found {len(row)}."
-            file_errors.add(err)
-            print(err)
-            continue
-        errors = validate_row(row, CLAIM_SCHEMA, row_number=idx)
-        for err in errors:
-            file_errors.add(err)
-            print(err)
-        record_number = row[1].strip()
-        if record_number in unique_record_numbers:
-            dup_err = f"Row {idx}: Duplicate RecordNumber {record_number}."
-            file_errors.add(dup_err)
-            print(dup_err)
-        else:
-            unique_record_numbers.add(record_number)
-        claim_count += 1
+    def stats(self):
+        return {"enabled": False, "columnwise": True, "hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0}
 
-    if has_trailer:
-        try:
-            expected_count = int(trailer_row[1].strip())
-            if expected_count != claim_count:
-                err = f"Trailer count {expected_count} does not match actual claim count {claim_count}."
-                file_errors.add(err)
-                print(err)
-        except Exception as e:
-            err = f"Error parsing trailer Record Count: {e}"
-            file_errors.add(err)
-            print(err)
-
-    if previous_record_count is not None:
-        if previous_record_count > 0 and abs(claim_count - previous_record_count) / previous_record_count > 0.5:
-            warn_msg = f"Warning: Claim count {claim_count} differs by more than 50% from previous count {previous_record_count}."
-            logger.warning(warn_msg)
-            print(warn_msg)
-
-    error_count = len(file_errors)
-    if error_count > 0:
-        sorted_errors = sorted(file_errors)
-        logger.error(f"Errors found in file {file_path}:")
-        for err in sorted_errors:
-            logger.error(err)
-        summary_msg = f"Finished processing file {file_path} with {error_count} error(s) and {claim_count} claim record(s)."
-        logger.error(summary_msg)
-        print(f"\n{summary_msg}")
-        print("Error details:")
-        for err in sorted_errors:
-            print(f" - {err}")
-    else:
-        summary_msg = f"File {file_path} processed successfully with {claim_count} claim record(s) and no errors."
-        logger.info(summary_msg)
-        print(summary_msg)
-        logger.info("Total errors: 0")
-        print("Total errors: 0")
-
-def process_uploaded_file(file_obj, previous_record_count=None):
+class SchemaValidationCache:
     """
-    This function is similar to process_file() but accepts a file-like object.
-    It can be used when a single file is uploaded (e.g., via a web form).
+    One FieldValidationCache per column of a schema, in schema order. Columns named
+    in columnwise are left to the caller to validate per batch.
     """
-    # Ensure we start reading from the beginning.
-    file_obj.seek(0)
-    print("\nProcessing uploaded file...")
-    try:
-        reader = csv.reader(file_obj)
-        rows = list(reader)
-    except Exception as e:
-        err_msg = f"Error reading uploaded file: {str(e)}"
-        logger.error(err_msg)
-        print(err_msg)
-        return
 
-    if not rows:
-        err_msg = "Uploaded file is empty."
-        logger.error(err_msg)
-        print(err_msg)
-        return
+    def __init__(self, schema, max_entries=FieldValidationCache.MAX_ENTRIES, columnwise=()):
+        self.fields = [ColumnwiseField(field_schema) if field_schema["name"] in columnwise
+                       else FieldValidationCache(field_schema, max_entries) for field_schema in schema]
 
-    # Use the same logic as process_file (note: we do not have a file path here)
-    file_errors = set()
-    unique_record_numbers = set()
-    claim_count = 0
-
-    has_header = (rows[0][0].strip() == "HDR") if rows[0] else False
-    has_trailer = (rows[-1][0].strip() == "TRL") if rows[-1] else False
-
-    if has_header:
-        header_row = rows[0]
-        header_errors = validate_row(header_row, HEADER_SCHEMA, row_number=1)
-        if header_errors:
-            file_errors.update(header_errors)
-            logger.error(f"Header errors in uploaded file: {header_errors}")
-            print("Header errors:")
-            for err in header_errors:
-                print(err)
-    else:
-        warning_msg = "Uploaded file does not have a header row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print(warning_msg)
+    def stats(self):
+        hits = sum(field.hits for field in self.fields)
+        lookups = hits + sum(field.misses for field in self.fields)
+        return {
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "columns": {field.name: field.stats() for field in self.fields},
+        }
 
-    if has_trailer:
-        trailer_row = rows[-1]
-        trailer_errors = validate_row(trailer_row, TRAILER_SCHEMA, row_number=len(rows))
-        if trailer_errors:
-            file_errors.update(trailer_errors)
-            logger.error(f"Trailer errors in uploaded file: {trailer_errors}")
-            print("Trailer errors:")
-            for err in trailer_errors:
-                print(err)
-    else:
-        warning_msg = "Uploaded file does not have a trailer row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print(warning_msg)
-
-    start_idx = 1 if has_header else 0
-    end_idx = -1 if has_trailer else len(rows)
-    claim_rows = rows[start_idx:end_idx]
+# ==============================
+# Error Summaries
+# ==============================
+# Error codes used by summaries, matched against the message text in order.
+ERROR_CODES = [
+    ("columns, found", "column_count"),
+    ("is required but missing", "required"),
+    ("does not match pattern", "pattern"),
+    ("is not in allowed list", "not_allowed"),
+    ("exceeds max length", "too_long"),
+    ("Not a valid integer", "not_integer"),
+    ("Not a valid decimal", "not_decimal"),
+    ("Not a valid amount", "not_amount"),
+    ("decimal places", "too_many_decimal_places"),
+    ("significant digits", "too_many_digits"),
+    ("Invalid date format", "invalid_date"),
+    ("is less than minimum", "below_minimum"),
+    ("Conversion to", "conversion"),
+    ("Duplicate RecordNumber", "duplicate_record_number"),
+    ("Trailer count", "trailer_count"),
+    ("Error parsing trailer", "trailer_record_count"),
+    ("Expected '", "unexpected_value"),
+]
+SUMMARY_EXAMPLES = 5
+SUMMARY_TOP_ERRORS = 20
+SUMMARY_SEED = 0  # fixed, so the same file always yields the same examples
+
+def error_code(message):
+    rule = re.search(r"Rule '([^']+)'", message)
+    if rule:
+        return f"rule:{rule.group(1)}"
+    for text, code in ERROR_CODES:
+        if text in message:
+            return code
+    return "other"
+
+class ErrorSummary:
+    """
+    Streaming error aggregates: counts per column, per error code and per (column, code)
+    pair, each pair keeping a reservoir sample of example errors. Memory depends on the
+    number of columns and codes, not on how many errors the file has.
+    """
 
-    for idx, row in enumerate(claim_rows, start=start_idx+1):
-        if len(row) != EXPECTED_CLAIM_FIELDS:
-            err = f"Row {idx}: Expected {EXPECTED_CLAIM_FIELDS} columns, found {len(row)}."
-            file_errors.add(err)
-            print(err)
-            continue
-        errors = validate_row(row, CLAIM_SCHEMA, row_number=idx)
-        for err in errors:
-            file_errors.add(err)
-            print(err)
-        record_number = row[1].strip()
-        if record_number in unique_record_numbers:
-            dup_err = f"Row {idx}: Duplicate RecordNumber {record_number}."
-            file_errors.add(dup_err)
-            print(dup_err)
+    def __init__(self, examples=SUMMARY_EXAMPLES, seed=None):
+        self.examples = examples
+        self.total = 0
+        self.by_column = {}
+        self.by_code = {}
+        self._groups = {}  # (column, code) -> [count, examples]
+        self._rng = random.Random(seed)
+
+    def add(self, row, column, message):
+        code = error_code(message)
+        column = column or ("(row)" if row is not None else "(file)")
+        self.total += 1
+        self.by_column[column] = self.by_column.get(column, 0) + 1
+        self.by_code[code] = self.by_code.get(code, 0) + 1
+        group = self._groups.get((column, code))
+        if group is None:
+            group = self._groups[(column, code)] = [0, []]
+        group[0] += 1
+        example = {"row": row, "message": message}
+        if len(group[1]) < self.examples:
+            group[1].append(example)
         else:
-            unique_record_numbers.add(record_number)
-        claim_count += 1
+            slot = self._rng.randrange(group[0])
+            if slot < self.examples:
+                group[1][slot] = example
+
+    def report(self, top=SUMMARY_TOP_ERRORS):
+        groups = sorted(self._groups.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            "by_column": dict(sorted(self.by_column.items(), key=lambda item: item[1], reverse=True)),
+            "by_code": dict(sorted(self.by_code.items(), key=lambda item: item[1], reverse=True)),
+            "distinct_error_types": len(groups),
+            "top_errors": [{"column": column, "code": code, "count": count,
+                            "examples": sorted(examples, key=lambda e: (e["row"] is None, e["row"] or 0))}
+                           for (column, code), (count, examples) in groups[:top]],
+        }
 
-    if has_trailer:
-        try:
-            expected_count = int(trailer_row[1].strip())
-            if expected_count != claim_count:
-                err = f"Trailer count {expected_count} does not match actual claim count {claim_count}."
-                file_errors.add(err)
-                print(err)
-        except Exception as e:
-            err = f"Error parsing trailer Record Count: {e}"
-            file_errors.add(err)
-            print(err)
-
-    if previous_record_count is not None:
-        if previous_record_count > 0 and abs(claim_count - previous_record_count) / previous_record_count > 0.5:
-            warn_msg = f"Warning: Claim count {claim_count} differs by more than 50% from previous count {previous_record_count}."
-            logger.warning(warn_msg)
-            print(warn_msg)
-
-    error_count = len(file_errors)
-    if error_count > 0:
-        sorted_errors = sorted(file_errors)
-        logger.error("Errors found in uploaded file:")
-        for err in sorted_errors:
-            logger.error(err)
-        summary_msg = f"Finished processing uploaded file with {error_count} error(s) and {claim_count} claim record(s)."
-        logger.error(summary_msg)
-        print(f"\n{summary_msg}")
-        print("Error details:")
-        for err in sorted_errors:
-            print(f" - {err}")
-    else:
-        summary_msg = f"Uploaded file processed successfully with {claim_count} claim record(s) and no errors."
-        logger.info(summary_msg)
-        print(summary_msg)
-        logger.info("Total errors: 0")
-        print("Total errors: 0")
-
-def process_files_in_folder(folder_path, previous_counts=None):
-    if not os.path.exists(folder_path):
-        err_msg = f"Folder not found: {folder_path}"
-        logger.error(err_msg)
-        print(err_msg)
-        return
-
-    files = [os.path.join(folder_path, f) for f in os.listdir(folder_path)
-             if os.path.isfile(os.path.join(folder_path, f))]
+# ==============================
+# Cross-Field Rules
+# ==============================
+# Claim rows are batched for check_rules(), RULE_BATCH_SIZE at most (larger batches are
+# no faster) and fewer when rows are too wide to fit in RULE_BATCH_SHARE of the job's
+# memory budget (see memory_budget.AdaptiveBatch).
+RULE_BATCH_SIZE = 4096
+RULE_BATCH_MIN = 256
+RULE_BATCH_SHARE = 0.25
+
+def parse_amounts(values, scale=AMOUNT_SCALE, precision=AMOUNT_PRECISION):
+    """
+    Column-wise parse_amount: returns (units, valid) NumPy arrays, int64 and bool.
+    The strings are laid out as a byte matrix and read with Horner's rule one
+    character position at a time across the whole batch, checking the format as
+    it goes. Agrees with parse_amount on every value.
+    """
+    import numpy as np
+    count = len(values)
+    # One column per character of the longest value, capped at what fits the precision
+    # (plus one to notice longer values, which are parsed one by one at the end).
+    longest = max(map(len, values), default=0)
+    width = min(longest, precision + 2) + 1
+    try:
+        matrix = np.array(values, dtype=f"S{width}")
+        usable = None
+    except UnicodeEncodeError:
+        usable = np.fromiter(map(str.isascii, values), dtype=bool, count=count)
+        matrix = np.array([value if ok else "" for value, ok in zip(values, usable)], dtype=f"S{width}")
+    columns = matrix.view(np.uint8).reshape(count, width).T.copy()
+    acc = np.zeros(count, dtype=np.int64)
+    frac_len = np.zeros(count, dtype=np.int64)
+    any_digit = np.zeros(count, dtype=bool)
+    seen_point = np.zeros(count, dtype=bool)
+    ended = np.zeros(count, dtype=bool)
+    bad = np.zeros(count, dtype=bool)
+    negative = columns[0] == ord("-")
+    for j, chars in enumerate(columns):
+        digit = chars - np.uint8(ord("0"))  # wraps around for non-digits
+        is_digit = digit < 10
+        is_point = chars == ord(".")
+        end = chars == 0
+        bad |= ended & ~end
+        ended |= end
+        other = ~(is_digit | is_point | ended)
+        if j == 0:
+            other &= ~negative & (chars != ord("+"))
+        bad |= other | (is_point & seen_point)
+        seen_point |= is_point
+        frac_len += seen_point & is_digit
+        any_digit |= is_digit
+        acc = np.where(is_digit, acc * 10 + digit, acc)
+    valid = ~bad & any_digit & (frac_len <= scale) & ended
+    if usable is not None:
+        valid &= usable
+    if "\0" in "".join(values):  # numpy drops trailing NULs
+        valid &= np.fromiter(("\0" not in value for value in values), dtype=bool, count=count)
+    frac_len = np.minimum(frac_len, scale)
+    powers = np.array(POWERS_OF_TEN, dtype=np.int64)
+    valid &= acc < powers[precision - scale + frac_len]
+    units = np.where(valid, acc, 0) * powers[scale - frac_len]
+    units = np.where(negative, -units, units)
+    if longest > precision + 2:  # e.g. padded with leading zeros
+        for i, value in enumerate(values):
+            if len(value) > precision + 2:
+                parsed, err = parse_amount(value, scale, precision)
+                if err is None:
+                    units[i], valid[i] = parsed, True
+    return units, valid
+
+class ColumnBatch:
+    """
+    A batch of claim rows seen column by column. Each column is stripped and
+    converted to a NumPy array on first use, so rules and totals that need the
+    same column share one conversion.
+    """
 
-    if not files:
-        msg = f"No files found in folder: {folder_path}"
-        logger.info(msg)
-        print(msg)
-        return
+    def __init__(self, rows, schema=CLAIM_SCHEMA):
+        self.rows = rows
+        self._fields = {field["name"]: (i, field) for i, field in enumerate(schema)}
+        self._raw = {}
+        self._typed = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def nbytes(self):
+        """Bytes held by the converted columns. Stripped values mostly share the rows' strings."""
+        return (sum(sys.getsizeof(values) for values in self._raw.values())
+                + sum(out.nbytes + valid.nbytes for out, valid in self._typed.values()))
+
+    def raw(self, name):
+        values = self._raw.get(name)
+        if values is None:
+            index = self._fields[name][0]
+            values = self._raw[name] = [row[index].strip() for row in self.rows]
+        return values
+
+    def typed(self, name):
+        """Returns (values, valid): datetime64 dates, int64 amount units or floats."""
+        typed = self._typed.get(name)
+        if typed is None:
+            typed = self._typed[name] = self._convert(self.raw(name), self._fields[name][1])
+        return typed
+
+    @staticmethod
+    def _convert(values, field):
+        import numpy as np
+        ftype = field.get("type")
+        if ftype == "amount":
+            return parse_amounts(values, field.get("scale", AMOUNT_SCALE), field.get("precision", AMOUNT_PRECISION))
+        if ftype == "date":
+            # numpy also accepts partial dates like 2024-01, so it only parses batches of
+            # full YYYY-MM-DD values; anything else is parsed like is_valid_date does.
+            out = None
+            if all(len(value) in (0, 10) for value in values):
+                try:
+                    out = np.array(values, dtype="datetime64[D]")
+                except ValueError:
+                    pass
+            if out is None:
+                out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+                for i, value in enumerate(values):
+                    try:
+                        out[i] = np.datetime64(datetime.strptime(value, "%Y-%m-%d").date(), "D")
+                    except ValueError:
+                        pass
+            return out, ~np.isnat(out)
+        try:
+            out = np.array(values, dtype=float)
+        except ValueError:
+            out = np.full(len(values), np.nan)
+            for i, value in enumerate(values):
+                try:
+                    out[i] = float(value)
+                except ValueError:
+                    pass
+        return out, ~np.isnan(out)
+
+class CrossFieldRules:
+    """
+    Evaluates cross-field rules (see CLAIM_RULES) column-wise over a batch of rows:
+    the columns a rule needs are converted to NumPy arrays once per batch (see
+    ColumnBatch) and each rule is a handful of array comparisons.
+    """
 
-    for file_path in files:
-        base_name = os.path.basename(file_path)
-        prev_count = previous_counts.get(base_name) if previous_counts else None
-        process_file(file_path, previous_record_count=prev_count)
+    def __init__(self, rules=CLAIM_RULES, schema=CLAIM_SCHEMA):
+        self.rules = rules
+        self.schema = schema
+        fields = {field["name"]: field for field in schema}
+        names = set()
+        for rule in rules:
+            names.update(rule.get("columns", []))
+            names.update(rule.get("parts", []))
+            if "total" in rule:
+                names.add(rule["total"])
+        unknown = names - fields.keys()
+        if unknown:
+            raise ValueError(f"Rules refer to unknown columns: {sorted(unknown)}")
+        self._scales = {name: fields[name].get("scale", AMOUNT_SCALE) if fields[name].get("type") == "amount" else None
+                        for name in names}
+
+    def check_batch(self, rows):
+        """
+        Returns (row position in rows, column, message) for every rule failure.
+        rows may be a list of rows or a ColumnBatch.
+        """
+        import numpy as np
+        batch = rows if isinstance(rows, ColumnBatch) else ColumnBatch(rows, self.schema)
+        failures = []
+        for rule in self.rules:
+            if rule["check"] == "order":
+                for before, after in zip(rule["columns"], rule["columns"][1:]):
+                    (a, a_valid), (b, b_valid) = batch.typed(before), batch.typed(after)
+                    bad = a_valid & b_valid & ((a >= b) if rule.get("strict") else (a > b))
+                    relation = "after" if rule.get("strict") else "on or after"
+                    raw_before, raw_after = batch.raw(before), batch.raw(after)
+                    for i in np.flatnonzero(bad):
+                        failures.append((int(i), after, f"Rule '{rule['name']}': {after} ({raw_after[i]}) "
+                                                       f"must be {relation} {before} ({raw_before[i]})."))
+            elif rule["check"] == "sum":
+                failures.extend(self._check_sum(rule, batch))
+            else:
+                raise ValueError(f"Unknown rule check: {rule['check']}")
+        return failures
+
+    def _check_sum(self, rule, batch):
+        import numpy as np
+        names = [rule["total"]] + rule["parts"]
+        scales = {self._scales[name] for name in names}
+        # Amount columns of one scale are compared exactly in integer units.
+        scale = scales.pop() if len(scales) == 1 else None
+        exact = scale is not None
+        factor = 10 ** scale if exact else 1
+        total, valid = batch.typed(rule["total"])
+        expected = np.zeros(len(batch), dtype=total.dtype if exact else float)
+        for name in rule["parts"]:
+            part, part_valid = batch.typed(name)
+            expected = expected + part
+            valid = valid & part_valid
+        bad = valid & (np.abs(total - expected) > rule.get("tolerance", 0) * factor)
+        raw_total = batch.raw(rule["total"])
+        failures = []
+        for i in np.flatnonzero(bad):
+            shown = format_amount(expected[i], scale) if exact else f"{expected[i]:.2f}"
+            failures.append((int(i), rule["total"], f"Rule '{rule['name']}': {rule['total']} ({raw_total[i]}) "
+                                                    f"does not equal {' + '.join(rule['parts'])} ({shown})."))
+        return failures
 
 # ==============================
-# Main Processing Block
+# RecordNumber Tracking
 # ==============================
-#!/usr/bin/env python3
-import os
-import csv
-import re
-import logging
-from datetime import datetime
+class RecordNumberSet:
+    """
+    Compact set used to detect duplicate RecordNumber values within a file.
+
+    RecordNumbers are normally close to sequential, so they are kept in a
+    bitmap (one bit per number in the covered range). If the numbers turn out
+    to be too sparse for that, the set switches to sorted runs packed in
+    array('q'). Only values written as plain ASCII digits that fit in 64 bits are
+    stored as numbers; anything else (' 7', '+7', '-7', '٧', '7_0') is kept as written
+    in a plain set, so it never collides with the number int() would make of it.
+    """
+    BITMAP_MIN_BITS = 1 << 16
+    BITS_PER_VALUE = 64  # Bitmap may cover at most this many numbers per stored value
+    BUFFER_LIMIT = 1 << 15
+    INT64_MAX = (1 << 63) - 1
+
+    def __init__(self, expected_count=None):
+        self._base = None
+        self._bitmap = bytearray()
+        self._initial_bytes = max(self.BITMAP_MIN_BITS, expected_count or 0) // 8 + 1
+        self._runs = None
+        self._buffer = set()
+        self._others = set()
+        self._int_count = 0
+
+    def __len__(self):
+        return self._int_count + len(self._others)
+
+    def __contains__(self, value):
+        number = self._as_int(value)
+        if number is None:
+            return (value.strip() if isinstance(value, str) else value) in self._others
+        if self._runs is None:
+            offset = number - self._base if self._base is not None else -1
+            if offset < 0 or offset >= len(self._bitmap) * 8:
+                return False
+            return bool(self._bitmap[offset >> 3] & (1 << (offset & 7)))
+        return number in self._buffer or self._in_runs(number)
+
+    def add(self, value):
+        """Adds a value. Returns False if it was already in the set."""
+        number = self._as_int(value)
+        if number is None:
+            key = value.strip() if isinstance(value, str) else value
+            if key in self._others:
+                return False
+            self._others.add(key)
+            return True
+        if self._runs is None:
+            added = self._bitmap_add(number)
+            if added is not None:
+                return added
+            self._to_runs()
+        return self._runs_add(number)
+
+    def _as_int(self, value):
+        if not (isinstance(value, str) and value.isascii() and value.isdigit()):
+            return None
+        number = int(value)
+        return number if number <= self.INT64_MAX else None
+
+    def _bitmap_add(self, number):
+        if self._base is None:
+            self._base = number
+            self._bitmap = bytearray(self._initial_bytes)
+        offset = number - self._base
+        if offset < 0 or offset >= len(self._bitmap) * 8:
+            if not self._grow_bitmap(number):
+                return None
+            offset = number - self._base
+        mask = 1 << (offset & 7)
+        if self._bitmap[offset >> 3] & mask:
+            return False
+        self._bitmap[offset >> 3] |= mask
+        self._int_count += 1
+        return True
+
+    def _grow_bitmap(self, number):
+        size = len(self._bitmap)
+        low = min(self._base, number)
+        high = max(self._base + size * 8, number + 1)
+        allowed = max(self._initial_bytes * 16, (self._int_count + 1) * self.BITS_PER_VALUE)
+        if high - low > allowed:
+            return False
+        if number < self._base:
+            # Leave headroom below as well so descending files do not prepend byte by byte.
+            extra = max((self._base - number + 7) // 8, min(size, (allowed - (high - low)) // 8))
+            self._bitmap[0:0] = bytes(extra)
+            self._base -= extra * 8
+        else:
+            needed = ((number - self._base) >> 3) + 1
+            new_size = max(needed, min(size * 2, allowed // 8))
+            self._bitmap.extend(bytes(new_size - size))
+        return True
+
+    def _to_runs(self):
+        values = array("q")
+        base = self._base
+        for index, byte in enumerate(self._bitmap):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        values.append(base + index * 8 + bit)
+        self._runs = [values] if values else []
+        self._bitmap = bytearray()
+        self._base = None
+
+    def _in_runs(self, number):
+        for run in self._runs:
+            pos = bisect_left(run, number)
+            if pos < len(run) and run[pos] == number:
+                return True
+        return False
+
+    def _runs_add(self, number):
+        if number in self._buffer or self._in_runs(number):
+            return False
+        self._buffer.add(number)
+        self._int_count += 1
+        if len(self._buffer) >= self.BUFFER_LIMIT:
+            self._flush_buffer()
+        return True
+
+    def _flush_buffer(self):
+        # Keep runs in decreasing size order so there are only O(log n) of them.
+        runs = self._runs
+        runs.append(array("q", sorted(self._buffer)))
+        self._buffer.clear()
+        while len(runs) > 1 and len(runs[-2]) <= 2 * len(runs[-1]):
+            newer = runs.pop()
+            older = runs.pop()
+            runs.append(array("q", heapq.merge(older, newer)))
 
 # ==============================
-# Setup Logging (to file and console)
+# Differential Validation
 # ==============================
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Remove any existing handlers to avoid duplicate messages.
-if logger.hasHandlers():
-    logger.handlers.clear()
-
-# File handler
-fh = logging.FileHandler("smart_parser.log")
-fh.setLevel(logging.INFO)
-fh_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-fh.setFormatter(fh_formatter)
-logger.addHandler(fh)
-
-# Console handler
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-ch_formatter = logging.Formatter("%(levelname)s - %(message)s")
-ch.setFormatter(ch_formatter)
-logger.addHandler(ch)
-
-# Prevent propagation so that messages are not duplicated.
-logger.propagate = False
+# Vendors resend cumulative files that are mostly the same as the day before. With a
+# vendor given, rows are keyed by ClaimID and hashed over every column but RecordNumber
+# (which shifts as rows are added); a row whose hash matches the vendor's previous file
+# is not validated again, only its RecordNumber is. Checks across rows (duplicate
+# RecordNumbers, trailer count, amount totals) still cover every row. The vendor's
+# index is only replaced by files that are accepted, i.e. have no errors (the same
+# rule the folder watcher uses to pick processed/ over quarantine/), so an unchanged
+# row has no errors to inherit.
+#
+# An index file is a JSON header line, a JSON line of the ClaimIDs in slot order, and
+# the digests and amount units as raw 64-bit arrays; it is not a pickle, so writing
+# to DIFF_INDEX_DIR does not let anyone run code in the app.
+DIFF_INDEX_DIR = os.environ.get("DIFF_INDEX_DIR", "row_indexes")
+DIFF_KEY_COLUMN = 2  # ClaimID
+RECORD_NUMBER_COLUMN = 1
+DIFF_LISTED_CLAIMS = 1000  # ClaimIDs listed per change type in the report
+
+def row_digest(row):
+    """64-bit hash of a claim row's content, RecordNumber excluded."""
+    record_number, row[RECORD_NUMBER_COLUMN] = row[RECORD_NUMBER_COLUMN], ""
+    content = "\x1f".join(row).encode("utf-8", "surrogatepass")
+    row[RECORD_NUMBER_COLUMN] = record_number
+    return int.from_bytes(hashlib.blake2b(content, digest_size=8).digest(), "little")
+
+class RowIndex:
+    """
+    The rows of one validated file: ClaimID -> slot, and per slot the row digest and
+    the units of each amount column (0 where invalid).
+    """
+    FORMAT = 1
+
+    def __init__(self, amount_columns, source=None):
+        self.amount_columns = list(amount_columns)
+        self.schema = schema_fingerprint()
+        self.source = source
+        self.id = uuid.uuid4().hex
+        self.slots = {}
+        self.digests = array("Q")
+        self.units = array("q")  # len(amount_columns) values per slot
+
+    def __len__(self):
+        return len(self.digests)
+
+    def units_matrix(self):
+        import numpy as np
+        return np.frombuffer(self.units, dtype=np.int64).reshape(-1, len(self.amount_columns))
+
+    @staticmethod
+    def path(vendor, directory=DIFF_INDEX_DIR):
+        return os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", vendor) + ".idx")
+
+    @classmethod
+    def load(cls, vendor, amount_columns, directory=DIFF_INDEX_DIR):
+        """The vendor's index, or None if there is none usable for the current schema."""
+        try:
+            with open(cls.path(vendor, directory), "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("format") != cls.FORMAT or header.get("byteorder") != sys.byteorder:
+                    raise ValueError("unsupported index format")
+                if header["schema"] != schema_fingerprint() or header["amount_columns"] != list(amount_columns):
+                    logger.info(f"Ignoring row index for vendor {vendor}: the schema changed since it was built")
+                    return None
+                index = cls(header["amount_columns"], header["source"])
+                index.id = header["id"]
+                keys = json.loads(f.readline())
+                index.slots = dict(zip(keys, range(len(keys))))
+                index.digests.fromfile(f, len(keys))
+                index.units.fromfile(f, len(keys) * len(index.amount_columns))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable row index for vendor {vendor}: {str(e)}")
+            return None
+        return index
+
+    def save(self, vendor, directory=DIFF_INDEX_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = self.path(vendor, directory)
+        header = {"format": self.FORMAT, "byteorder": sys.byteorder, "id": self.id, "schema": self.schema,
+                  "amount_columns": self.amount_columns, "source": self.source}
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(json.dumps(list(self.slots)).encode() + b"\n")  # slots are 0..n-1 in insertion order
+            self.digests.tofile(f)
+            self.units.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+class RowDiff:
+    """
+    Matches the rows of the file being validated against the vendor's previous index
+    while building the new one. Amount units of unchanged rows are carried over in
+    one pass at the end; those of validated rows are set by ClaimValidator.check_rules.
+    """
+    UNSEEN = -1
+    MODIFIED = -2
+
+    def __init__(self, vendor, previous, amount_columns, source=None):
+        self.vendor = vendor
+        self.previous = previous
+        self.index = RowIndex(amount_columns, source)
+        self.validated_units = {}  # slot -> amount units, for rows that were validated
+        # Previous slot -> new slot of the unchanged row, or UNSEEN / MODIFIED.
+        self._matched = array("q", repeat(self.UNSEEN, len(previous))) if previous is not None else array("q")
+        self._previous_slots = previous.slots if previous is not None else {}
+        self.counts = {"added": 0, "modified": 0, "unchanged": 0, "not_indexed": 0}
+        self.listed = {"added": [], "modified": []}
+
+    def __getstate__(self):
+        # Pickled by ValidationCheckpoint, which reloads the previous index from disk
+        # (its identity records the index id, so it is the same one).
+        state = self.__dict__.copy()
+        state["previous"] = None
+        state["_previous_slots"] = {}
+        return state
+
+    def reattach(self, previous):
+        """Puts back the previous index after unpickling."""
+        self.previous = previous
+        self._previous_slots = previous.slots if previous is not None else {}
+
+    def match(self, row):
+        """
+        Registers a claim row. Returns (slot, previous_slot): slot is its place in the
+        new index (None for a missing or repeated ClaimID, which is validated but not
+        indexed) and previous_slot is set when the row is unchanged.
+        """
+        key = row[DIFF_KEY_COLUMN].strip()
+        slots = self.index.slots
+        slot = len(slots)
+        if not key or slots.setdefault(key, slot) != slot:
+            self.counts["not_indexed"] += 1
+            return None, None
+        digest = row_digest(row)
+        self.index.digests.append(digest)
+        previous_slot = self._previous_slots.get(key)
+        if previous_slot is None:
+            self._count("added", key)
+            return slot, None
+        if self.previous.digests[previous_slot] != digest:
+            self._matched[previous_slot] = self.MODIFIED
+            self._count("modified", key)
+            return slot, None
+        self._matched[previous_slot] = slot
+        self.counts["unchanged"] += 1
+        return slot, previous_slot
+
+    def _count(self, change, key):
+        self.counts[change] += 1
+        if len(self.listed[change]) < DIFF_LISTED_CLAIMS:
+            self.listed[change].append(key)
+
+    def _inherited(self):
+        """(previous slots, new slots) of the unchanged rows."""
+        import numpy as np
+        matched = np.frombuffer(self._matched, dtype=np.int64)
+        previous_slots = np.flatnonzero(matched >= 0)
+        return previous_slots, matched[previous_slots]
+
+    def inherited_totals(self):
+        """Per amount column, the summed units of the unchanged rows."""
+        if self.previous is None or not self.counts["unchanged"]:
+            return [0] * len(self.index.amount_columns)
+        previous_slots, _ = self._inherited()
+        return [int(total) for total in self.previous.units_matrix()[previous_slots].sum(axis=0)]
+
+    def finish(self, accepted):
+        """
+        Returns the change report. If the file was accepted, its completed index
+        replaces the vendor's, so the next file is diffed against this one.
+        """
+        if accepted:
+            self._save_index()
+        return {**self.report(), "index_updated": accepted}
+
+    def _save_index(self):
+        import numpy as np
+        index = self.index
+        units = np.zeros((len(index), len(index.amount_columns)), dtype=np.int64)
+        if self.previous is not None and self.counts["unchanged"]:
+            previous_slots, slots = self._inherited()
+            units[slots] = self.previous.units_matrix()[previous_slots]
+        for slot, row_units in self.validated_units.items():
+            units[slot] = row_units
+        index.units = array("q", units.tobytes())
+        index.save(self.vendor)
+
+    def report(self):
+        removed = []
+        removed_count = 0
+        if self.previous is not None:
+            matched = self._matched
+            for key, slot in self.previous.slots.items():
+                if matched[slot] == self.UNSEEN:
+                    removed_count += 1
+                    if len(removed) < DIFF_LISTED_CLAIMS:
+                        removed.append(key)
+        counts = self.counts
+        revalidated = counts["added"] + counts["modified"] + counts["not_indexed"]
+        total = revalidated + counts["unchanged"]
+        return {"vendor": self.vendor,
+                "previous_file": self.previous.source if self.previous is not None else None,
+                "rows_revalidated": revalidated, "rows_inherited": counts["unchanged"],
+                "revalidated_share": round(revalidated / total, 4) if total else 0.0,
+                "added": counts["added"], "modified": counts["modified"], "removed": removed_count,
+                "unchanged": counts["unchanged"], "not_indexed": counts["not_indexed"],
+                "added_claims": self.listed["added"], "modified_claims": self.listed["modified"],
+                "removed_claims": removed}
 
 # ==============================
-# Schema Definitions
+# File Processing Functions
 # ==============================
-HEADER_SCHEMA = [
-    {"name": "RecordID", "required": True, "expected": "HDR", "max_length": 3, "type": "text"},
-    {"name": "Creation Date", "required": True, "format": "date", "max_length": 10, "type": "date"}
-]
+PROGRESS_STEP = 5  # Percent of the file between progress log lines
+READ_CHUNK_SIZE = 1024 * 1024
 
-ALLOWED_STATES = [
-    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA",
-    "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD",
-    "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ",
-    "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC",
-    "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"
-]
+class ClaimValidator:
+    """
+    Validation engine shared by every input path.
+
+    Rows can be pushed one at a time with feed_row(), or raw bytes with feed().
+    The last row is held back until finish() so a trailing TRL row can be told
+    apart from a claim. Callers that already know the trailer (memory-mapped
+    files) use validate_header/read_trailer/validate_claim/close_trailer directly.
+    If a ResultStore is given, the run and each distinct error are recorded in it,
+    under run_id if one was reserved in advance. With summary=True errors are only
+    aggregated in an ErrorSummary instead of being collected, and the result carries
+    the summary in place of the error list. With a RowDiff, unchanged claim rows
+    inherit their errors from the vendor's previous file instead of being validated.
+    """
 
-CLAIM_SCHEMA = [
-    {"name": "RecordID", "required": True, "expected": "CLM", "max_length": 3, "type": "text"},
-    {"name": "RecordNumber", "required": True, "type": "integer", "unique": True},
-    {"name": "ClaimID", "required": True, "type": "text", "pattern": r"^[A-Z]{2}-\d{4}-\d{1,8}$", "max_length": 50},
-    {"name": "OriginalClaim", "required": False, "type": "text", "max_length": 50},
-    {"name": "Group_ID", "required": True, "type": "text", "max_length": 50},
-    {"name": "Payer Contact Name", "required": False, "type": "text", "max_length": 10},
-    {"name": "Payer Contact Phone", "required": False, "type": "text", "pattern": r"^\d{3}-\d{3}-\d{4}$", "max_length": 12},
-    {"name": "Employee_ID", "required": False, "type": "text", "max_length": 50},
-    {"name": "SSN", "required": True, "type": "text", "pattern": r"^\d{3}-\d{2}-\d{4}$", "max_length": 11},
-    {"name": "Patient_ID", "required": True, "type": "text", "max_length": 30},
-    {"name": "Patient_Last_Name", "required": True, "type": "text", "max_length": 50},
-    {"name": "Patient_First_Name", "required": True, "type": "text", "max_length": 50},
-    {"name": "Address1", "required": False, "type": "text", "max_length": 35},
-    {"name": "Address2", "required": False, "type": "text", "max_length": 35},
-    {"name": "City", "required": False, "type": "text", "max_length": 30},
-    {"name": "State", "required": False, "type": "text", "max_length": 2, "allowed": ALLOWED_STATES},
-    {"name": "ZipCode", "required": False, "type": "integer"},
-    {"name": "Relationship", "required": True, "type": "integer", "allowed": [1, 2, 3]},
-    {"name": "DoB", "required": True, "type": "date", "max_length": 10},
-    {"name": "Prescriber_Name", "required": False, "type": "text", "max_length": 50},
-    {"name": "Pharmacy_Name", "required": True, "type": "text", "max_length": 50},
-    {"name": "Pharmacy_Type", "required": False, "type": "text", "max_length": 1, "allowed": ["R", "M", "H", "C"]},
-    {"name": "Date_of_Service", "required": True, "type": "date", "max_length": 10},
-    {"name": "Prescription_No", "required": False, "type": "text", "max_length": 50},
-    {"name": "Prescription_Filled_Date", "required": True, "type": "date", "max_length": 10},
-    {"name": "In_Out_Network", "required": False, "type": "text", "max_length": 1, "allowed": ["I", "O"]},
-    {"name": "National Drug Code", "required": True, "type": "text", "max_length": 50},
-    {"name": "Label_Name", "required": True, "type": "text", "max_length": 50},
-    {"name": "Brand_Generic", "required": True, "type": "text", "max_length": 1, "allowed": ["B", "G"]},
-    {"name": "Drug_Strength", "required": True, "type": "text", "max_length": 20},
-    {"name": "Days_Supply", "required": True, "type": "integer"},
-    {"name": "Quantity", "required": True, "type": "integer"},
-    {"name": "Dosage Form", "required": False, "type": "text", "max_length": 20},
-    {"name": "Formulary", "required": True, "type": "text", "max_length": 1, "allowed": ["Y", "N"]},
-    {"name": "Total_Billed_Amount", "required": True, "type": "decimal", "min": 0},
-    {"name": "Plan_Paid_Amount", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Copay_Coins", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Deductible", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Other_Cost", "required": True, "type": "decimal", "min": 0},
-    {"name": "Member_Total_Paid_Amount", "required": True, "type": "decimal", "min": 0},
-    {"name": "Paid_Date", "required": True, "type": "date", "max_length": 10},
-    {"name": "Status", "required": False, "type": "text", "max_length": 1, "allowed": ["A", "D", "R"]}
-]
+    def __init__(self, description, previous_record_count=None, expected_count=None, store=None, run_id=None,
+                 summary=False, diff=None):
+        # description reads like "file <path>" or "uploaded file <name>".
+        self.description = description
+        self.recorder = store.recorder(description, run_id) if store is not None else None
+        self.summary = ErrorSummary(seed=SUMMARY_SEED) if summary else None
+        self.previous_record_count = previous_record_count
+        self.file_errors = set()
+        self.checkpoint_errors = None  # messages added since the last checkpoint, once one was saved
+        self.unique_record_numbers = RecordNumberSet(expected_count)
+        self.claim_count = 0
+        self.row_count = 0
+        self.expected_count = None
+        self._trailer_errors = None
+        self._pending = None
+        self._parser = None
+        self._skip_rows = 0  # rows a resumed stream has already validated (see ValidationCheckpoint)
+        # Amount columns are parsed and validated a batch at a time in check_rules().
+        self.amount_fields = [field for field in CLAIM_SCHEMA if field.get("type") == "amount"]
+        self.field_cache = SchemaValidationCache(CLAIM_SCHEMA, columnwise=[field["name"] for field in self.amount_fields])
+        self.rules = CrossFieldRules()
+        self._rule_batch = []
+        self._rule_rows = []
+        self._rule_slots = []  # RowIndex slot of each batched row, in differential mode
+        self.diff = diff
+        self.memory = JobMemory()
+        self._rule_batch_sizes = AdaptiveBatch(self.memory, "rule_batch", RULE_BATCH_MIN, RULE_BATCH_SIZE,
+                                               RULE_BATCH_SHARE)
+        self._rule_batch_size = RULE_BATCH_MIN
+        # Exact sums of the amount columns in integer units, over rows where the value parses.
+        self.amount_totals = {field["name"]: 0 for field in self.amount_fields}
+
+    def __getstate__(self):
+        # Pickled by ValidationCheckpoint. The store connection and the incremental
+        # parser (decompressor state) are not picklable and are rebuilt on resume.
+        state = self.__dict__.copy()
+        state["recorder"] = None
+        state["_parser"] = None
+        return state
+
+    @property
+    def title(self):
+        return self.description[:1].upper() + self.description[1:]
+
+    @property
+    def error_count(self):
+        return self.summary.total if self.summary is not None else len(self.file_errors)
+
+    def add_error(self, err, row=None, column=None, echo=True):
+        if self.summary is not None:
+            self.summary.add(row, column, err)
+        else:
+            if echo:
+                print(err)
+            if err in self.file_errors:
+                return
+            self.file_errors.add(err)
+            if self.checkpoint_errors is not None:
+                self.checkpoint_errors.append(err)
+        if self.recorder is not None:
+            self.recorder(row, column, err)
+
+    # ---- push interface ----
+    def feed(self, data):
+        """Feeds a chunk of raw (optionally gzip/bz2/zip compressed) bytes."""
+        if self._parser is None:
+            self._parser = IncrementalRowParser()
+        for row in self._unskipped(self._parser.feed(data)):
+            self.feed_row(row)
+
+    def _unskipped(self, rows):
+        if not self._skip_rows:
+            return rows
+        rows = list(rows)
+        skipped = min(self._skip_rows, len(rows))
+        self._skip_rows -= skipped
+        return rows[skipped:]
+
+    def feed_row(self, row):
+        self.row_count += 1
+        if self.row_count == 1:
+            if self.validate_header(row):
+                return
+        elif self._pending is not None:
+            self.validate_claim(self._pending, self.row_count - 1)
+        self._pending = row
+
+    def finish(self):
+        """Completes validation and returns the result dict."""
+        if self._parser is not None:
+            for row in self._unskipped(self._parser.close()):
+                self.feed_row(row)
+            self._parser = None
+        if self.row_count == 0:
+            return None
+
+        pending, self._pending = self._pending, None
+        has_trailer = bool(pending) and pending[0].strip() == "TRL"
+        if has_trailer:
+            self.read_trailer(pending)
+            self.close_trailer(self.row_count)
+        else:
+            if pending is not None:
+                self.validate_claim(pending, self.row_count)
+            self.warn_no_trailer()
+        return self.report()
+
+    # ---- row level checks ----
+    def validate_header(self, header_row):
+        """Validates the first row if it is a header. Returns True when it was one."""
+        has_header = (header_row[0].strip() == "HDR") if header_row else False
+        if has_header:
+            header_errors = []
+            for column, err in row_field_errors(header_row, HEADER_SCHEMA):
+                header_errors.append(format_row_error(1, column, err))
+                self.add_error(header_errors[-1], 1, column, echo=False)
+            if header_errors:
+                logger.error(f"Header errors in {self.description}: {header_errors}")
+                print("Header errors:")
+                for err in header_errors:
+                    print(err)
+        else:
+            warning_msg = f"{self.title} does not have a header row. Treating all rows as claim records."
+            logger.warning(warning_msg)
+            print("Warning: No header row found. Treating all rows as claim records.")
+        return has_header
 
-TRAILER_SCHEMA = [
-    {"name": "RecordID", "required": True, "expected": "TRL", "max_length": 3, "type": "text"},
-    {"name": "Record Count", "required": True, "type": "integer"}
-]
+    def warn_no_trailer(self):
+        warning_msg = f"{self.title} does not have a trailer row. Treating all rows as claim records."
+        logger.warning(warning_msg)
+        print("Warning: No trailer row found. Treating all rows as claim records.")
 
-EXPECTED_HEADER_FIELDS = len(HEADER_SCHEMA)
-EXPECTED_CLAIM_FIELDS = 42
-EXPECTED_TRAILER_FIELDS = len(TRAILER_SCHEMA)
+    def read_trailer(self, trailer_row):
+        """
+        Validates the trailer fields and reads its Record Count. Row numbers are only
+        attached in close_trailer(), so this can run before the claim rows are read.
+        """
+        self._trailer_errors = row_field_errors(trailer_row, TRAILER_SCHEMA)
+        if self._trailer_errors:
+            trailer_messages = [f"Column '{column}': {err}" if column else err for column, err in self._trailer_errors]
+            logger.error(f"Trailer errors in {self.description}: {trailer_messages}")
+            print("Trailer errors:")
+            for err in trailer_messages:
+                print(err)
+        try:
+            self.expected_count = int(trailer_row[1].strip())
+        except Exception as e:
+            self.add_error(f"Error parsing trailer Record Count: {e}")
+        return self.expected_count
+
+    def close_trailer(self, row_number):
+        for column, err in self._trailer_errors or []:
+            self.add_error(format_row_error(row_number, column, err), row_number, column, echo=False)
+        if self.expected_count is not None and self.expected_count != self.claim_count:
+            self.add_error(f"Trailer count {self.expected_count} does not match actual claim count {self.claim_count}.")
+
+    def validate_claim(self, row, idx):
+        if isinstance(row, UnparsableRecord):
+            self.add_error(f"Row {idx}: Could not be parsed: {row.error}.", idx)
+            self.claim_count += 1
+            return
+        if len(row) != EXPECTED_CLAIM_FIELDS:
+            self.add_error(f"Row {idx}: Expected {EXPECTED_CLAIM_FIELDS} columns, found {len(row)}.", idx)
+            return
+        if self.diff is None:
+            for column, err in row_field_errors(row, CLAIM_SCHEMA, self.field_cache):
+                self.add_error(format_row_error(idx, column, err), idx, column)
+            self._rule_batch.append(row)
+            self._rule_rows.append(idx)
+            if len(self._rule_batch) >= self._rule_batch_size:
+                self.check_rules()
+        else:
+            self._validate_claim_differential(row, idx)
+        record_number = row[1].strip()
+        if not self.unique_record_numbers.add(record_number):
+            self.add_error(f"Row {idx}: Duplicate RecordNumber {record_number}.", idx, "RecordNumber")
+        self.claim_count += 1
+
+    def _validate_claim_differential(self, row, idx):
+        slot, previous_slot = self.diff.match(row)
+        if previous_slot is not None:
+            # RecordNumber is not part of the row digest, so it is always validated.
+            for err in self.field_cache.fields[RECORD_NUMBER_COLUMN].validate(row[RECORD_NUMBER_COLUMN].strip()):
+                self.add_error(format_row_error(idx, "RecordNumber", err), idx, "RecordNumber")
+            return
+        for column, err in row_field_errors(row, CLAIM_SCHEMA, self.field_cache):
+            self.add_error(format_row_error(idx, column, err), idx, column)
+        self._rule_batch.append(row)
+        self._rule_rows.append(idx)
+        self._rule_slots.append(slot)
+        if len(self._rule_batch) >= self._rule_batch_size:
+            self.check_rules()
+
+    def check_rules(self):
+        """
+        Validates the amount columns, adds them to amount_totals and runs the
+        cross-field rules, over the claim rows batched since the last call, then
+        sizes the next batch from the memory this one held.
+        """
+        if not self._rule_batch:
+            return
+        import numpy as np
+        batch = ColumnBatch(self._rule_batch)
+        slots = self._rule_slots if self.diff is not None else None
+        for column_number, field in enumerate(self.amount_fields):
+            name = field["name"]
+            units, valid = batch.typed(name)
+            # Only cells that fail are run through validate_field, for its messages.
+            failed = ~valid
+            if "min" in field:
+                failed |= valid & (units < round(field["min"] * 10 ** field.get("scale", AMOUNT_SCALE)))
+            raw = batch.raw(name)
+            for position in np.flatnonzero(failed):
+                idx = self._rule_rows[position]
+                for err in validate_field(field, raw[position]):
+                    self.add_error(format_row_error(idx, name, err), idx, name)
+            self.amount_totals[name] += int(units[valid].sum())
+            if slots:
+                self._index_units(slots, column_number, np.where(valid, units, 0).tolist())
+        for position, column, err in self.rules.check_batch(batch):
+            idx = self._rule_rows[position]
+            self.add_error(format_row_error(idx, column, err), idx, column)
+        held = estimate_size(self._rule_batch, row_size) + batch.nbytes()
+        self._rule_batch_size = self._rule_batch_sizes.resize(len(batch), held)
+        self._rule_batch = []
+        self._rule_rows = []
+        self._rule_slots = []
+
+    def _index_units(self, slots, column_number, units):
+        validated_units = self.diff.validated_units
+        for slot, value in zip(slots, units):
+            if slot is not None:
+                validated_units.setdefault(slot, [0] * len(self.amount_fields))[column_number] = value
+
+    # ---- result ----
+    def formatted_amount_totals(self):
+        """amount_totals as decimal strings, so JSON clients do not round them through float."""
+        scales = {field["name"]: field.get("scale", AMOUNT_SCALE) for field in CLAIM_SCHEMA}
+        return {name: format_amount(units, scales[name]) for name, units in self.amount_totals.items()}
+
+    def report(self):
+        self.check_rules()
+        if self.diff is not None:
+            for field, units in zip(self.amount_fields, self.diff.inherited_totals()):
+                self.amount_totals[field["name"]] += units
+        claim_count = self.claim_count
+        previous_record_count = self.previous_record_count
+        if previous_record_count is not None:
+            if previous_record_count > 0 and abs(claim_count - previous_record_count) / previous_record_count > 0.5:
+                warn_msg = f"Warning: Claim count {claim_count} differs by more than 50% from previous count {previous_record_count}."
+                logger.warning(warn_msg)
+                print(warn_msg)
+
+        if self.summary is not None:
+            return self._summary_report(claim_count)
+
+        error_count = len(self.file_errors)
+        sorted_errors = sorted(self.file_errors)
+        if error_count > 0:
+            logger.error(f"Errors found in {self.description}:")
+            for err in sorted_errors:
+                logger.error(err)
+            summary_msg = f"Finished processing {self.description} with {error_count} error(s) and {claim_count} claim record(s)."
+            logger.error(summary_msg)
+            print(f"\n{summary_msg}")
+            print("Error details:")
+            for err in sorted_errors:
+                print(f" - {err}")
+        else:
+            summary_msg = f"{self.title} processed successfully with {claim_count} claim record(s) and no errors."
+            logger.info(summary_msg)
+            print(summary_msg)
+            logger.info("Total errors: 0")
+            print("Total errors: 0")
+        cache_stats = self.field_cache.stats()
+        logger.info(f"Validation cache hit rate for {self.description}: {cache_stats['hit_rate']:.1%}")
+        result = {"file": self.description, "claim_count": claim_count, "error_count": error_count,
+                  "errors": sorted_errors, "amount_totals": self.formatted_amount_totals(), "cache_stats": cache_stats}
+        if self.diff is not None:
+            result["differential"] = self.diff.finish(accepted=error_count == 0)
+        result["memory"] = self.memory_report()
+        if self.recorder is not None:
+            self.recorder.finish(claim_count, error_count)
+            result["run_id"] = self.recorder.run_id
+        return result
+
+    def memory_report(self):
+        if self.summary is None:
+            self.memory.hold("errors", estimate_size(self.file_errors))
+        return self.memory.report()
+
+    def _summary_report(self, claim_count):
+        error_count = self.summary.total
+        summary = self.summary.report()
+        if error_count > 0:
+            summary_msg = f"Finished processing {self.description} with {error_count} error(s) and {claim_count} claim record(s)."
+            logger.error(summary_msg)
+            logger.error(f"Errors per column in {self.description}: {summary['by_column']}")
+            print(f"\n{summary_msg}")
+            for entry in summary["top_errors"]:
+                print(f" - {entry['column']} / {entry['code']}: {entry['count']}")
+        else:
+            summary_msg = f"{self.title} processed successfully with {claim_count} claim record(s) and no errors."
+            logger.info(summary_msg)
+            print(summary_msg)
+        result = {"file": self.description, "claim_count": claim_count, "error_count": error_count,
+                  "summary": summary, "amount_totals": self.formatted_amount_totals(),
+                  "cache_stats": self.field_cache.stats()}
+        if self.diff is not None:
+            result["differential"] = self.diff.finish(accepted=error_count == 0)
+        result["memory"] = self.memory_report()
+        if self.recorder is not None:
+            self.recorder.finish(claim_count, error_count)
+            result["run_id"] = self.recorder.run_id
+        return result
 
 # ==============================
-# Validation Functions
+# Checkpoint and Resume
 # ==============================
-def is_valid_date(value):
-    try:
-        datetime.strptime(value, "%Y-%m-%d")
-        return True, None
-    except ValueError:
-        return False, f"Invalid date format (expected YYYY-MM-DD): {value}"
-
-def is_valid_integer(value):
-    try:
-        int(value)
-        return True, None
-    except ValueError:
-        return False, f"Not a valid integer: {value}"
-
-def is_valid_decimal(value):
-    try:
-        float(value)
-        return True, None
-    except ValueError:
-        return False, f"Not a valid decimal: {value}"
-
-def check_length(value, max_length):
-    if len(value) > max_length:
-        return False, f"Length {len(value)} exceeds max length {max_length}"
-    return True, None
-
-def check_pattern(value, pattern):
-    if not re.match(pattern, value):
-        return False, f"Value '{value}' does not match pattern: {pattern}"
-    return True, None
-
-def check_allowed(value, allowed_list):
-    if value not in allowed_list:
-        return False, f"Value '{value}' is not in allowed list: {allowed_list}"
-    return True, None
-
-def validate_field(field_schema, value):
-    errors = []
-    if field_schema.get("required", False) and (value is None or value == ""):
-        errors.append(f"Field '{field_schema['name']}' is required but missing.")
-        return errors
-
-    if value == "":
-        return errors
-
-    if "expected" in field_schema:
-        if value != field_schema["expected"]:
-            errors.append(f"Expected '{field_schema['expected']}' but got '{value}'.")
-
-    if "max_length" in field_schema:
-        valid, err = check_length(value, field_schema["max_length"])
-        if not valid:
-            errors.append(err)
+# A long validation of a file on disk pickles the ClaimValidator, with its
+# position in the file, every CHECKPOINT_INTERVAL seconds. A run restarted on the
+# same, unchanged file with the same schema, summary mode and vendor picks up from
+# there and produces the same report as an uninterrupted run. The checkpoint is
+# removed when the run ends. The pickle leaves out what can be had elsewhere: the
+# distinct error messages are appended to a .errors file next to it, and the
+# vendor's previous RowIndex is reloaded from DIFF_INDEX_DIR (the checkpoint is
+# ignored if that index has been replaced since). A run holds an exclusive lock on
+# its checkpoint; a second run of the same file meanwhile validates without one.
+# Checkpoints are only ever read back from CHECKPOINT_DIR, which must not be
+# writable by anyone who should not run code as this service.
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", "checkpoints")
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", 60))
+CHECKPOINT_CHECK_ROWS = 4096  # rows between clock checks on the memory-mapped path
+
+def schema_fingerprint():
+    """Changes whenever the schemas or rules do, so a deploy that changes them starts runs afresh."""
+    text = repr((HEADER_SCHEMA, CLAIM_SCHEMA, TRAILER_SCHEMA, CLAIM_RULES, EXPECTED_CLAIM_FIELDS))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class ValidationCheckpoint:
+    """
+    Checkpoint file for one validation of file_path. save() pickles the validator
+    and a position (whatever the caller needs to continue) and atomically replaces
+    the previous checkpoint; load() returns them if they belong to this file as it
+    is now, re-attaching the run's recorder after dropping errors stored past the
+    checkpoint. acquire() must succeed before either is used.
+    """
 
-    ftype = field_schema.get("type")
-    converted_value = value
-    if ftype == "integer":
-        valid, err = is_valid_integer(value)
-        if not valid:
-            errors.append(err)
-        else:
+    def __init__(self, file_path, summary=False, vendor=None, row_index=None, directory=CHECKPOINT_DIR,
+                 interval=CHECKPOINT_INTERVAL):
+        # row_index is the id of the vendor's RowIndex the run is diffed against, if any.
+        file_path = os.path.abspath(file_path)
+        st = os.stat(file_path)
+        self.identity = {"path": file_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                         "summary": summary, "vendor": vendor, "row_index": row_index, "schema": schema_fingerprint()}
+        key = json.dumps([file_path, summary, vendor])
+        self.path = os.path.join(directory, hashlib.sha1(key.encode("utf-8", "surrogatepass")).hexdigest() + ".ckpt")
+        self.errors_path = f"{self.path}.errors"
+        self.interval = interval
+        self._due = time.monotonic() + interval
+        self._errors_size = None  # size of the .errors file once this run has written or resumed it
+        self._lock_file = None
+
+    def acquire(self):
+        """Takes the checkpoint for this run. False if another run of the same file holds it."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock_file = open(f"{self.path}.lock", "a")
+        if fcntl is not None:
             try:
-                converted_value = int(value)
-            except Exception as e:
-                errors.append(f"Conversion to integer failed: {e}")
-    elif ftype == "decimal":
-        valid, err = is_valid_decimal(value)
-        if not valid:
-            errors.append(err)
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.release()
+                return False
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # drops the flock
+            self._lock_file = None
+
+    def due(self):
+        return time.monotonic() >= self._due
+
+    def _save_errors(self, validator):
+        """Appends the messages added since the last save to the .errors file; returns its size."""
+        if self._errors_size is None:
+            mode, messages = "wb", sorted(validator.file_errors)
         else:
+            mode, messages = "ab", validator.checkpoint_errors
+        with open(self.errors_path, mode) as f:
+            for message in messages:
+                f.write(json.dumps(message).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self._errors_size = f.tell()
+        validator.checkpoint_errors = []
+        return self._errors_size
+
+    def save(self, validator, position):
+        recorder = validator.recorder
+        if recorder is not None:
+            recorder.flush()
+        state = {"identity": self.identity, "position": position, "errors_size": self._save_errors(validator),
+                 "run_id": recorder.run_id if recorder is not None else None,
+                 "last_error_id": recorder.store.last_error_id(recorder.run_id) if recorder is not None else None}
+        tmp_path = f"{self.path}.tmp"
+        errors, validator.file_errors = validator.file_errors, set()
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump({**state, "validator": validator}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            validator.file_errors = errors
+        os.replace(tmp_path, self.path)
+        self._due = time.monotonic() + self.interval
+        logger.info(f"Checkpointed {validator.description} at {position}")
+
+    def _read(self):
+        """The last checkpoint state of this file as it is now, or None."""
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {str(e)}")
+            return None
+        if state.get("identity") != self.identity:
+            logger.info(f"Ignoring checkpoint {self.path}: the file, schema or row index changed since it was written")
+            return None
+        try:
+            complete = os.path.getsize(self.errors_path) >= state["errors_size"]
+        except OSError:
+            complete = False
+        if not complete:
+            logger.warning(f"Ignoring checkpoint {self.path}: its error file is missing or truncated")
+            return None
+        return state
+
+    def _load_errors(self, size):
+        """The messages in the first size bytes of the .errors file; drops anything written after."""
+        with open(self.errors_path, "r+b") as f:
+            f.truncate(size)
+            messages = {json.loads(line) for line in f}
+        self._errors_size = size
+        return messages
+
+    def resumable_run_id(self):
+        """The run_id a validation resuming from this checkpoint continues, or None."""
+        state = self._read()
+        return state["run_id"] if state is not None else None
+
+    def load(self, store=None, run_id=None, diff=None):
+        """
+        Returns (validator, position) from the last checkpoint of this file, or None.
+        A checkpoint saved without a run is resumed into a new run under run_id. diff
+        is the RowDiff a fresh run would use, whose previous index is put back into
+        the resumed one.
+        """
+        state = self._read()
+        if state is None:
+            return None
+        validator = state["validator"]
+        if validator.diff is not None:
+            validator.diff.reattach(diff.previous)
+        validator.file_errors = self._load_errors(state["errors_size"])
+        validator.checkpoint_errors = []
+        if store is not None and state["run_id"] is not None:
+            store.discard_errors_after(state["run_id"], state["last_error_id"])
+            validator.recorder = store.recorder(validator.description, state["run_id"], resume=True)
+        elif store is not None:
+            validator.recorder = store.recorder(validator.description, run_id)
+        logger.info(f"Resuming {validator.description} from checkpoint at {state['position']}")
+        return validator, state["position"]
+
+    def discard(self):
+        for path in (self.path, f"{self.path}.tmp", self.errors_path):
             try:
-                converted_value = float(value)
-            except Exception as e:
-                errors.append(f"Conversion to decimal failed: {e}")
-
-    if "allowed" in field_schema:
-        allowed_list = field_schema["allowed"]
-        if ftype in ["integer", "decimal"]:
-            if converted_value not in allowed_list:
-                errors.append(f"Value '{value}' is not in allowed list: {allowed_list}")
-        else:
-            valid, err = check_allowed(value, allowed_list)
-            if not valid:
-                errors.append(err)
-
-    if "pattern" in field_schema and ftype not in ["integer", "decimal"]:
-        valid, err = check_pattern(value, field_schema["pattern"])
-        if not valid:
-            errors.append(err)
-
-    if ftype == "date":
-        valid, err = is_valid_date(value)
-        if not valid:
-            errors.append(err)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
-    if ftype in ["integer", "decimal"] and "min" in field_schema:
-        if converted_value < field_schema["min"]:
-            errors.append(f"Value {value} is less than minimum {field_schema['min']}.")
-
-    return errors
-
-def validate_row(row, schema, row_number):
-    errors = []
-    if len(row) != len(schema):
-        errors.append(f"Row {row_number}: Expected {len(schema)} columns, found {len(row)} columns.")
-        return errors
-    for idx, field_schema in enumerate(schema):
-        field_value = row[idx].strip()
-        field_errors = validate_field(field_schema, field_value)
-        if field_errors:
-            for err in field_errors:
-                errors.append(f"Row {row_number}, Column '{field_schema['name']}': {err}")
-    return errors
-
-# ==============================
-# File Processing Functions
-# ==============================
-def process_file(file_path, previous_record_count=None):
+def process_file(file_path, previous_record_count=None, store=None, run_id=None, summary=False, checkpoint=True,
+                 vendor=None):
+    """
+    Validates a claim file on disk. Returns the report, None for an empty or missing
+    file, or {"file", "error"} if the file could not be read.
+
+    Uncompressed files are memory-mapped: the trailer is read from the end of the
+    file and validated first, so its Record Count is known before the claim rows are
+    scanned and can be used to pre-size duplicate tracking and report progress.
+    Compressed files are decompressed as a stream instead. Pass a ResultStore to
+    record the run and its errors for later querying, and summary=True to get
+    aggregate counts and examples instead of every error message. Unless checkpoint
+    is False, progress is checkpointed periodically and an interrupted run of the
+    same file resumes from its last checkpoint (under its original run_id). With a
+    vendor, only rows that are new or changed since that vendor's previous file are
+    validated (see RowDiff) and the result says which rows were added, modified and
+    removed.
+    """
     logger.info(f"Processing file: {file_path}")
     print(f"\nProcessing file: {file_path}")
 
@@ -722,239 +1601,190 @@ def process_file(file_path, previous_record_count=None):
         print(err_msg)
         return
 
-    file_errors = set()
-    unique_record_numbers = set()
-    claim_count = 0
-
+    description = f"file {file_path}"
+    use_checkpoint, checkpoint = checkpoint, None
     try:
-        with open(file_path, newline="", encoding="utf-8") as csvfile:
-            reader = csv.reader(csvfile)
-            rows = list(reader)
+        diff = None
+        if vendor:
+            amount_columns = [field["name"] for field in CLAIM_SCHEMA if field.get("type") == "amount"]
+            diff = RowDiff(vendor, RowIndex.load(vendor, amount_columns), amount_columns, description)
+        if use_checkpoint:
+            row_index = diff.previous.id if diff is not None and diff.previous is not None else None
+            checkpoint = ValidationCheckpoint(file_path, summary, vendor, row_index)
+            if not checkpoint.acquire():
+                logger.info(f"Another run of {description} holds its checkpoint; validating without one")
+                checkpoint = None
+        claim_file = MappedClaimFile.open(file_path)
+        if claim_file is None:
+            with open(file_path, "rb") as stream:
+                result = validate_stream(stream, description, previous_record_count, store=store, run_id=run_id,
+                                         summary=summary, checkpoint=checkpoint, diff=diff)
+        else:
+            with claim_file:
+                result = _validate_mapped_file(claim_file, description, previous_record_count, store, run_id, summary,
+                                               checkpoint, diff)
+        if checkpoint is not None:
+            checkpoint.discard()
     except Exception as e:
         err_msg = f"Error reading file {file_path}: {str(e)}"
         logger.error(err_msg)
         print(err_msg)
-        return
+        return {"file": description, "error": err_msg}
+    finally:
+        if checkpoint is not None:
+            checkpoint.release()
 
-    if not rows:
+    if result is None:
         err_msg = f"File {file_path} is empty."
         logger.error(err_msg)
         print(err_msg)
-        return
-
-    # Detect header and trailer rows.
-    has_header = (rows[0][0].strip() == "HDR") if rows[0] else False
-    has_trailer = (rows[-1][0].strip() == "TRL") if rows[-1] else False
-
-    if has_header:
-        header_row = rows[0]
-        header_errors = validate_row(header_row, HEADER_SCHEMA, row_number=1)
-        if header_errors:
-            file_errors.update(header_errors)
-            logger.error(f"Header errors in {file_path}: {header_errors}")
-            print("Header errors:")
-            for err in header_errors:
-                print(err)
-    else:
-        warning_msg = f"File {file_path} does not have a header row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print("Warning: No header row found. Treating all rows as claim records.")
-
-    if has_trailer:
-        trailer_row = rows[-1]
-        trailer_errors = validate_row(trailer_row, TRAILER_SCHEMA, row_number=len(rows))
-        if trailer_errors:
-            file_errors.update(trailer_errors)
-            logger.error(f"Trailer errors in {file_path}: {trailer_errors}")
-            print("Trailer errors:")
-            for err in trailer_errors:
-                print(err)
+    return result
+
+def _validate_mapped_file(claim_file, description, previous_record_count, store=None, run_id=None, summary=False,
+                          checkpoint=None, diff=None):
+    header_row, header_end = claim_file.first_record()
+    if header_row is None:
+        return None
+    trailer_row, trailer_start = claim_file.last_record()
+
+    has_header = (header_row[0].strip() == "HDR") if header_row else False
+    claims_start = header_end if has_header else 0
+    has_trailer = (trailer_row[0].strip() == "TRL") if trailer_row else False
+    has_trailer = has_trailer and trailer_start >= claims_start
+    claims_stop = trailer_start if has_trailer else claim_file.size
+
+    resumed = checkpoint.load(store, run_id, diff) if checkpoint is not None else None
+    if resumed is not None:
+        validator, position = resumed
+        start, idx, next_progress = position["offset"], position["row"], position["next_progress"]
     else:
-        warning_msg = f"File {file_path} does not have a trailer row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print("Warning: No trailer row found. Treating all rows as claim records.")
-
-    # Determine claim rows.
-    start_idx = 1 if has_header else 0
-    end_idx = -1 if has_trailer else len(rows)
-    claim_rows = rows[start_idx:end_idx]
-
-    for idx, row in enumerate(claim_rows, start=start_idx+1):
-        if len(row) != EXPECTED_CLAIM_FIELDS:
-            err = f"Row {idx}: Expected {EXPECTED_CLAIM_FIELDS} columns, found {len(row)}."
-            file_errors.add(err)
-            print(err)
-            continue
-        errors = validate_row(row, CLAIM_SCHEMA, row_number=idx)
-        for err in errors:
-            file_errors.add(err)
-            print(err)
-        record_number = row[1].strip()
-        if record_number in unique_record_numbers:
-            dup_err = f"Row {idx}: Duplicate RecordNumber {record_number}."
-            file_errors.add(dup_err)
-            print(dup_err)
+        validator = ClaimValidator(description, previous_record_count, store=store, run_id=run_id, summary=summary,
+                                   diff=diff)
+        validator.validate_header(header_row)
+        # Read the trailer before any claim rows.
+        if has_trailer:
+            validator.read_trailer(trailer_row)
+            validator.unique_record_numbers = RecordNumberSet(validator.expected_count)
         else:
-            unique_record_numbers.add(record_number)
-        claim_count += 1
+            validator.warn_no_trailer()
+        start, idx, next_progress = claims_start, 1 if has_header else 0, PROGRESS_STEP
+
+    size = claim_file.size
+    for row, offset in claim_file.rows(start, claims_stop):
+        idx += 1
+        validator.validate_claim(row, idx)
+        if offset * 100 >= next_progress * size:
+            percent = offset * 100 // size
+            expected = validator.expected_count if validator.expected_count is not None else "?"
+            logger.info(f"Progress {description}: {percent}% ({validator.claim_count} of {expected} claim record(s))")
+            next_progress = (percent // PROGRESS_STEP + 1) * PROGRESS_STEP
+        if checkpoint is not None and idx % CHECKPOINT_CHECK_ROWS == 0 and checkpoint.due():
+            checkpoint.save(validator, {"offset": offset, "row": idx, "next_progress": next_progress})
 
     if has_trailer:
-        try:
-            expected_count = int(trailer_row[1].strip())
-            if expected_count != claim_count:
-                err = f"Trailer count {expected_count} does not match actual claim count {claim_count}."
-                file_errors.add(err)
-                print(err)
-        except Exception as e:
-            err = f"Error parsing trailer Record Count: {e}"
-            file_errors.add(err)
-            print(err)
-
-    if previous_record_count is not None:
-        if previous_record_count > 0 and abs(claim_count - previous_record_count) / previous_record_count > 0.5:
-            warn_msg = f"Warning: Claim count {claim_count} differs by more than 50% from previous count {previous_record_count}."
-            logger.warning(warn_msg)
-            print(warn_msg)
-
-    error_count = len(file_errors)
-    if error_count > 0:
-        sorted_errors = sorted(file_errors)
-        logger.error(f"Errors found in file {file_path}:")
-        for err in sorted_errors:
-            logger.error(err)
-        summary_msg = f"Finished processing file {file_path} with {error_count} error(s) and {claim_count} claim record(s)."
-        logger.error(summary_msg)
-        print(f"\n{summary_msg}")
-        print("Error details:")
-        for err in sorted_errors:
-            print(f" - {err}")
+        validator.close_trailer(idx + 1)
+    return validator.report()
+
+def validate_stream(stream, description, previous_record_count=None, tee=None, chunk_size=READ_CHUNK_SIZE,
+                    store=None, run_id=None, summary=False, checkpoint=None, diff=None):
+    """
+    Validates claim data read from any binary stream (a file, a request body, ...).
+    Each chunk is validated as soon as it is read. If tee is given, the raw bytes are
+    also written to it, so the upload can be persisted without reading it back.
+    With a ValidationCheckpoint for a stream that can be read again from the start
+    (a compressed file), progress is checkpointed between chunks; on resume the
+    stream is decompressed and parsed again, but rows already validated are skipped.
+    Returns the result dict, or None if the stream was empty.
+    """
+    resumed = checkpoint.load(store, run_id, diff) if checkpoint is not None else None
+    if resumed is not None:
+        validator, position = resumed
+        validator._skip_rows = position["rows"]
     else:
-        summary_msg = f"File {file_path} processed successfully with {claim_count} claim record(s) and no errors."
-        logger.info(summary_msg)
-        print(summary_msg)
-        logger.info("Total errors: 0")
-        print("Total errors: 0")
+        validator = ClaimValidator(description, previous_record_count, store=store, run_id=run_id, summary=summary,
+                                   diff=diff)
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        if tee is not None:
+            tee.write(data)
+        validator.feed(data)
+        if checkpoint is not None and not validator._skip_rows and checkpoint.due():
+            checkpoint.save(validator, {"rows": validator.row_count})
+    return validator.finish()
+
+class ValidatingWriter:
+    """
+    Writable file object that validates whatever is written to it, with an optional
+    tee to disk. Used as the stream_factory target when parsing multipart uploads,
+    so the file is validated while the request body is still being received.
+    """
 
-def process_uploaded_file(file_obj, previous_record_count=None):
+    def __init__(self, description, previous_record_count=None, tee_path=None, store=None, summary=False):
+        self.validator = ClaimValidator(description, previous_record_count, store=store, summary=summary)
+        self.tee_path = tee_path
+        self._tee = open(tee_path, "wb") if tee_path else None
+        self.result = None
+
+    def write(self, data):
+        if self._tee is not None:
+            self._tee.write(data)
+        self.validator.feed(bytes(data))
+        return len(data)
+
+    def seek(self, *args):
+        # Werkzeug rewinds finished file parts; there is nothing to rewind here.
+        return 0
+
+    def read(self, *args):
+        return b""
+
+    def finish(self):
+        if self.result is None:
+            if self._tee is not None:
+                self._tee.close()
+                self._tee = None
+            self.result = self.validator.finish()
+        return self.result
+
+    def close(self):
+        if self._tee is not None:
+            self._tee.close()
+            self._tee = None
+
+def process_uploaded_file(file_obj, previous_record_count=None, store=None, summary=False):
     """
     This function is similar to process_file() but accepts a file-like object.
     It can be used when a single file is uploaded (e.g., via a web form).
+    Binary objects may be gzip, bz2 or zip compressed; the delimiter is detected
+    from the first lines.
     """
     # Ensure we start reading from the beginning.
     file_obj.seek(0)
     print("\nProcessing uploaded file...")
     try:
-        reader = csv.reader(file_obj)
-        rows = list(reader)
+        if isinstance(file_obj, io.TextIOBase):
+            validator = ClaimValidator("uploaded file", previous_record_count, store=store, summary=summary)
+            stream, delimiter = open_claim_stream(file_obj)
+            for row in parse_records(stream, delimiter):
+                validator.feed_row(row)
+            result = validator.finish()
+        else:
+            result = validate_stream(file_obj, "uploaded file", previous_record_count, store=store, summary=summary)
     except Exception as e:
         err_msg = f"Error reading uploaded file: {str(e)}"
         logger.error(err_msg)
         print(err_msg)
         return
 
-    if not rows:
+    if result is None:
         err_msg = "Uploaded file is empty."
         logger.error(err_msg)
         print(err_msg)
-        return
-
-    # Use the same logic as process_file (note: we do not have a file path here)
-    file_errors = set()
-    unique_record_numbers = set()
-    claim_count = 0
-
-    has_header = (rows[0][0].strip() == "HDR") if rows[0] else False
-    has_trailer = (rows[-1][0].strip() == "TRL") if rows[-1] else False
-
-    if has_header:
-        header_row = rows[0]
-        header_errors = validate_row(header_row, HEADER_SCHEMA, row_number=1)
-        if header_errors:
-            file_errors.update(header_errors)
-            logger.error(f"Header errors in uploaded file: {header_errors}")
-            print("Header errors:")
-            for err in header_errors:
-                print(err)
-    else:
-        warning_msg = "Uploaded file does not have a header row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print(warning_msg)
-
-    if has_trailer:
-        trailer_row = rows[-1]
-        trailer_errors = validate_row(trailer_row, TRAILER_SCHEMA, row_number=len(rows))
-        if trailer_errors:
-            file_errors.update(trailer_errors)
-            logger.error(f"Trailer errors in uploaded file: {trailer_errors}")
-            print("Trailer errors:")
-            for err in trailer_errors:
-                print(err)
-    else:
-        warning_msg = "Uploaded file does not have a trailer row. Treating all rows as claim records."
-        logger.warning(warning_msg)
-        print(warning_msg)
-
-    start_idx = 1 if has_header else 0
-    end_idx = -1 if has_trailer else len(rows)
-    claim_rows = rows[start_idx:end_idx]
+    return result
 
-    for idx, row in enumerate(claim_rows, start=start_idx+1):
-        if len(row) != EXPECTED_CLAIM_FIELDS:
-            err = f"Row {idx}: Expected {EXPECTED_CLAIM_FIELDS} columns, found {len(row)}."
-            file_errors.add(err)
-            print(err)
-            continue
-        errors = validate_row(row, CLAIM_SCHEMA, row_number=idx)
-        for err in errors:
-            file_errors.add(err)
-            print(err)
-        record_number = row[1].strip()
-        if record_number in unique_record_numbers:
-            dup_err = f"Row {idx}: Duplicate RecordNumber {record_number}."
-            file_errors.add(dup_err)
-            print(dup_err)
-        else:
-            unique_record_numbers.add(record_number)
-        claim_count += 1
-
-    if has_trailer:
-        try:
-            expected_count = int(trailer_row[1].strip())
-            if expected_count != claim_count:
-                err = f"Trailer count {expected_count} does not match actual claim count {claim_count}."
-                file_errors.add(err)
-                print(err)
-        except Exception as e:
-            err = f"Error parsing trailer Record Count: {e}"
-            file_errors.add(err)
-            print(err)
-
-    if previous_record_count is not None:
-        if previous_record_count > 0 and abs(claim_count - previous_record_count) / previous_record_count > 0.5:
-            warn_msg = f"Warning: Claim count {claim_count} differs by more than 50% from previous count {previous_record_count}."
-            logger.warning(warn_msg)
-            print(warn_msg)
-
-    error_count = len(file_errors)
-    if error_count > 0:
-        sorted_errors = sorted(file_errors)
-        logger.error("Errors found in uploaded file:")
-        for err in sorted_errors:
-            logger.error(err)
-        summary_msg = f"Finished processing uploaded file with {error_count} error(s) and {claim_count} claim record(s)."
-        logger.error(summary_msg)
-        print(f"\n{summary_msg}")
-        print("Error details:")
-        for err in sorted_errors:
-            print(f" - {err}")
-    else:
-        summary_msg = f"Uploaded file processed successfully with {claim_count} claim record(s) and no errors."
-        logger.info(summary_msg)
-        print(summary_msg)
-        logger.info("Total errors: 0")
-        print("Total errors: 0")
-
-def process_files_in_folder(folder_path, previous_counts=None):
+def process_files_in_folder(folder_path, previous_counts=None, store=None, summary=False):
     if not os.path.exists(folder_path):
         err_msg = f"Folder not found: {folder_path}"
         logger.error(err_msg)
@@ -968,12 +1798,225 @@ def process_files_in_folder(folder_path, previous_counts=None):
         msg = f"No files found in folder: {folder_path}"
         logger.info(msg)
         print(msg)
-        return
+        return []
 
+    results = []
     for file_path in files:
         base_name = os.path.basename(file_path)
         prev_count = previous_counts.get(base_name) if previous_counts else None
-        process_file(file_path, previous_record_count=prev_count)
+        results.append(process_file(file_path, previous_record_count=prev_count, store=store, summary=summary))
+    return results
+
+# ==============================
+# JSON / NDJSON Claim Files
+# ==============================
+# Records are objects keyed by column name (or arrays of values in column order).
+# RecordID may be left out of claim records; "HDR" and "TRL" records are laid out
+# with the header and trailer schemas.
+RECORD_COLUMNS = {"HDR": [field["name"] for field in HEADER_SCHEMA],
+                  "TRL": [field["name"] for field in TRAILER_SCHEMA]}
+CLAIM_COLUMNS = [field["name"] for field in CLAIM_SCHEMA]
+KNOWN_COLUMNS = {field["name"] for schema in (HEADER_SCHEMA, CLAIM_SCHEMA, TRAILER_SCHEMA) for field in schema}
+MAX_REPORTED_COLUMNS = 200
+
+def _json_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return json.dumps(value)
+
+def record_to_row(record):
+    """Lays out one JSON record as a row of strings in schema order."""
+    if isinstance(record, list):
+        return [_json_cell(value) for value in record]
+    if not isinstance(record, dict):
+        return [_json_cell(record)]
+    record_id = _json_cell(record.get("RecordID", "CLM"))
+    columns = RECORD_COLUMNS.get(record_id.strip(), CLAIM_COLUMNS)
+    row = list(map(record.get, columns, repeat("")))
+    row[0] = record_id
+    if not all(map(isinstance, row, repeat(str))):
+        row = [_json_cell(value) for value in row]
+    return row
+
+def validate_json_stream(stream, description, previous_record_count=None, store=None, run_id=None, summary=False):
+    """
+    Validates a JSON or NDJSON claim file while it is read (see JsonRecordReader),
+    so neither the document nor a list of its records is ever held in memory.
+    Returns the usual result plus record_count and the columns seen, or None if
+    there were no records. Malformed JSON stops the scan and is reported as an error.
+    """
+    validator = ClaimValidator(description, previous_record_count, store=store, run_id=run_id, summary=summary)
+    columns = {}
+    try:
+        for record in JsonRecordReader(stream):
+            if isinstance(record, dict) and len(columns) < MAX_REPORTED_COLUMNS:
+                for key in record:
+                    columns[key] = None
+            validator.feed_row(record_to_row(record))
+    except (ValueError, UnicodeDecodeError) as e:
+        validator.add_error(f"Record {validator.row_count + 1}: {str(e)}", validator.row_count + 1)
+    if validator.row_count == 0:
+        # Nothing to finish, but JSON that is malformed from the start still gets a report.
+        return validator.report() if validator.error_count else None
+    result = validator.finish()
+    result["record_count"] = validator.row_count
+    result["columns"] = [column for column in columns if column in KNOWN_COLUMNS]
+    result["unknown_columns"] = [column for column in columns if column not in KNOWN_COLUMNS]
+    if result["unknown_columns"]:
+        logger.warning(f"Ignored unknown columns in {description}: {result['unknown_columns']}")
+    return result
+
+# ==============================
+# Quick Verdict (sampled validation)
+# ==============================
+QUICK_SAMPLE_ROWS = 2000
+QUICK_CONFIDENCE = 0.95
+QUICK_MAX_ERROR_RATE = 0.01  # share of claim rows with errors that is still acceptable
+QUICK_EXAMPLES = 20
+_background_pool = None
+
+def wilson_interval(errors, total, confidence=QUICK_CONFIDENCE):
+    """Wilson score interval (low, high) for errors / total."""
+    if total == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    rate = errors / total
+    denominator = 1 + z * z / total
+    centre = (rate + z * z / (2 * total)) / denominator
+    half_width = z * ((rate * (1 - rate) / total + z * z / (4 * total * total)) ** 0.5) / denominator
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+def _rate(errors, total, confidence):
+    low, high = wilson_interval(errors, total, confidence)
+    return {"errors": errors, "rate": round(errors / total, 6) if total else 0.0,
+            "low": round(low, 6), "high": round(high, 6)}
+
+def quick_verdict(file_path, sample_size=QUICK_SAMPLE_ROWS, confidence=QUICK_CONFIDENCE,
+                  max_error_rate=QUICK_MAX_ERROR_RATE, seed=None):
+    """
+    Estimates whether a claim file is acceptable without reading all of it.
+
+    The header and trailer are validated in full. The claim rows between them are
+    split into sample_size equal byte ranges and one row is read at a random offset
+    in each, so the sample is spread over the whole file. Returns per-column error
+    rates with Wilson confidence intervals and a verdict: "reject" if the header or
+    trailer is invalid or the row error rate is above max_error_rate with the given
+    confidence, "accept" if it is below, and "uncertain" otherwise. Duplicate
+    RecordNumbers and the trailer count can only be checked by a full run.
+    """
+    started = time.monotonic()
+    claim_file = MappedClaimFile.open(file_path)
+    if claim_file is None:
+        raise ValueError("Quick verdict needs an uncompressed file; compressed files can only be read in order")
+    rng = random.Random(seed)
+    with claim_file:
+        header_row, header_end = claim_file.first_record()
+        if header_row is None:
+            raise ValueError(f"File {file_path} is empty.")
+        trailer_row, trailer_start = claim_file.last_record()
+
+        reasons = []
+        has_header = bool(header_row) and header_row[0].strip() == "HDR"
+        header_errors = format_row_errors(row_field_errors(header_row, HEADER_SCHEMA), 1) if has_header else []
+        if not has_header:
+            reasons.append("No header row")
+        claims_start = header_end if has_header else 0
+        has_trailer = bool(trailer_row) and trailer_row[0].strip() == "TRL" and trailer_start >= claims_start
+        trailer_errors = []
+        expected_count = None
+        if has_trailer:
+            trailer_errors = [f"Trailer, Column '{column}': {err}" if column else f"Trailer: {err}"
+                              for column, err in row_field_errors(trailer_row, TRAILER_SCHEMA)]
+            try:
+                expected_count = int(trailer_row[1].strip())
+            except Exception as e:
+                trailer_errors.append(f"Error parsing trailer Record Count: {e}")
+        else:
+            reasons.append("No trailer row")
+        claims_stop = trailer_start if has_trailer else claim_file.size
+
+        span = claims_stop - claims_start
+        strata = max(1, min(sample_size, span))
+        seen = set()
+        sampled = sampled_bytes = 0
+        sample = []  # (byte offset, row, field errors)
+        for i in range(strata if span > 0 else 0):
+            low = claims_start + span * i // strata
+            high = claims_start + span * (i + 1) // strata
+            row, start, end = claim_file.record_at(rng.randrange(low, max(high, low + 1)), claims_stop)
+            if row is None or start in seen:
+                continue
+            seen.add(start)
+            sampled += 1
+            sampled_bytes += end - start
+            if len(row) != EXPECTED_CLAIM_FIELDS:
+                field_errors = [(None, f"Expected {EXPECTED_CLAIM_FIELDS} columns, found {len(row)}.")]
+            else:
+                field_errors = row_field_errors(row, CLAIM_SCHEMA)
+            sample.append((start, row, field_errors))
+
+    well_formed = [i for i, (_, row, _) in enumerate(sample) if len(row) == EXPECTED_CLAIM_FIELDS]
+    for position, column, err in CrossFieldRules().check_batch([sample[i][1] for i in well_formed]):
+        sample[well_formed[position]][2].append((column, err))
+    bad_rows = 0
+    column_errors = {}
+    examples = []
+    for start, _, field_errors in sample:
+        if field_errors:
+            bad_rows += 1
+            for column in {column or "(row)" for column, _ in field_errors}:
+                column_errors[column] = column_errors.get(column, 0) + 1
+            for column, err in field_errors:
+                if len(examples) < QUICK_EXAMPLES:
+                    examples.append(f"Byte offset {start}" + (f", Column '{column}'" if column else "") + f": {err}")
+
+    row_rate = _rate(bad_rows, sampled, confidence)
+    if header_errors:
+        reasons.append(f"{len(header_errors)} header error(s)")
+    if trailer_errors:
+        reasons.append(f"{len(trailer_errors)} trailer error(s)")
+    if header_errors or trailer_errors or row_rate["low"] > max_error_rate:
+        verdict = "reject"
+    elif row_rate["high"] <= max_error_rate:
+        verdict = "accept"
+    else:
+        verdict = "uncertain"
+    if sampled and row_rate["low"] > max_error_rate:
+        reasons.append(f"Row error rate is above {max_error_rate:.2%} ({row_rate['low']:.2%}-{row_rate['high']:.2%})")
+
+    estimated_claims = round(span * sampled / sampled_bytes) if sampled_bytes else 0
+    if expected_count is not None and expected_count > 0 and abs(estimated_claims - expected_count) / expected_count > 0.1:
+        reasons.append(f"Trailer count {expected_count} is far from the estimated {estimated_claims} claim record(s)")
+
+    columns = sorted(({"column": column, **_rate(count, sampled, confidence)} for column, count in column_errors.items()),
+                     key=lambda entry: entry["rate"], reverse=True)
+    result = {"file": f"file {file_path}", "verdict": verdict, "reasons": reasons,
+              "sampled_rows": sampled, "confidence": confidence, "max_error_rate": max_error_rate,
+              "estimated_claim_count": estimated_claims, "trailer_record_count": expected_count,
+              "header_errors": header_errors, "trailer_errors": trailer_errors,
+              "row_error_rate": row_rate, "columns": columns, "examples": examples,
+              "elapsed_seconds": round(time.monotonic() - started, 3)}
+    logger.info(f"Quick verdict for {file_path}: {verdict} from {sampled} sampled row(s) "
+                f"(row error rate {row_rate['low']:.2%}-{row_rate['high']:.2%})")
+    return result
+
+def start_background_validation(file_path, previous_record_count=None, store=None):
+    """
+    Runs process_file in a background thread. Returns the run_id it will be stored
+    under, if any: that of the interrupted run it resumes from a checkpoint, or a new one.
+    """
+    global _background_pool
+    if _background_pool is None:
+        _background_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="full-validation")
+    run_id = None
+    if store is not None:
+        run_id = ValidationCheckpoint(file_path).resumable_run_id() or uuid.uuid4().hex
+    _background_pool.submit(process_file, file_path, previous_record_count, store, run_id)
+    return run_id
 
 # ==============================
 # Main Processing Block
@@ -994,35 +2037,59 @@ def process_files_in_folder(folder_path, previous_counts=None):
 #     if os.path.exists(upload_file_path):
 #         with open(upload_file_path, "r", newline="", encoding="utf-8") as f:
 #             process_uploaded_file(f, previous_record_count=previous_counts.get(os.path.basename(upload_file_path)))
-from flask import Flask, request, jsonify, send_file
+from flask import request, jsonify, current_app
 from flask.views import MethodView
-import os
-import logging
+from contextlib import nullcontext
+from werkzeug.formparser import MultiPartParser
 from werkzeug.utils import secure_filename
+from result_store import get_result_store
 
-app = Flask(__name__)
-UPLOAD_FOLDER = "uploads"
-LOG_FILE = "smart_parser.log"
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# The views below are registered on the app built by indium.create_app.
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+PREVIOUS_COUNTS = {"input_file_28.csv": 74, "input_file_14.csv": 70}
+UPLOAD_FIELDS = ("vendor_file", "file")  # multipart fields an upload may be sent in
 
-logging.basicConfig(level=logging.INFO, filename=LOG_FILE, filemode='a',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+class DiscardedPart:
+    """Sink for multipart file parts that are not validated."""
 
-def process_file(file_path, previous_record_count=None):
-    logger.info(f"Processing file: {file_path}")
-    # Process logic here
-    return {"message": f"Processed {file_path}", "record_count": previous_record_count}
+    def write(self, data):
+        return len(data)
 
-def process_files_in_folder(folder_path, previous_counts=None):
-    if not os.path.exists(folder_path):
-        return {"error": "Folder not found"}
-    files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-    results = [process_file(f, previous_counts.get(os.path.basename(f))) for f in files]
-    return results
+    def seek(self, *args):
+        return 0
+
+    def read(self, *args):
+        return b""
+
+    def close(self):
+        pass
+
+class UploadPartParser(MultiPartParser):
+    """
+    Multipart parser that streams the first selected file part named in UPLOAD_FIELDS
+    into the writer open_writer(filename) returns, and discards any other file part, so only
+    the validated file gets a validator, a result store run and a copy on disk. If
+    open_writer returns None the name is refused: it is kept in rejected and every
+    file part is discarded.
+    """
+
+    def __init__(self, open_writer, **kwargs):
+        super().__init__(**kwargs)
+        self.open_writer = open_writer
+        self.writer = None
+        self.rejected = None
+
+    def start_file_streaming(self, event, total_content_length):
+        if self.writer is None and self.rejected is None and event.name in UPLOAD_FIELDS and event.filename:
+            self.writer = self.open_writer(event.filename)
+            if self.writer is not None:
+                return self.writer
+            self.rejected = event.filename
+        return DiscardedPart()
+
+def _summary_requested():
+    """True when the request asks for an aggregate summary (?summary=1)."""
+    return request.args.get("summary", "0").lower() in ("1", "true", "yes")
 
 class ClaimFileProcessor(MethodView):
     def post(self, action):
@@ -1032,42 +2099,113 @@ class ClaimFileProcessor(MethodView):
             return self.process_folder()
         elif action == "upload-file":
             return self.upload_file()
+        elif action == "quick-verdict":
+            return self.quick_verdict()
         return jsonify({"error": "Invalid action"}), 400
 
     def process_file(self):
+        """
+        {"file_path": ..., "summary": false, "vendor": ...}. With a vendor, only rows that
+        are new or changed since that vendor's previous file are validated.
+        """
         data = request.json
         file_path = data.get("file_path")
         if not file_path or not os.path.exists(file_path):
             return jsonify({"error": "File not found"}), 400
-        result = process_file(file_path)
+        result = process_file(file_path, store=get_result_store(), summary=bool(data.get("summary")),
+                              vendor=data.get("vendor") or None)
+        if result is None:
+            return jsonify({"error": "File is empty"}), 400
+        if "error" in result:
+            return jsonify(result), 400
+        return jsonify(result)
+
+    def quick_verdict(self):
+        """
+        {"file_path": ..., "sample_size": 2000, "confidence": 0.95, "max_error_rate": 0.01,
+         "full_validation": false}. With full_validation the complete run is started in
+        the background and its run_id returned, to be fetched from /api/runs/<run_id>.
+        """
+        data = request.get_json(silent=True) or {}
+        file_path = data.get("file_path")
+        if not file_path or not os.path.exists(file_path):
+            return jsonify({"error": "File not found"}), 400
+        try:
+            result = quick_verdict(file_path,
+                                   sample_size=int(data.get("sample_size", QUICK_SAMPLE_ROWS)),
+                                   confidence=float(data.get("confidence", QUICK_CONFIDENCE)),
+                                   max_error_rate=float(data.get("max_error_rate", QUICK_MAX_ERROR_RATE)))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if data.get("full_validation"):
+            prev = PREVIOUS_COUNTS.get(os.path.basename(file_path))
+            result["full_validation_run_id"] = start_background_validation(file_path, prev, get_result_store())
         return jsonify(result)
 
     def process_folder(self):
-        previous_counts = {"input_file_28.csv": 74, "input_file_14.csv": 70}
-        result = process_files_in_folder(app.config["UPLOAD_FOLDER"], previous_counts)
+        result = process_files_in_folder(current_app.config["UPLOAD_FOLDER"], PREVIOUS_COUNTS, get_result_store(),
+                                         summary=_summary_requested())
         return jsonify(result)
 
     def upload_file(self):
-        if "file" not in request.files:
+        """
+        Validates the upload while the request body is being received instead of
+        saving it and reading it back. In a multipart body the first file part named
+        vendor_file or file feeds the validator and other parts are discarded; other bodies are read from request.stream
+        with the name taken from ?filename=. A copy is teed to UPLOAD_FOLDER unless
+        ?persist=0 is passed; ?summary=1 returns aggregate error counts instead of
+        every error.
+        """
+        persist = request.args.get("persist", "1") != "0"
+        summary = _summary_requested()
+        upload_folder = current_app.config["UPLOAD_FOLDER"]
+
+        def tee_path_for(filename):
+            return os.path.join(upload_folder, filename) if persist and filename else None
+
+        if request.mimetype != "multipart/form-data":
+            filename = secure_filename(request.args.get("filename", ""))
+            if filename == "":
+                return jsonify({"error": "No selected file"}), 400
+            tee_path = tee_path_for(filename)
+            with open(tee_path, "wb") if tee_path else nullcontext() as tee:
+                result = validate_stream(request.stream, f"uploaded file {filename}",
+                                         PREVIOUS_COUNTS.get(filename), tee=tee, store=get_result_store(),
+                                         summary=summary)
+            return self._upload_result(result)
+
+        boundary = request.mimetype_params.get("boundary", "").encode("ascii")
+        if not boundary:
+            return jsonify({"error": "Missing multipart boundary"}), 400
+
+        def open_writer(filename):
+            filename = secure_filename(filename or "")
+            if filename == "":
+                return None  # nothing usable left of the name, e.g. "..": refused below
+            return ValidatingWriter(f"uploaded file {filename}", PREVIOUS_COUNTS.get(filename),
+                                    tee_path_for(filename), get_result_store(), summary)
+
+        parser = UploadPartParser(open_writer, max_form_memory_size=request.max_form_memory_size,
+                                  max_form_parts=request.max_form_parts)
+        try:
+            _, files = parser.parse(request.stream, boundary, request.content_length)
+        finally:
+            if parser.writer is not None:
+                parser.writer.close()
+        if parser.rejected is not None:
+            return jsonify({"error": f"Invalid file name: {parser.rejected!r}"}), 400
+        if parser.writer is None:
+            if any(field in files for field in UPLOAD_FIELDS):
+                return jsonify({"error": "No selected file"}), 400
             return jsonify({"error": "No file provided"}), 400
-        file = request.files["file"]
-        if file.filename == "":
-            return jsonify({"error": "No selected file"}), 400
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(file_path)
-        previous_counts = {"input_file_28.csv": 74, "input_file_14.csv": 70}
-        result = process_file(file_path, previous_counts.get(filename))
-        return jsonify(result)
-
-@app.route("/download-log", methods=["GET"])
-def download_log():
-    if os.path.exists(LOG_FILE):
-        return send_file(LOG_FILE, as_attachment=True)
-    return jsonify({"error": "Log file not found"}), 404
+        return self._upload_result(parser.writer.finish())
 
-claim_processor_view = ClaimFileProcessor.as_view("claim_processor")
-app.add_url_rule("/api/<string:action>", view_func=claim_processor_view, methods=["POST"])
+    @staticmethod
+    def _upload_result(result):
+        if result is None:
+            return jsonify({"error": "Uploaded file is empty"}), 400
+        return jsonify(result)
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    from indium import create_app
+    create_app().run(debug=True, host="0.0.0.0", port=5000)
@@ -1,80 +1,106 @@
 import logging
-import os
-import json
 import io
-import base64
-import pandas as pd
-from PIL import Image
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import request, jsonify
 from flask.views import MethodView
 import asyncio
-from asgiref.wsgi import WsgiToAsgi
-
-# ✅ Setup Logging
-LOG_DIR = "logs"
-LOG_FILE = os.path.join(LOG_DIR, "file_upload.log")
-
-# Ensure log directory exists
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-
-# Configure logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+from input_stream import open_claim_stream, open_decompressed, strip_compression_suffix
+from error_logger import validate_json_stream, PREVIOUS_COUNTS
+from result_store import get_result_store
+from memory_budget import AdaptiveBatch, JobMemory, frame_size
+
+# Logging is configured by the app (see indium.create_app).
+# pandas is imported where a file is actually parsed, so importing this module stays cheap.
+
+# Plain-text delimited formats; the delimiter itself is sniffed from the content.
+DELIMITED_EXTENSIONS = ["csv", "txt", "psv", "tsv", "dat"]
+# JSON claim files are validated record by record as they stream in (see validate_json_stream).
+JSON_EXTENSIONS = ["json", "ndjson", "jsonl"]
+# Delimited files are parsed in chunks of at most READ_CHUNK_ROWS rows, fewer when rows
+# are too wide to fit in READ_CHUNK_SHARE of the job's memory budget.
+READ_CHUNK_ROWS = 100_000
+READ_CHUNK_MIN = 1_000
+READ_CHUNK_SHARE = 0.5
 
 # app = Flask(__name__)
 # CORS(app)  # Enable CORS for all domains
 # asgi_app = WsgiToAsgi(app)  # Convert Flask app to an ASGI-compatible app
 
+def read_delimited(text_stream, delimiter):
+    """
+    Parses a delimited file chunk by chunk (see memory_budget.AdaptiveBatch), keeping
+    only its header. Returns (columns, row count, memory report).
+    """
+    import pandas as pd
+    memory = JobMemory()
+    chunk_sizes = AdaptiveBatch(memory, "chunk", READ_CHUNK_MIN, READ_CHUNK_ROWS, READ_CHUNK_SHARE)
+    columns = None
+    rows = 0
+    with pd.read_csv(text_stream, sep=delimiter, chunksize=chunk_sizes.size) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(chunk_sizes.size)
+            except StopIteration:
+                break
+            if columns is None:
+                columns = list(chunk.columns)
+            rows += len(chunk)
+            chunk_sizes.resize(len(chunk), frame_size(chunk))
+    return columns, rows, memory.report()
+
 class FileProcessor:
     @staticmethod
-    async def process_file(file):
+    async def process_file(file, summary=False, store=None):
         filename = file.filename
-        file_extension = filename.split(".")[-1].lower()
+        file_extension = strip_compression_suffix(filename).split(".")[-1].lower()
         logging.info(f"Received file: {filename} (Type: {file_extension})")
 
         try:
-            file_content = await asyncio.to_thread(file.read)
-
-            if file_extension == "json":
+            if file_extension in ["xls", "xlsx"]:
+                # Excel workbooks are zip containers themselves, so skip compression detection.
+                file_content = await asyncio.to_thread(file.read)
+                return FileProcessor._process_excel(filename, file_extension, file_content)
+
+            stream, compression, member_name = await asyncio.to_thread(open_decompressed, file.stream)
+            if member_name:
+                file_extension = member_name.split(".")[-1].lower()
+            if compression:
+                logging.info(f"Decompressing {compression} file: {filename} (Type: {file_extension})")
+
+            if file_extension in JSON_EXTENSIONS:
                 try:
-                    json_data = json.loads(file_content)
-                    logging.info(f"Processing JSON file: {filename}")
-                    return {"filename": filename, "content": json_data}
-                except json.JSONDecodeError as e:
-                    logging.error(f"Corrupt JSON file: {filename} - {str(e)}")
-                    return {"error": "Invalid JSON file, unable to decode JSON"}
+                    result = await asyncio.to_thread(validate_json_stream, stream, f"uploaded file {filename}",
+                                                     PREVIOUS_COUNTS.get(filename), store, None, summary)
+                    if result is None:
+                        logging.error(f"Empty JSON file: {filename}")
+                        return {"error": "Uploaded JSON file has no records"}
+                    logging.info(f"Processing JSON file: {filename} ({result['record_count']} record(s), "
+                                 f"{result['error_count']} error(s))")
+                    return {"filename": filename, **result}
                 except Exception as e:
                     logging.error(f"Unexpected error in JSON file: {filename} - {str(e)}")
                     return {"error": f"Invalid JSON file: {str(e)}"}
 
-            elif file_extension in ["csv", "xls", "xlsx"]:
+            elif file_extension in DELIMITED_EXTENSIONS:
+                import pandas as pd
                 try:
-                    if file_extension == "csv":
-                        df = pd.read_csv(io.BytesIO(file_content), encoding_errors='replace')
-                    else:
-                        df = pd.read_excel(io.BytesIO(file_content))
+                    text_stream, delimiter = await asyncio.to_thread(open_claim_stream, stream, errors="replace")
+                    columns, rows, memory = await asyncio.to_thread(read_delimited, text_stream, delimiter)
 
-                    if df.empty:
+                    if not rows:
                         raise ValueError("Empty data frame")
-                    logging.info(f"Processing {file_extension.upper()} file: {filename} (Columns: {list(df.columns)})")
-                    return {"filename": filename, "columns": list(df.columns)}
+                    logging.info(f"Processing {file_extension.upper()} file: {filename} (Delimiter: {delimiter!r}, Columns: {columns})")
+                    return {"filename": filename, "columns": columns, "memory": memory}
                 except pd.errors.EmptyDataError:
-                    logging.error(f"Empty CSV/Excel file: {filename}")
+                    logging.error(f"Empty CSV file: {filename}")
                     return {"error": "Uploaded CSV/Excel file is empty"}
                 except pd.errors.ParserError:
-                    logging.error(f"Corrupt CSV/Excel file: {filename}")
+                    logging.error(f"Corrupt CSV file: {filename}")
                     return {"error": "Uploaded CSV/Excel file is corrupt or incorrectly formatted"}
                 except UnicodeDecodeError as e:
-                    logging.error(f"Encoding error in CSV/Excel file: {filename} - {str(e)}")
+                    logging.error(f"Encoding error in CSV file: {filename} - {str(e)}")
                     return {"error": "Uploaded file has encoding issues, unable to decode content"}
                 except Exception as e:
-                    logging.error(f"Error processing CSV/Excel file: {filename} - {str(e)}")
+                    logging.error(f"Error processing CSV file: {filename} - {str(e)}")
                     return {"error": f"Invalid CSV/Excel file: {str(e)}"}
 
             else:
@@ -85,6 +111,24 @@ class FileProcessor:
             logging.error(f"Unexpected error processing file: {filename} - {str(e)}")
             return {"error": f"File processing failed: {str(e)}"}
 
+    @staticmethod
+    def _process_excel(filename, file_extension, file_content):
+        import pandas as pd
+        try:
+            memory = JobMemory()
+            df = pd.read_excel(io.BytesIO(file_content))
+            if df.empty:
+                raise ValueError("Empty data frame")
+            memory.hold("workbook", frame_size(df))  # workbooks cannot be read in chunks
+            logging.info(f"Processing {file_extension.upper()} file: {filename} (Columns: {list(df.columns)})")
+            return {"filename": filename, "columns": list(df.columns), "memory": memory.report()}
+        except pd.errors.EmptyDataError:
+            logging.error(f"Empty CSV/Excel file: {filename}")
+            return {"error": "Uploaded CSV/Excel file is empty"}
+        except Exception as e:
+            logging.error(f"Error processing CSV/Excel file: {filename} - {str(e)}")
+            return {"error": f"Invalid CSV/Excel file: {str(e)}"}
+
 class UploadAPI(MethodView):
     def post(self):
         try:
@@ -93,7 +137,9 @@ class UploadAPI(MethodView):
                 return jsonify({"error": "Missing file in request"}), 400
 
             file = request.files["file"]
-            result = asyncio.run(FileProcessor.process_file(file))
+            # JSON files are validated; ?summary=1 returns aggregate error counts instead of every error.
+            summary = request.args.get("summary", "0").lower() in ("1", "true", "yes")
+            result = asyncio.run(FileProcessor.process_file(file, summary, get_result_store()))
             return jsonify(result)
 
         except Exception as e:
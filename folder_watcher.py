@@ -0,0 +1,367 @@
+"""
+Watch-folder ingestion service.
+
+    python folder_watcher.py [folder]
+
+Watches a drop folder (INBOX_FOLDER by default) and validates each file shortly
+after it has been completely written, instead of waiting for a client to call
+/api/process-folder. Validated files are moved to processed/ and files that could
+not be read or have errors to quarantine/, each with a <name>.result.json next to
+it; every run is also recorded in the result store (see /api/runs).
+
+On Linux the folder is watched with inotify, so an idle watcher sleeps in select()
+until something lands. Elsewhere, or when inotify is unavailable or WATCH_POLL=1
+(e.g. on network mounts, where inotify does not see remote writes), the folder is
+rescanned every WATCH_POLL_INTERVAL seconds. Run a single watcher per folder.
+
+The drop folder must not be the app's UPLOAD_FOLDER: files there are referred to
+by name after they are written (/api/mappings/<id>/apply?source=, files persisted
+by chunked uploads), so the watcher refuses to move them away.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from error_logger import process_file, validate_json_stream, PREVIOUS_COUNTS
+from file_reader import JSON_EXTENSIONS
+from input_stream import open_decompressed, strip_compression_suffix
+from result_store import get_result_store
+
+# Every setting can be overridden from the environment.
+WATCH_FOLDER = os.environ.get("WATCH_FOLDER", "INBOX_FOLDER")
+APP_UPLOAD_FOLDER = "UPLOAD_FOLDER"  # indium.UPLOAD_FOLDER, which is never watched (see above)
+WATCH_WORKERS = int(os.environ.get("WATCH_WORKERS", 2))
+# A file is picked up once it is closed (inotify) and unchanged for this long.
+WATCH_SETTLE_SECONDS = float(os.environ.get("WATCH_SETTLE_SECONDS", 2))
+WATCH_POLL_INTERVAL = float(os.environ.get("WATCH_POLL_INTERVAL", 5))
+WATCH_POLL = os.environ.get("WATCH_POLL", "0") == "1"
+PROCESSED_DIR_NAME = "processed"
+QUARANTINE_DIR_NAME = "quarantine"
+# Partial downloads and editor/upload temp files are never picked up.
+IGNORED_SUFFIXES = [".part", ".tmp", ".crdownload", ".swp", ".result.json"]
+
+# ==============================
+# inotify (Linux, via ctypes)
+# ==============================
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Inotify:
+    """A single non-blocking inotify watch on one directory."""
+
+    def __init__(self, path, mask=WATCH_MASK):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err), path)
+
+    def fileno(self):
+        return self.fd
+
+    def read_events(self):
+        """Yields (mask, name) for every queued event without blocking."""
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                yield mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+# ==============================
+# Validating One Dropped File
+# ==============================
+def validate_dropped_file(path, store=None, summary=True):
+    """
+    Validates a file from the drop folder: JSON/NDJSON (possibly compressed) with
+    validate_json_stream, anything else with process_file. Returns the result, or
+    None when the file could not be read or is empty.
+    """
+    name = os.path.basename(path)
+    description = f"file {path}"
+    previous_record_count = PREVIOUS_COUNTS.get(name)
+    with open(path, "rb") as raw:
+        stream, _, member_name = open_decompressed(raw)
+        extension = (member_name or strip_compression_suffix(name)).split(".")[-1].lower()
+        if extension in JSON_EXTENSIONS:
+            try:
+                return validate_json_stream(stream, description, previous_record_count, store, summary=summary)
+            except Exception as e:
+                logging.error(f"Error reading JSON file {path}: {str(e)}")
+                return None
+    return process_file(path, previous_record_count, store, summary=summary)
+
+
+# ==============================
+# Folder Watcher
+# ==============================
+class FolderWatcher:
+    """
+    Finds files that have finished being written to `folder` and validates them on
+    a pool of `workers` threads. At most `workers` files are in flight; the rest
+    wait in a queue in the order they became ready.
+    """
+
+    def __init__(self, folder=WATCH_FOLDER, workers=WATCH_WORKERS, settle_seconds=WATCH_SETTLE_SECONDS,
+                 poll_interval=WATCH_POLL_INTERVAL, poll=WATCH_POLL, store=None, summary=True):
+        self.folder = os.path.abspath(folder)
+        self.processed_dir = os.path.join(self.folder, PROCESSED_DIR_NAME)
+        self.quarantine_dir = os.path.join(self.folder, QUARANTINE_DIR_NAME)
+        self.workers = workers
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.poll = poll
+        self.store = store
+        self.summary = summary
+        self.counts = {"processed": 0, "quarantined": 0, "failed": 0}
+        # path -> [stat signature, monotonic time it was last seen changing, closed by its writer]
+        self._pending = {}
+        self._ready = deque()
+        self._busy = set()
+        self._failed = {}  # path -> signature of a file that could not be moved out of the folder
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+        self._stopping = False
+        self._wake_read, self._wake_write = os.pipe()
+        self._inotify = None
+
+    # ---- lifecycle ----
+    def run(self):
+        """Watches until stop() is called, then waits for the files in flight."""
+        os.makedirs(self.processed_dir, exist_ok=True)
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        if not self.poll:
+            try:
+                self._inotify = Inotify(self.folder)
+            except OSError as e:
+                logging.warning(f"inotify unavailable for {self.folder} ({str(e)}), polling every "
+                                f"{self.poll_interval}s instead")
+        logging.info(f"Watching {self.folder} with {'inotify' if self._inotify else 'polling'}, "
+                     f"{self.workers} worker(s)")
+        self.scan()  # files that landed while nobody was watching
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="folder-watcher") as pool:
+            while not self._stopping:
+                self._wait(self._timeout())
+                self._check_pending()
+                self._dispatch(pool)
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        logging.info(f"Stopped watching {self.folder}: {self.counts}")
+
+    def stop(self):
+        self._stopping = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            pass
+
+    def _timeout(self):
+        """How long the loop may sleep: until the next closed file could settle, or indefinitely."""
+        timeout = None if self._inotify else self.poll_interval
+        with self._lock:
+            deadlines = [noted + self.settle_seconds for _, noted, closed in self._pending.values() if closed]
+        if deadlines:
+            settle = max(0.0, min(deadlines) - time.monotonic())
+            timeout = settle if timeout is None else min(timeout, settle)
+        return timeout
+
+    def _wait(self, timeout):
+        sources = [self._wake_read] + ([self._inotify] if self._inotify else [])
+        readable, _, _ = select.select(sources, [], [], timeout)
+        if self._wake_read in readable:
+            os.read(self._wake_read, 4096)
+        if self._inotify is not None and self._inotify in readable:
+            self._handle_events()
+        elif self._inotify is None:
+            self.scan()
+
+    # ---- finding files ----
+    def _candidate(self, name):
+        return not name.startswith(".") and not any(name.endswith(suffix) for suffix in IGNORED_SUFFIXES)
+
+    def scan(self):
+        """Notes every candidate file in the folder; unchanged files settle, changed ones start over."""
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            logging.error(f"Watch folder not found: {self.folder}")
+            return
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and self._candidate(entry.name):
+                self._note(entry.path, closed=True, touched=False)
+
+    def _handle_events(self):
+        for mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logging.warning(f"inotify queue overflowed for {self.folder}, rescanning")
+                self.scan()
+            elif mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                logging.warning(f"Watch on {self.folder} was removed, falling back to polling")
+                self._inotify.close()
+                self._inotify = None
+                return
+            elif name and not mask & IN_ISDIR and self._candidate(name):
+                # Until its writer closes it, a file that is being written is never picked up.
+                self._note(os.path.join(self.folder, name), closed=bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO)),
+                           touched=True)
+
+    def _note(self, path, closed, touched):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        signature = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if path in self._busy:
+                return
+            if touched or path not in self._pending:
+                self._pending[path] = [signature, time.monotonic(), closed]
+
+    def _check_pending(self):
+        """Moves files that are closed and have not changed for settle_seconds to the ready queue."""
+        now = time.monotonic()
+        with self._lock:
+            for path, entry in list(self._pending.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    del self._pending[path]
+                    continue
+                signature = (st.st_size, st.st_mtime_ns)
+                if signature != entry[0]:
+                    entry[0], entry[1] = signature, now
+                    continue
+                if not entry[2] or now - entry[1] < self.settle_seconds:
+                    continue
+                del self._pending[path]
+                if self._failed.get(path) == signature:
+                    continue
+                self._busy.add(path)
+                self._ready.append(path)
+
+    # ---- processing ----
+    def _dispatch(self, pool):
+        while self._ready and self._slots.acquire(blocking=False):
+            path = self._ready.popleft()
+            pool.submit(self._process, path).add_done_callback(lambda _, path=path: self._done(path))
+
+    def _done(self, path):
+        with self._lock:
+            self._busy.discard(path)
+        self._slots.release()
+        self._wake()
+
+    def _process(self, path):
+        logging.info(f"Validating dropped file {path}")
+        try:
+            result = validate_dropped_file(path, self.store, self.summary)
+        except Exception as e:
+            logging.error(f"Error validating dropped file {path}: {str(e)}")
+            result = None
+        clean = result is not None and "error" not in result and result.get("error_count") == 0
+        destination_dir = self.processed_dir if clean else self.quarantine_dir
+        try:
+            destination = self._move(path, destination_dir)
+            record = {"source": path, "destination": destination, "status": "processed" if clean else "quarantined",
+                      "result": result if result is not None else {"error": "File could not be read or is empty"}}
+            with open(f"{destination}.result.json", "w") as f:
+                json.dump(record, f)
+        except OSError as e:
+            logging.error(f"Could not move dropped file {path}: {str(e)}")
+            with self._lock:
+                self.counts["failed"] += 1
+                try:
+                    st = os.stat(path)
+                    self._failed[path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    pass
+            return
+        with self._lock:
+            self.counts["processed" if clean else "quarantined"] += 1
+        logging.info(f"{'Processed' if clean else 'Quarantined'} {path} -> {destination}"
+                     + (f" (run {result['run_id']})" if result and result.get("run_id") else ""))
+
+    @staticmethod
+    def _move(path, destination_dir):
+        """Moves path into destination_dir without overwriting an earlier file of the same name."""
+        name = os.path.basename(path)
+        destination = os.path.join(destination_dir, name)
+        if os.path.exists(destination):
+            stem, dot, extension = name.partition(".")
+            destination = os.path.join(destination_dir, f"{stem}.{time.strftime('%Y%m%d%H%M%S')}"
+                                                        f"-{os.getpid()}-{threading.get_ident()}{dot}{extension}")
+        return shutil.move(path, destination)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    folder = argv[0] if argv else WATCH_FOLDER
+    if os.path.realpath(folder) == os.path.realpath(APP_UPLOAD_FOLDER):
+        logging.error(f"Not watching {folder}: it is the app's upload folder, whose files the API refers to by "
+                      f"name. Drop files into a folder of their own (WATCH_FOLDER).")
+        return 2
+    watcher = FolderWatcher(folder, store=get_result_store())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: watcher.stop())
+    watcher.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
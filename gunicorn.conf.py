@@ -0,0 +1,31 @@
+import os
+import multiprocessing
+
+# ==============================
+# Gunicorn settings for wsgi:app
+# ==============================
+# Every setting can be overridden from the environment, e.g. WEB_CONCURRENCY=8.
+
+wsgi_app = "wsgi:app"
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# Prefork workers; threads let one worker overlap uploads that wait on the network.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Load the app in the master before forking so workers share it copy-on-write.
+preload_app = True
+
+# Recycle workers after a number of requests (jittered so they do not all restart
+# together) to bound memory growth, and give in-flight uploads time to finish.
+max_requests = int(os.environ.get("MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 100))
+timeout = int(os.environ.get("WORKER_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 60))
+keepalive = 5
+
+accesslog = os.environ.get("ACCESS_LOG", "-")
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} ready")
@@ -1,124 +1,311 @@
 import logging
 import os
-import io
-import base64
-import pandas as pd
-from PIL import Image
-from flask import Flask, request, jsonify
+import sys
+import gzip
+import zlib
+import hashlib
+import threading
+from flask import Flask, Response, current_app, request, jsonify, send_file
 from flask_cors import CORS
-from flask.views import MethodView
-import asyncio
-from asgiref.wsgi import WsgiToAsgi
-from file_reader import UploadAPI 
-from mapper import ColumnMapper # Import function to register routes
-from map import ColumnMapperAPI
-from error_logger import ClaimFileProcessor,secure_filename,send_file
-import logging as logger
+from dotenv import load_dotenv
+from werkzeug.utils import import_string
 
 # ✅ Setup Logging
 LOG_DIR = "logs"
 LOG_FILE = os.path.join(LOG_DIR, "file_upload.log")
+UPLOAD_FOLDER = 'UPLOAD_FOLDER'
 
-# Ensure log directory exists
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+# ✅ Conditionally exclude the `/health` route
+EXCLUDE_HEALTH_ROUTE = True  # Set to True to remove the `/health` route
 
-# ✅ Setup Logger
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# ==============================
+# Lazily Loaded Views
+# ==============================
+# Each view is imported the first time its route is hit (or by warm_up()), so
+# pandas, google.generativeai and friends are not paid for at startup, and a
+# module that fails to import only breaks its own route.
+class LazyView:
+    def __init__(self, import_name, endpoint):
+        self.import_name = import_name
+        self.endpoint = endpoint
+        self.__name__ = endpoint
+        self._view = None
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all domains
-asgi_app = WsgiToAsgi(app)  # Convert Flask app to an ASGI-compatible app
+    def load(self):
+        if self._view is None:
+            self._view = import_string(self.import_name).as_view(self.endpoint)
+        return self._view
 
-@app.errorhandler(404)
-def not_found_error(error):
-    if request.path == "/health":
-        return "", 204  # ✅ Return 204 No Content for /health requests to suppress logging
-    return jsonify({"error": "Endpoint not found"}), 404
+    def __call__(self, **kwargs):
+        try:
+            view = self.load()
+        except ImportError as e:
+            cause = getattr(e, "exception", e)  # import_string wraps the original ImportError
+            logging.error(f"Could not load view {self.import_name}: {str(cause)}")
+            return jsonify({"error": f"{request.path} is unavailable: {str(cause)}"}), 503
+        return view(**kwargs)
 
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({"error": "Internal server error"}), 500
+# (import name, endpoint, [(rule, methods), ...])
+VIEWS = [
+    ("error_logger.ClaimFileProcessor", "claim_processor", [
+        ("/api/<string:action>", ["POST"]),
+    ]),
+    # Chunked, resumable uploads
+    ("chunked_upload.ChunkedUploadAPI", "chunked_upload", [
+        ("/api/uploads", ["POST"]),
+        ("/api/uploads/<upload_id>", ["GET", "DELETE"]),
+        ("/api/uploads/<upload_id>/chunks/<int:index>", ["PUT"]),
+        ("/api/uploads/<upload_id>/<string:action>", ["POST"]),
+    ]),
+    # Stored validation results
+    ("result_store.ValidationResultsAPI", "validation_results", [
+        ("/api/runs", ["GET"]),
+        ("/api/runs/<run_id>", ["GET"]),
+        ("/api/runs/<run_id>/<string:action>", ["GET"]),
+    ]),
+    ("file_reader.UploadAPI", "upload_api", [
+        ("/upload/", ["POST"]),
+    ]),
+    ("mapper.ColumnMapper", "column_mapper", [
+        ("/process", ["POST"]),
+    ]),
+    ("mapper.BatchColumnMapper", "batch_column_mapper", [
+        ("/process/batch", ["POST"]),
+    ]),
+    # Saved column mappings and applying them to vendor files
+    ("mapper.MappingAPI", "mapping_api", [
+        ("/api/mappings", ["POST"]),
+        ("/api/mappings/<mapping_id>", ["GET"]),
+        ("/api/mappings/<mapping_id>/<string:action>", ["POST"]),
+    ]),
+    ("map.ColumnMapperAPI", "ColumnMapperAPI", [
+        ("/map", ["POST"]),
+    ]),
+]
+
+# ==============================
+# Response Compression and Conditional Requests
+# ==============================
+# Buffered responses to GET/HEAD get an ETag and answer If-None-Match with 304.
+# Compressible responses of any method are gzipped (or brotli-compressed when the
+# optional brotli package is installed) if the client's Accept-Encoding allows it;
+# a compressed response keeps the ETag of its uncompressed body, marked weak.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = ["application/json", "application/javascript", "application/xml"]
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def compressible(mimetype):
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def negotiate_encoding():
+    """Best of br/gzip for the current request's Accept-Encoding, or None for identity."""
+    offered = ["gzip"]
+    try:
+        import brotli  # optional
+        offered.insert(0, "br")
+    except ImportError:
+        pass
+    return request.accept_encodings.best_match(offered)
+
+
+def _compress(data, encoding, level):
+    if encoding == "br":
+        import brotli
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def finalize_response(response):
+    """after_request hook: ETag, conditional GET and content negotiation for buffered responses."""
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if request.method in ("GET", "HEAD") and response.status_code == 200:
+        if "ETag" not in response.headers:
+            response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+        if not response.cache_control.max_age and not response.cache_control.no_store:
+            response.cache_control.no_cache = True  # may be stored, but revalidated with the ETag
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    if response.status_code != 200 or "Content-Encoding" in response.headers or not compressible(response.mimetype):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    encoding = negotiate_encoding()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(_compress(data, encoding, current_app.config.get("COMPRESS_LEVEL", COMPRESS_LEVEL)))
+    response.headers["Content-Encoding"] = encoding
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _gzip_file(path):
+    """Yields a file gzip-compressed, a chunk at a time."""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def send_text_file(path, download_name):
+    """
+    send_file for large text files such as logs: conditional on the file's ETag, and
+    streamed gzip-compressed when the client accepts gzip.
+    """
+    response = send_file(path, as_attachment=True, download_name=download_name, conditional=True)
+    if response.status_code != 200 or request.accept_encodings.best_match(["gzip"]) is None:
+        return response
+    etag, _ = response.get_etag()
+    response.close()
+    compressed = Response(_gzip_file(path), mimetype=response.mimetype,
+                          headers={"Content-Disposition": response.headers["Content-Disposition"],
+                                   "Content-Encoding": "gzip"})
+    compressed.vary.add("Accept-Encoding")
+    compressed.cache_control.no_cache = True
+    compressed.set_etag(etag, weak=True)
+    return compressed
+
+
+# Slow third-party imports that the views above load on first use.
+HEAVY_MODULES = ["pandas", "google.generativeai"]
+_warm_up_lock = threading.Lock()
+
+
+def configure_logging():
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
+    handler = logging.FileHandler(LOG_FILE, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',
+                                           datefmt='%Y-%m-%d %H:%M:%S'))
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+
+
+def create_app(config=None):
+    """Builds the Flask app. Views and their dependencies are loaded lazily; see warm_up()."""
+    load_dotenv()
+    configure_logging()
+
+    app = Flask(__name__)
+    CORS(app)  # Enable CORS for all domains
+    app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+    if config:
+        app.config.update(config)
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+
+    @app.errorhandler(404)
+    def not_found_error(error):
+        if request.path == "/health":
+            return "", 204  # ✅ Return 204 No Content for /health requests to suppress logging
+        return jsonify({"error": "Endpoint not found"}), 404
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        return jsonify({"error": "Internal server error"}), 500
+
+    if not EXCLUDE_HEALTH_ROUTE:
+        @app.route('/health', methods=['GET'])
+        def health_check():
+            return jsonify({"status": "healthy"}), 200
+
+    @app.route('/ready', methods=['GET'])
+    def ready_check():
+        """Readiness: 200 once warm-up has run and uploads and the result store are usable."""
+        unavailable = warm_up(app)
+        problems = []
+        if not os.access(app.config["UPLOAD_FOLDER"], os.W_OK):
+            problems.append("upload folder is not writable")
+        try:
+            from result_store import get_result_store
+            get_result_store().ping()
+        except Exception as e:
+            problems.append(f"result store: {str(e)}")
+        status = {"status": "not ready" if problems else "ready", "pid": os.getpid(),
+                  "problems": problems, "unavailable": unavailable}
+        return jsonify(status), 503 if problems else 200
+
+    @app.route("/download-log", methods=["GET"])
+    def download_log():
+        log_path = os.path.abspath(LOG_FILE)  # send_file resolves relative paths against the app root
+        if os.path.exists(log_path):
+            return send_text_file(log_path, os.path.basename(LOG_FILE))
+        return jsonify({"error": "Log file not found"}), 404
+
+    app.after_request(finalize_response)
+
+    @app.teardown_appcontext
+    def close_result_store(exc):
+        # Only once a view has loaded the store; importing it here would undo the lazy loading.
+        result_store = sys.modules.get("result_store")
+        if result_store is not None:
+            result_store.close_result_store()
+
+    lazy_views = []
+    for import_name, endpoint, rules in VIEWS:
+        view = LazyView(import_name, endpoint)
+        lazy_views.append(view)
+        for rule, methods in rules:
+            app.add_url_rule(rule, endpoint=endpoint, view_func=view, methods=methods)
+    app.extensions["lazy_views"] = lazy_views
+    app.extensions["warm_up_failed"] = None
+    return app
+
+
+def warm_up(app):
+    """
+    Imports every lazily loaded view and the heavy modules behind them and preloads
+    the claim validators, so a worker can pay the cost before it takes traffic.
+    Only runs once per app. Views that fail to import are logged and left to answer
+    503. Returns the import names that failed.
+    """
+    with _warm_up_lock:
+        if app.extensions["warm_up_failed"] is None:
+            app.extensions["warm_up_failed"] = _warm_up(app)
+        return app.extensions["warm_up_failed"]
+
+
+def _warm_up(app):
+    failed = []
+    for view in app.extensions["lazy_views"]:
+        try:
+            view.load()
+        except ImportError as e:
+            logging.warning(f"Warm-up could not load {view.import_name}: {str(getattr(e, 'exception', e))}")
+            failed.append(view.import_name)
+    for module in HEAVY_MODULES:
+        try:
+            import_string(module)
+        except ImportError as e:
+            logging.warning(f"Warm-up could not import {module}: {str(e)}")
+            failed.append(module)
+    from error_logger import preload_validators
+    preload_validators()
+    logging.info(f"Warm-up finished, unavailable: {failed}")
+    return failed
+
+
+app = create_app()
+
+
+def __getattr__(name):
+    # `indium:asgi_app` is only built when an ASGI server asks for it.
+    if name == "asgi_app":
+        from asgiref.wsgi import WsgiToAsgi
+        globals()["asgi_app"] = WsgiToAsgi(app)  # Convert Flask app to an ASGI-compatible app
+        return globals()["asgi_app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# ✅ Conditionally exclude the `/health` route
-EXCLUDE_HEALTH_ROUTE = True  # Set to True to remove the `/health` route
-app.config["UPLOAD_FOLDER"] = 'UPLOAD_FOLDER'
-if not os.path.exists('UPLOAD_FOLDER'):
-    os.makedirs('UPLOAD_FOLDER')
-
-if not EXCLUDE_HEALTH_ROUTE:
-    @app.route('/health', methods=['GET'])
-    def health_check():
-        return jsonify({"status": "healthy"}), 200
-    
-def process_file(file_path, previous_record_count=None):
-    logger.info(f"Processing file: {file_path}")
-    # Process logic here
-    return {"message": f"Processed {file_path}", "record_count": previous_record_count}
-
-def process_files_in_folder(folder_path, previous_counts=None):
-    if not os.path.exists(folder_path):
-        return {"error": "Folder not found"}
-    files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-    results = [process_file(f, previous_counts.get(os.path.basename(f))) for f in files]
-    return results
-
-class ClaimFileProcessor(MethodView):
-    def post(self, action):
-        if action == "process-file":
-            return self.process_file()
-        elif action == "process-folder":
-            return self.process_folder()
-        elif action == "upload-file":
-            return self.upload_file()
-        return jsonify({"error": "Invalid action"}), 400
-
-    def process_file(self):
-        data = request.json
-        file_path = data.get("file_path")
-        if not file_path or not os.path.exists(file_path):
-            return jsonify({"error": "File not found"}), 400
-        result = process_file(file_path)
-        return jsonify(result)
-
-    def process_folder(self):
-        previous_counts = {"input_file_28.csv": 74, "input_file_14.csv": 70}
-        result = process_files_in_folder(app.config["UPLOAD_FOLDER"], previous_counts)
-        return jsonify(result)
-
-    def upload_file(self):
-        if "vendor_file" not in request.files:
-            return jsonify({"error": "No file provided"}), 400
-        file = request.files["vendor_file"]
-        if file.filename == "":
-            return jsonify({"error": "No selected file"}), 400
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(file_path)
-        previous_counts = {"input_file_28.csv": 74, "input_file_14.csv": 70}
-        result = process_file(file_path, previous_counts.get(filename))
-        return jsonify(result)
-
-@app.route("/download-log", methods=["GET"])
-def download_log():
-    if os.path.exists(LOG_FILE):
-        return send_file(LOG_FILE, as_attachment=True)
-    return jsonify({"error": "Log file not found"}), 404
-
-claim_processor_view = ClaimFileProcessor.as_view("claim_processor")
-app.add_url_rule("/api/<string:action>", view_func=claim_processor_view, methods=["POST"])
-
-#  Register routes from external file
-app.add_url_rule('/upload/', view_func=UploadAPI.as_view('upload_api'))
-app.add_url_rule('/process', view_func=ColumnMapper.as_view('column_mapper'), methods=['POST'])
-app.add_url_rule('/map', view_func=ColumnMapperAPI.as_view('ColumnMapperAPI'), methods=['POST'])
-app.add_url_rule("/api/<string:action>", view_func=ClaimFileProcessor, methods=["POST"])
 
 if __name__ == "__main__":
     print("\033[92m[INFO] Starting Flask server on port 5000...\033[0m")
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    warm_up(app)
+    app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,648 @@
+import io
+import os
+import csv
+import json
+import bz2
+import mmap
+import gzip
+import zlib
+import codecs
+import shutil
+import zipfile
+import tempfile
+
+# ==============================
+# Format Detection
+# ==============================
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+ZIP_MAGIC = b"PK\x03\x04"
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bz2", ".zip": "zip"}
+
+SNIFF_BYTES = 64 * 1024
+SNIFF_LINES = 5
+CANDIDATE_DELIMITERS = [",", "|", "\t", ";"]
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+def detect_compression(head):
+    """Returns 'gzip', 'bz2', 'zip' or None based on the first bytes of a file."""
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(BZIP2_MAGIC):
+        return "bz2"
+    if head.startswith(ZIP_MAGIC):
+        return "zip"
+    return None
+
+
+def strip_compression_suffix(filename):
+    """'claims.csv.gz' -> 'claims.csv'. Names without a compression suffix are returned as is."""
+    root, ext = os.path.splitext(filename)
+    if ext.lower() in COMPRESSION_SUFFIXES:
+        return root
+    return filename
+
+
+def sniff_delimiter(sample):
+    """Picks the delimiter that occurs most often outside quotes in the first few lines."""
+    counts = dict.fromkeys(CANDIDATE_DELIMITERS, 0)
+    in_quotes = False
+    lines = 0
+    for char in sample:
+        if char == '"':
+            in_quotes = not in_quotes
+        elif in_quotes:
+            continue
+        elif char == "\n":
+            lines += 1
+            if lines >= SNIFF_LINES:
+                break
+        elif char in counts:
+            counts[char] += 1
+    best = max(CANDIDATE_DELIMITERS, key=lambda d: counts[d])
+    return best if counts[best] else ","
+
+
+# ==============================
+# Stream Helpers
+# ==============================
+class PrefixedStream(io.RawIOBase):
+    """Replays bytes that were already read for sniffing, then continues with the wrapped stream."""
+
+    def __init__(self, prefix, stream):
+        self._prefix = memoryview(prefix)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._stream.read(len(buffer))
+        if not data:
+            return 0
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
+
+
+def _read_head(stream, size=SNIFF_BYTES):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b"".join(chunks)
+
+
+def _open_zip_member(stream):
+    if not stream.seekable():
+        # zipfile needs random access to the central directory.
+        spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        shutil.copyfileobj(stream, spooled)
+        spooled.seek(0)
+        stream = spooled
+    archive = zipfile.ZipFile(stream)
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if not members:
+        raise ValueError("Zip archive contains no files")
+    return archive.open(members[0]), members[0].filename
+
+
+def open_decompressed(source):
+    """
+    Opens a path or binary file object and transparently decompresses gzip, bz2 and zip input.
+
+    Returns (binary_stream, compression, member_name). member_name is the name of the
+    file read from a zip archive and None otherwise.
+    """
+    stream = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+    head = _read_head(stream, 4)
+    compression = detect_compression(head)
+    if stream.seekable():
+        stream.seek(-len(head), io.SEEK_CUR)
+    else:
+        stream = io.BufferedReader(PrefixedStream(head, stream))
+
+    member_name = None
+    if compression == "gzip":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    elif compression == "bz2":
+        stream = bz2.BZ2File(stream, mode="rb")
+    elif compression == "zip":
+        stream, member_name = _open_zip_member(stream)
+    return stream, compression, member_name
+
+
+def open_claim_stream(source, encoding="utf-8", errors="strict"):
+    """
+    Opens a delimited claim file for csv.reader.
+
+    Compression and delimiter are detected from the first bytes, and the data is
+    decompressed as it is read. Returns (text_stream, delimiter).
+    """
+    if isinstance(source, io.TextIOBase):
+        head_lines = [source.readline() for _ in range(SNIFF_LINES)]
+        delimiter = sniff_delimiter("".join(head_lines))
+        return _LineChain(head_lines, source), delimiter
+
+    binary, _, _ = open_decompressed(source)
+    head = _read_head(binary)
+    delimiter = sniff_delimiter(head.decode(encoding, errors="replace"))
+    buffered = io.BufferedReader(PrefixedStream(head, binary), buffer_size=SNIFF_BYTES)
+    return io.TextIOWrapper(buffered, encoding=encoding, errors=errors, newline=""), delimiter
+
+
+class _LineChain:
+    """Iterates over lines read ahead for sniffing, then over the rest of a text stream."""
+
+    def __init__(self, head_lines, stream):
+        self._head_lines = [line for line in head_lines if line]
+        self._stream = stream
+
+    def __iter__(self):
+        yield from self._head_lines
+        yield from self._stream
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def close(self):
+        pass
+
+
+# ==============================
+# Record Boundaries
+# ==============================
+def ends_in_quoted_field(record, delimiter, quote='"'):
+    """
+    True if a csv record, read up to (not including) a newline, is inside a quoted
+    field there, so that the newline belongs to the field. Works on str or bytes
+    (with bytes delimiter and quote). As in the csv module, a quote only opens a
+    quoted field at the start of a field; elsewhere, as in 5" or O"Brien, it is data.
+    """
+    pos = 0
+    while True:
+        if record.startswith(quote, pos):
+            pos += 1
+            while True:
+                close = record.find(quote, pos)
+                if close == -1:
+                    return True
+                pos = close + 1
+                if not record.startswith(quote, pos):
+                    break
+                pos += 1  # a doubled quote is a literal quote
+        pos = record.find(delimiter, pos)
+        if pos == -1:
+            return False
+        pos += 1
+
+
+class UnparsableRecord(list):
+    """Stands in, as an empty row, for a record csv could not parse; error says why."""
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+
+def parse_records(lines, delimiter):
+    """csv.reader over lines, yielding an UnparsableRecord for each record csv rejects."""
+    reader = csv.reader(lines, delimiter=delimiter)
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # The reader starts afresh with the next line.
+            yield UnparsableRecord(str(e))
+
+
+# ==============================
+# Incremental Parsing
+# ==============================
+def split_records(text, final=False, delimiter=","):
+    """
+    Splits decoded text into complete csv records.
+    Returns (records, remainder); the remainder is an unfinished record to be
+    prefixed to the next piece of text. Newlines inside quoted fields do not end a
+    record (see ends_in_quoted_field).
+    """
+    cut = text.rfind("\n")
+    if cut == -1 and not final:
+        return [], text
+    if final:
+        body, remainder = text, ""
+    else:
+        body, remainder = text[:cut], text[cut + 1:]
+    lines = body.split("\n")
+    ends_with_newline = final and lines and lines[-1] == ""
+    if ends_with_newline:
+        lines.pop()
+    if '"' not in body:
+        return lines, remainder
+
+    records = []
+    current = []
+    quoted = False  # current ends inside a quoted field
+    for line in lines:
+        current.append(line)
+        if '"' in line:
+            quoted = ends_in_quoted_field("\n".join(current), delimiter)
+        if not quoted:
+            records.append("\n".join(current))
+            current = []
+    if current and final:
+        # A quoted field left open at the end of the input runs to the very end, newline included.
+        records.append("\n".join(current) + ("\n" if ends_with_newline else ""))
+    elif current:
+        # An open quoted field continues in the next piece of text.
+        remainder = "\n".join(current) + "\n" + remainder
+    return records, remainder
+
+
+class IncrementalRowParser:
+    """
+    Push-based counterpart of open_claim_stream.
+
+    Bytes are fed in as they arrive and complete csv rows come out. gzip and bz2
+    input is decompressed incrementally and the delimiter is sniffed once the
+    first lines are in. Zip archives need their central directory, so they are
+    spooled and parsed when the parser is closed.
+    """
+
+    def __init__(self, encoding="utf-8", errors="strict"):
+        self.encoding = encoding
+        self.errors = errors
+        self.delimiter = None
+        self.compression = None
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        self._decompressor = None
+        self._head = b""
+        self._checked = False
+        self._spool = None
+        self._text = ""
+
+    @property
+    def picklable(self):
+        """Plain-text parsers can be pickled; decompressor state and zip spools cannot."""
+        return self._decompressor is None and self._spool is None
+
+    def __getstate__(self):
+        if not self.picklable:
+            raise TypeError("A parser of compressed input cannot be pickled")
+        state = self.__dict__.copy()
+        state["_decoder"] = self._decoder.getstate()
+        return state
+
+    def __setstate__(self, state):
+        decoder_state = state.pop("_decoder")
+        self.__dict__.update(state)
+        self._decoder = codecs.getincrementaldecoder(self.encoding)(errors=self.errors)
+        self._decoder.setstate(decoder_state)
+
+    def feed(self, data):
+        """Consumes a chunk of raw bytes and returns the rows it completed."""
+        self.bytes_read += len(data)
+        if not self._checked:
+            self._head += data
+            if len(self._head) < 4:
+                return []
+            data = self._start(self._head)
+            self._head = b""
+        if self._spool is not None:
+            self._spool.write(data)
+            return []
+        return self._feed_text(self._decoder.decode(self._decompress(data)))
+
+    def close(self):
+        """Flushes buffered input and returns an iterable of the remaining rows."""
+        if not self._checked:
+            data = self._start(self._head)
+            self._head = b""
+            if self._spool is None:
+                self._text += self._decoder.decode(self._decompress(data))
+        if self._spool is not None:
+            self._spool.seek(0)
+            stream, self.delimiter = open_claim_stream(self._spool, self.encoding, self.errors)
+            return parse_records(stream, self.delimiter)
+        return self._feed_text(self._decoder.decode(b"", final=True), final=True)
+
+    def _start(self, head):
+        self._checked = True
+        self.compression = detect_compression(head)
+        if self.compression == "gzip":
+            self._decompressor = zlib.decompressobj(31)
+        elif self.compression == "bz2":
+            self._decompressor = bz2.BZ2Decompressor()
+        elif self.compression == "zip":
+            self._spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        return head
+
+    def _decompress(self, data):
+        if self._decompressor is None:
+            return data
+        out = []
+        while data:
+            if self._decompressor.eof:
+                # Concatenated gzip/bz2 members start a fresh decompressor.
+                self._start(data)
+            out.append(self._decompressor.decompress(data))
+            data = self._decompressor.unused_data if self._decompressor.eof else b""
+        return b"".join(out)
+
+    def _feed_text(self, text, final=False):
+        self._text += text
+        if self.delimiter is None:
+            if not final and self._text.count("\n") < SNIFF_LINES and len(self._text) < SNIFF_BYTES:
+                return []
+            self.delimiter = sniff_delimiter(self._text)
+        records, self._text = split_records(self._text, final, self.delimiter)
+        if not records:
+            return []
+        return list(parse_records(records, self.delimiter))
+
+
+# ==============================
+# Memory-Mapped Claim Files
+# ==============================
+class MappedClaimFile:
+    """
+    Memory-mapped access to an uncompressed delimited claim file.
+
+    Record boundaries are found with bytes searches on the mapping and records are
+    handed to csv.reader as memoryview slices, so the file is never copied into a
+    list of rows. The first and last records can be read without scanning the file.
+    """
+
+    def __init__(self, path, encoding="utf-8"):
+        self.path = path
+        self.encoding = encoding
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = None
+        self._view = memoryview(b"")
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self._map, "madvise"):
+                self._map.madvise(mmap.MADV_SEQUENTIAL)
+            self._view = memoryview(self._map)
+        self.delimiter = sniff_delimiter(str(self._view[:SNIFF_BYTES], encoding, "replace"))
+        self._delimiter_bytes = self.delimiter.encode(encoding)
+
+    @classmethod
+    def open(cls, path, encoding="utf-8"):
+        """Returns a MappedClaimFile, or None when the file is compressed and has to be streamed."""
+        with open(path, "rb") as f:
+            if detect_compression(f.read(4)):
+                return None
+        return cls(path, encoding)
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def record_end(self, start, stop=None):
+        """Returns the offset just past the record starting at start, including its newline."""
+        mm = self._map
+        stop = self.size if stop is None else stop
+        pos = start
+        while True:
+            newline = mm.find(b"\n", pos, stop)
+            if newline == -1:
+                return stop
+            # A newline inside a quoted field does not end the record.
+            if mm.find(b'"', start, newline) == -1 or not ends_in_quoted_field(mm[start:newline], self._delimiter_bytes, b'"'):
+                return newline + 1
+            pos = newline + 1
+
+    def first_record(self):
+        """Returns (row, end_offset) for the first record, or (None, 0) for an empty file."""
+        if not self.size:
+            return None, 0
+        end = self.record_end(0)
+        return self._parse(0, end), end
+
+    def last_record(self):
+        """Returns (row, start_offset) for the last line, or (None, size) for an empty file."""
+        if not self.size:
+            return None, self.size
+        end = self.size
+        if self._map[end - 1] == 0x0A:
+            end -= 1
+            if end and self._map[end - 1] == 0x0D:
+                end -= 1
+        start = self._map.rfind(b"\n", 0, end) + 1
+        return self._parse(start, end), start
+
+    def record_at(self, offset, stop=None):
+        """
+        Returns (row, start, end) for the first record starting at or after offset, or
+        (None, stop, stop) if there is none before stop. Used to sample records at random
+        byte offsets; a newline inside a quoted field can be mistaken for a record boundary.
+        """
+        stop = self.size if stop is None else stop
+        start = offset
+        if start > 0 and self._map[start - 1] != 0x0A:
+            newline = self._map.find(b"\n", start, stop)
+            start = stop if newline == -1 else newline + 1
+        if start >= stop:
+            return None, stop, stop
+        end = self.record_end(start, stop)
+        return self._parse(start, end), start, end
+
+    def rows(self, start, stop):
+        """Yields (row, end_offset) for each record between the start and stop offsets."""
+        position = start
+
+        def records():
+            nonlocal position
+            view = self._view
+            encoding = self.encoding
+            while position < stop:
+                end = self.record_end(position, stop)
+                # No slice of the view outlives the line, or an error here could not close the map.
+                text = str(view[position:end], encoding)
+                position = end
+                yield text
+
+        for row in parse_records(records(), self.delimiter):
+            yield row, position
+
+    def _parse(self, start, end):
+        text = str(self._view[start:end], self.encoding)
+        return next(parse_records([text], self.delimiter), [])
+
+
+# ==============================
+# JSON / NDJSON Records
+# ==============================
+JSON_READ_SIZE = 1024 * 1024
+MAX_JSON_RECORD_SIZE = 64 * 1024 * 1024
+JSON_WHITESPACE = " \t\n\r"
+JSON_NUMBER_START = "-0123456789"
+JSON_DELIMITERS = [",", "]", "}", " ", "\t", "\n", "\r"]
+# A decode error this close to the end of the buffer may only mean the value goes
+# on in the next chunk (a literal such as "fals" or an escape such as "\u00").
+JSON_TRUNCATION_SLACK = 16
+
+
+class JsonRecordReader:
+    """
+    Iterates over the records of a JSON or NDJSON document while reading it in
+    chunks, so only the record being decoded is held in memory.
+
+    Records are the elements of a top-level array, or of the first array of
+    objects (or arrays) inside a top-level object such as {"claims": [...]}. A
+    top-level object without one is itself a record, which covers NDJSON and
+    concatenated objects. Numbers are returned as their literal text, so amounts
+    are never rounded through float.
+    """
+
+    def __init__(self, source, encoding="utf-8-sig", read_size=JSON_READ_SIZE):
+        self._stream = source
+        self._read_size = read_size
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder(parse_float=str, parse_int=str)
+        self._buffer = ""
+        self._pos = 0
+        self._offset = 0  # characters dropped from the front of the buffer
+        self._eof = False
+
+    def __iter__(self):
+        while True:
+            char = self._peek()
+            if char == "":
+                return
+            if char == "[":
+                self._pos += 1
+                yield from self._items()
+            elif char == "{":
+                yield from self._object()
+            else:
+                raise self._error("Expected an object or array")
+
+    # ---- buffer ----
+    def _fill(self):
+        """Reads the next chunk. Returns False at the end of the input."""
+        if self._eof:
+            return False
+        data = self._stream.read(self._read_size)
+        text = self._decoder.decode(data, final=not data)
+        self._eof = not data
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        if len(self._buffer) > MAX_JSON_RECORD_SIZE:
+            raise self._error(f"A single record exceeds {MAX_JSON_RECORD_SIZE} characters")
+        return True
+
+    def _peek(self):
+        """Skips whitespace and returns the next character without consuming it ('' at the end)."""
+        while True:
+            buffer, pos = self._buffer, self._pos
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                return ""
+
+    def _value(self):
+        """Decodes one complete JSON value at the current position."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._truncated(e) and self._fill():
+                    continue
+                raise self._error(e.msg, e.pos)
+            # A number cut off by the end of the buffer ("12" or "3.") may go on in the next chunk.
+            if self._buffer[self._pos] in JSON_NUMBER_START and self._buffer[end:end + 1] not in JSON_DELIMITERS \
+                    and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _truncated(self, e):
+        """True if the decode error may be the end of the buffer rather than bad JSON."""
+        return e.pos >= len(self._buffer) - JSON_TRUNCATION_SLACK or e.msg.startswith("Unterminated string")
+
+    def _error(self, message, pos=None):
+        return ValueError(f"Invalid JSON at character {self._offset + (self._pos if pos is None else pos)}: {message}")
+
+    # ---- structure ----
+    def _items(self):
+        """Yields the elements of an array whose '[' has been consumed."""
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            char = self._peek()
+            self._pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise self._error("Expected ',' or ']'", self._pos - 1)
+
+    def _object(self):
+        """Yields the records inside a top-level object, or the object itself."""
+        self._pos += 1
+        fields = {}
+        streamed = False
+        if self._peek() == "}":
+            self._pos += 1
+            yield fields
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str) or self._peek() != ":":
+                raise self._error("Expected a key")
+            self._pos += 1
+            if self._peek() == "[" and not streamed:
+                self._pos += 1
+                if self._peek() in ("{", "["):
+                    streamed = True
+                    yield from self._items()
+                else:
+                    fields[key] = list(self._items())
+            else:
+                fields[key] = self._value()
+            char = self._peek()
+            self._pos += 1
+            if char == "}":
+                break
+            if char != ",":
+                raise self._error("Expected ',' or '}'", self._pos - 1)
+        if not streamed:
+            yield fields
@@ -0,0 +1,456 @@
+"""
+Local HTTP load test for the indium endpoints.
+
+    python loadtest.py --concurrency 16 --duration 60 --output result.json
+    python loadtest.py --mix upload=1,api-upload-file=2 --sizes 10KB=8,1MB=2,20MB=1
+    python loadtest.py --baseline last_release.json   # exit status 1 on a regression
+
+Starts the app (gunicorn with gunicorn.conf.py by default, or the Flask server)
+in a scratch directory, with GEMINI_API_ENDPOINT pointed at a local stub of the
+generateContent API, then drives the endpoints from --concurrency client threads
+for --duration seconds. Each thread sends its next request as soon as the last
+one is answered, picking the endpoint from --mix and the upload size from --sizes.
+--url targets an instance that is already running instead.
+
+The JSON report has throughput, error rate, status counts and p50/p95/p99 latency
+overall, per endpoint and per upload size. With --baseline, endpoints whose
+throughput fell or whose p95 latency rose by more than --tolerance are listed
+under "regressions".
+
+Endpoints: upload (/upload/), api-upload-file (/api/upload-file), process
+(/process) and map (/map). map is not in the default mix: /map is served by
+map.ColumnMapperAPI, which is not in this tree, so it answers 503.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import http.server
+from urllib.parse import urlsplit
+from error_logger import CLAIM_SCHEMA
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = "upload=1,api-upload-file=1,process=1"
+DEFAULT_SIZES = "10KB=6,1MB=3,10MB=1"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_DURATION = 30
+DEFAULT_WARMUP = 3
+DEFAULT_TOLERANCE = 0.1
+READY_TIMEOUT = 120
+REQUEST_TIMEOUT = 300
+SIZE_UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "B": 1}
+
+# ==============================
+# Gemini Stub
+# ==============================
+class GeminiStub:
+    """
+    Answers generateContent calls like the REST API does, after `latency` seconds
+    (+/- 20%), with an empty JSON mapping; `error_rate` of the calls get a 500.
+    """
+
+    def __init__(self, latency=0.2, error_rate=0.0):
+        stub = self
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, body = stub._answer()
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _answer(self):
+        time.sleep(self.latency * random.uniform(0.8, 1.2))
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+        if failed:
+            return 500, {"error": {"code": 500, "message": "stub failure", "status": "INTERNAL"}}
+        return 200, {"candidates": [{"content": {"parts": [{"text": "{}"}], "role": "model"},
+                                     "finishReason": "STOP", "index": 0}]}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return {"latency_ms": round(self.latency * 1000), "error_rate": self.error_rate,
+                "calls": self.calls, "errors": self.errors}
+
+
+# ==============================
+# Test Data
+# ==============================
+CLAIM_ROW = ("CLM,{n},AB-2024-{n},,G1,,,,123-45-6789,P{n},Doe,Jo,1 Main St,,Springfield,CA,90210,1,1980-01-01,,"
+             "Pharm,R,2024-01-02,RX{n},2024-01-03,I,NDC1,Lab,B,10mg,30,60,Tab,Y,100.00,80.00,10.00,5.00,5.00,20.00,"
+             "2024-01-05,A\n")
+STANDARD_COLUMNS = [field["name"] for field in CLAIM_SCHEMA]
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+
+def parse_weights(text):
+    """'a=3,b=1' -> [("a", 3.0), ("b", 1.0)]; a missing weight is 1."""
+    weights = []
+    for item in text.split(","):
+        key, _, weight = item.strip().partition("=")
+        weights.append((key, float(weight or 1)))
+    return weights
+
+
+def claim_file(size):
+    """A claim file with a header, claim rows up to about `size` bytes, and a matching trailer."""
+    rows = ["HDR,2024-01-05\n"]
+    total = len(rows[0])
+    n = 0
+    while total < size or n == 0:
+        n += 1
+        rows.append(CLAIM_ROW.format(n=n))
+        total += len(rows[-1])
+    rows.append(f"TRL,{n}\n")
+    return "".join(rows).encode("utf-8")
+
+
+def vendor_layout(size):
+    """
+    Vendor file for /process and /map: a label line, then the vendor's column names
+    (extract_columns takes the first data row as the header), then claim rows.
+    Names are reworded so some columns are matched locally and the rest go to the model.
+    """
+    names = [name.upper().replace("_", "") if i % 3 else f"VND_{i}" for i, name in enumerate(STANDARD_COLUMNS)]
+    lines = [",".join(f"c{i}" for i in range(len(names))) + "\n", ",".join(names) + "\n"]
+    body = claim_file(size).decode("utf-8").splitlines(keepends=True)[1:-1]
+    return ("".join(lines) + "".join(body)).encode("utf-8")
+
+
+def standard_layout():
+    return ("Field Name\n" + "\n".join(STANDARD_COLUMNS) + "\n").encode("utf-8")
+
+
+def multipart(files):
+    """Encodes {field: (filename, bytes)} as multipart/form-data. Returns (content_type, body)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, (filename, data) in files.items():
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                     f"Content-Type: text/csv\r\n\r\n".encode("utf-8"))
+        parts.append(data)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return f"multipart/form-data; boundary={boundary}", b"".join(parts)
+
+
+# Endpoint name -> (path, function building the multipart files for an upload size)
+SCENARIOS = {
+    "upload": ("/upload/", lambda size: {"file": ("loadtest_claims.csv", claim_file(size))}),
+    "api-upload-file": ("/api/upload-file?persist=0",
+                        lambda size: {"file": ("loadtest_claims.csv", claim_file(size))}),
+    "process": ("/process", lambda size: {"standard_file": ("standard.csv", standard_layout()),
+                                          "vendor_file": ("vendor.csv", vendor_layout(size))}),
+    "map": ("/map", lambda size: {"standard_file": ("standard.csv", standard_layout()),
+                                  "vendor_file": ("vendor.csv", vendor_layout(size))}),
+}
+
+
+# ==============================
+# App Under Test
+# ==============================
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(workdir, stub_url, server="gunicorn", workers=None):
+    """Starts the app on a free port with its files in workdir. Returns (process, base_url)."""
+    port = _free_port()
+    env = dict(os.environ, GEMINI_API_ENDPOINT=stub_url, GEMINI_API_KEY="loadtest",
+               RESULT_DB=os.path.join(workdir, "validation_results.db"),
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+    if server == "gunicorn":
+        env.update(BIND=f"127.0.0.1:{port}", ACCESS_LOG=os.devnull)
+        if workers:
+            env["WEB_CONCURRENCY"] = str(workers)
+        command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py")]
+    else:
+        command = [sys.executable, "-c",
+                   f"from wsgi import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return process, f"http://127.0.0.1:{port}"
+
+
+def wait_until_ready(base_url, process=None, timeout=READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    url = urlsplit(base_url)
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"App exited with status {process.returncode} before it was ready")
+        try:
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=5)
+            conn.request("GET", "/ready")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"App at {base_url} was not ready within {timeout}s")
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# ==============================
+# Load Generation
+# ==============================
+class LoadGenerator:
+    """Closed-loop client threads; every answered request is recorded as a sample."""
+
+    def __init__(self, base_url, mix, sizes, concurrency=DEFAULT_CONCURRENCY, seed=None):
+        self.url = urlsplit(base_url)
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.samples = []  # (endpoint, size label, status, seconds, bytes sent, finished at)
+        self._lock = threading.Lock()
+        self._requests = []  # (endpoint, size label, path, content type, body), with weights
+        self._weights = []
+        for endpoint, endpoint_weight in mix:
+            path, build = SCENARIOS[endpoint]
+            for (label, size), size_weight in sizes:
+                content_type, body = multipart(build(size))
+                self._requests.append((endpoint, label, path, content_type, body))
+                self._weights.append(endpoint_weight * size_weight)
+
+    def run(self, duration):
+        stop_at = time.monotonic() + duration
+        threads = [threading.Thread(target=self._client, args=(stop_at, random.Random(self.random.random())))
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.samples
+
+    def _client(self, stop_at, rng):
+        conn = None
+        while time.monotonic() < stop_at:
+            endpoint, label, path, content_type, body = rng.choices(self._requests, self._weights)[0]
+            started = time.monotonic()
+            for attempt in range(2):
+                reused = conn is not None
+                if conn is None:
+                    conn = http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=REQUEST_TIMEOUT)
+                try:
+                    status = self._post(conn, path, content_type, body)
+                    break
+                except (OSError, http.client.HTTPException) as e:
+                    status = type(e).__name__
+                    conn.close()
+                    conn = None
+                    # A kept-alive connection the server has since closed is retried once on a new one.
+                    if not (reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError))):
+                        break
+            finished = time.monotonic()
+            with self._lock:
+                self.samples.append((endpoint, label, status, finished - started, len(body), finished))
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _post(conn, path, content_type, body):
+        try:
+            conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the server may have answered without reading the whole body; read that answer
+        response = conn.getresponse()
+        response.read()
+        if response.will_close:
+            conn.close()
+        return response.status
+
+
+# ==============================
+# Report
+# ==============================
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-fraction * len(sorted_values) // 1)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(sample[3] for sample in samples)
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[2])] = statuses.get(str(sample[2]), 0) + 1
+    errors = sum(1 for sample in samples if not isinstance(sample[2], int) or sample[2] >= 400)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / seconds, 2) if seconds else 0.0,
+        "upload_mb_s": round(sum(sample[4] for sample in samples) / seconds / 1024 ** 2, 2) if seconds else 0.0,
+        "status": statuses,
+        "latency_ms": {"p50": ms(percentile(latencies, 0.50)), "p95": ms(percentile(latencies, 0.95)),
+                       "p99": ms(percentile(latencies, 0.99)), "max": ms(latencies[-1] if latencies else None),
+                       "mean": ms(sum(latencies) / len(latencies) if latencies else None)},
+    }
+
+
+def build_report(samples, started, seconds, config, stub=None):
+    """Groups the samples that finished inside the measured window [started, started + seconds)."""
+    measured = [sample for sample in samples if started <= sample[5] < started + seconds]
+    report = {"config": config, "measured_seconds": round(seconds, 2), "total": summarize(measured, seconds),
+              "endpoints": {}, "sizes": {}}
+    for key, index in (("endpoints", 0), ("sizes", 1)):
+        for name in dict.fromkeys(sample[index] for sample in measured):
+            report[key][name] = summarize([sample for sample in measured if sample[index] == name], seconds)
+    if stub is not None:
+        report["gemini_stub"] = stub.stats()
+    return report
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Endpoints (and the total) whose throughput or p95 latency got worse than baseline by more than tolerance."""
+    regressions = []
+    pairs = [("total", report["total"], baseline.get("total"))]
+    pairs += [(name, stats, baseline.get("endpoints", {}).get(name)) for name, stats in report["endpoints"].items()]
+    for name, current, previous in pairs:
+        if not previous:
+            continue
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append({"endpoint": name, "metric": "throughput_rps",
+                                "baseline": previous["throughput_rps"], "current": current["throughput_rps"]})
+        p95, previous_p95 = current["latency_ms"]["p95"], previous["latency_ms"]["p95"]
+        if p95 is not None and previous_p95 is not None and p95 > previous_p95 * (1 + tolerance):
+            regressions.append({"endpoint": name, "metric": "p95_ms", "baseline": previous_p95, "current": p95})
+        if current["error_rate"] > previous["error_rate"] + tolerance / 10:
+            regressions.append({"endpoint": name, "metric": "error_rate",
+                                "baseline": previous["error_rate"], "current": current["error_rate"]})
+    return regressions
+
+
+# ==============================
+# Command Line
+# ==============================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the indium endpoints against a local Gemini stub.")
+    parser.add_argument("--url", help="test an already running instance instead of starting one")
+    parser.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, help="gunicorn workers (default: gunicorn.conf.py)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="client threads")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=DEFAULT_WARMUP, help="unmeasured seconds before that")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights, from {sorted(SCENARIOS)}")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="upload size weights, e.g. 10KB=6,1MB=3,10MB=1")
+    parser.add_argument("--stub-latency", type=float, default=200, help="Gemini stub latency in ms")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0, help="share of stub calls that fail")
+    parser.add_argument("--seed", type=int, help="seed for the request sequence")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative throughput drop / p95 rise against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory (server.log, results)")
+    args = parser.parse_args(argv)
+    args.mix = parse_weights(args.mix)
+    unknown = [endpoint for endpoint, _ in args.mix if endpoint not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoint(s) in --mix: {unknown}")
+    args.sizes = [((label, parse_size(label)), weight) for label, weight in parse_weights(args.sizes)]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="indium-loadtest-")
+    stub = process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            stub = GeminiStub(args.stub_latency / 1000, args.stub_error_rate).start()
+            process, base_url = start_app(workdir, stub.url, args.server, args.workers)
+        print(f"Waiting for {base_url} ...", file=sys.stderr)
+        wait_until_ready(base_url, process)
+
+        generator = LoadGenerator(base_url, args.mix, args.sizes, args.concurrency, args.seed)
+        print(f"Running {args.concurrency} client(s) for {args.warmup}s warm-up + {args.duration}s ...",
+              file=sys.stderr)
+        started = time.monotonic() + args.warmup
+        samples = generator.run(args.warmup + args.duration)
+        config = {"url": base_url if args.url else None, "server": None if args.url else args.server,
+                  "workers": args.workers, "concurrency": args.concurrency, "duration": args.duration,
+                  "warmup": args.warmup, "mix": dict(args.mix),
+                  "sizes": {label: weight for (label, _), weight in args.sizes}, "seed": args.seed,
+                  "cpu_count": os.cpu_count(), "python": sys.version.split()[0]}
+        report = build_report(samples, started, args.duration, config, stub)
+        if args.baseline:
+            with open(args.baseline) as f:
+                report["regressions"] = compare(report, json.load(f), args.tolerance)
+    finally:
+        if process is not None:
+            stop_app(process)
+        if stub is not None:
+            stub.stop()
+        if args.keep:
+            print(f"Scratch directory: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,53 +1,478 @@
 
 
-import pandas as pd
 import os
+import io
 import json
-import google.generativeai as genai
-from flask import Flask, request, jsonify
+import re
+import time
+import hashlib
+import uuid
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import request, jsonify, current_app
 from flask.views import MethodView
-import io
-from dotenv import load_dotenv
+from werkzeug.utils import secure_filename
+from error_logger import UploadPartParser
+from input_stream import (SNIFF_BYTES, open_claim_stream, open_decompressed, sniff_delimiter,
+                          strip_compression_suffix)
+from memory_budget import AdaptiveBatch, JobMemory, frame_size
 
-load_dotenv()
+# pandas and google.generativeai are slow to import, so they are loaded on first use.
+# Environment variables from .env are loaded by the app (see indium.create_app).
 
-app = Flask(__name__)
+def _configure_genai():
+    """Configures the Gemini client. GEMINI_API_ENDPOINT points it at another server, e.g. a local stub."""
+    import google.generativeai as genai
+    endpoint = os.environ.get("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=os.environ.get("GEMINI_API_KEY", "stub"), transport="rest",
+                        client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])  # Use environment variable for security
+    return genai
 
 # Initialize the Gemini AI model
 def get_gen_ai_model():
     """Initialize and return the Gemini AI model."""
-    genai.configure(api_key=os.environ["GEMINI_API_KEY"])  # Use environment variable for security
+    genai = _configure_genai()
     return genai.GenerativeModel("gemini-2.0-flash-exp")
 
 
 # Function to read files from Flask request
 def read_file(file_storage):
-    """Reads a CSV or Excel file from Flask FileStorage object."""
+    """Reads a CSV (optionally compressed, any delimiter) or Excel file from Flask FileStorage object."""
     if not file_storage:
         raise ValueError("No file provided")
+    import pandas as pd
 
-    file_extension = os.path.splitext(file_storage.filename)[1].lower()
+    file_extension = os.path.splitext(strip_compression_suffix(file_storage.filename))[1].lower()
     
     if file_extension == ".csv":
-        return pd.read_csv(io.StringIO(file_storage.read().decode('utf-8', errors='ignore')), dtype=str)
+        return _read_delimited(file_storage)
     elif file_extension in [".xls", ".xlsx"]:
         return pd.read_excel(file_storage, dtype=str)
     else:
         raise ValueError("Unsupported file type. Please provide a CSV or Excel file.")
 
+def _read_delimited(file_storage, nrows=None):
+    """
+    Reads an uploaded CSV, decompressing it and detecting its delimiter like the claim
+    readers do. The upload's stream is left open, so it can be read again.
+    """
+    import pandas as pd
+    file_storage.stream.seek(0)
+    binary, _, _ = open_decompressed(file_storage.stream)
+    delimiter = sniff_delimiter(binary.read(SNIFF_BYTES).decode("utf-8", errors="ignore"))
+    binary.seek(0)
+    return pd.read_csv(binary, sep=delimiter, dtype=str, nrows=nrows, encoding_errors="ignore")
+
+def read_columns(file_storage):
+    """
+    Returns the column names of a CSV or Excel file as extract_columns sees them, and
+    the row they are on (see names_row), reading only the first rows unless the file
+    is a 'Field Name' layout.
+    """
+    import pandas as pd
+    file_extension = os.path.splitext(strip_compression_suffix(file_storage.filename))[1].lower()
+    if file_extension == ".csv":
+        df = _read_delimited(file_storage, nrows=1)
+    elif file_extension in [".xls", ".xlsx"]:
+        df = pd.read_excel(file_storage.stream, dtype=str, nrows=1)
+    else:
+        raise ValueError("Unsupported file type. Please provide a CSV or Excel file.")
+    if 'Field Name' in df.columns:
+        file_storage.stream.seek(0)
+        df = read_file(file_storage)
+    return extract_columns(df)[0], names_row(df)
+
+def names_row(df):
+    """
+    The 0-based line of the file that extract_columns takes column names from: the
+    first line after pandas' header, or None for a 'Field Name' layout, which lists
+    the names instead. Saved with a mapping so apply_mapping reads the same line.
+    """
+    return None if 'Field Name' in df.columns else 1
+
 # Function to extract column names
 def extract_columns(df):
     """Extracts column names from a DataFrame, using 'Field Name' column if available."""
     if 'Field Name' in df.columns:
-        return df['Field Name'].dropna().tolist()
+        return df['Field Name'].dropna().tolist(), df
     else:
         column_names = df.iloc[0].dropna().tolist()
         df = df[1:].reset_index(drop=True)
         df.columns = column_names
         return column_names, df
 
-def map_fields(standard_columns, vendor_columns):
-    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+# ==============================
+# Local Column Matching
+# ==============================
+# Column names are embedded as character n-gram count vectors over a vocabulary
+# built from both layouts, and the full cosine similarity matrix is one matrix product.
+NGRAM_SIZES = (2, 3)
+LOCAL_MATCH_THRESHOLD = 0.9   # pairs at or above this score are mapped without the model...
+LOCAL_MIN_MARGIN = 0.05       # ...unless another vendor column scores within this margin of them
+OFFLINE_MIN_SCORE = 0.5       # lowest score accepted when the model cannot be reached
+
+def normalize_column_name(name):
+    """'PatientFirst_Name' -> 'patient first name'."""
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(name))
+    return " ".join(re.sub(r"[^0-9a-zA-Z]+", " ", name).lower().split())
+
+def _ngrams(name):
+    padded = f" {normalize_column_name(name)} "
+    return [padded[i:i + n] for n in NGRAM_SIZES for i in range(len(padded) - n + 1)]
+
+def similarity_matrix(standard_columns, vendor_columns):
+    """Cosine similarity of every standard column against every vendor column, shape (standard, vendor)."""
+    import numpy as np
+    grams = [_ngrams(name) for name in list(standard_columns) + list(vendor_columns)]
+    vocabulary = {}
+    for name_grams in grams:
+        for gram in name_grams:
+            vocabulary.setdefault(gram, len(vocabulary))
+    vectors = np.zeros((len(grams), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, name_grams in enumerate(grams):
+        np.add.at(vectors[row], [vocabulary[gram] for gram in name_grams], 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    split = len(standard_columns)
+    return vectors[:split] @ vectors[split:].T
+
+def _assign(scores):
+    """
+    One-to-one assignment maximizing total similarity, as (row, column) pairs: the
+    Hungarian algorithm with row/column potentials, O(n²m) for n <= m, which is
+    instant for column layouts of a few hundred names.
+    """
+    import numpy as np
+    cost = -np.asarray(scores, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # 1-based row assigned to each 1-based column; 0 = free
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        min_reduced = np.full(m + 1, np.inf)
+        previous = np.zeros(m + 1, dtype=np.int64)
+        used = np.zeros(m + 1, dtype=bool)
+        while owner[col]:
+            used[col] = True
+            reduced = cost[owner[col] - 1] - u[owner[col]] - v[1:]
+            improved = ~used[1:] & (reduced < min_reduced[1:])
+            min_reduced[1:][improved] = reduced[improved]
+            previous[1:][improved] = col
+            candidates = np.where(used[1:], np.inf, min_reduced[1:])
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_reduced[~used] -= delta
+            col = next_col
+        while col:  # augment along the alternating path
+            owner[col] = owner[previous[col]]
+            col = previous[col]
+    pairs = [(int(owner[col]) - 1, col - 1) for col in range(1, m + 1) if owner[col]]
+    return [(col, row) for row, col in pairs] if transposed else pairs
+
+def match_columns(standard_columns, vendor_columns):
+    """
+    Scores all column pairs and returns a one-to-one assignment as a list of
+    {"standard", "vendor", "score", "margin"} sorted by score. margin is how far the
+    chosen vendor column is ahead of the best other candidate for that standard column
+    (negative if the assignment gave it a column other than its best).
+    """
+    if not standard_columns or not vendor_columns:
+        return []
+    import numpy as np
+    scores = similarity_matrix(standard_columns, vendor_columns)
+    top_two = -np.sort(-scores, axis=1)[:, :2]
+    matches = []
+    for row, col in _assign(scores):
+        score = float(scores[row, col])
+        if scores.shape[1] == 1:
+            runner_up = 0.0
+        else:
+            runner_up = float(top_two[row, 1] if score >= top_two[row, 0] else top_two[row, 0])
+        matches.append({"standard": standard_columns[row], "vendor": vendor_columns[col],
+                        "score": round(score, 4), "margin": round(score - runner_up, 4)})
+    matches.sort(key=lambda match: match["score"], reverse=True)
+    return matches
+
+# ==============================
+# Request Coalescing
+# ==============================
+class SingleFlight:
+    """
+    Runs one call per key at a time. Callers that arrive while a call for the same key
+    is in flight wait for it and share its result or exception instead of making their
+    own. A waiter that gives up (timeout) does not affect the call or the other waiters.
+    Coalescing is per process.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            if call.waiters:
+                logging.info(f"Shared one mapping call with {call.waiters} coalesced request(s)")
+        elif not call.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for an identical in-flight mapping request")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+_model_calls = SingleFlight()
+
+# ==============================
+# Model Latency Budget and Circuit Breaker
+# ==============================
+MAPPING_BUDGET_SECONDS = float(os.environ.get("MAPPING_BUDGET_SECONDS", 30))
+MAPPING_HEDGE_AFTER_SECONDS = float(os.environ.get("MAPPING_HEDGE_AFTER_SECONDS", 10))
+MAPPING_MAX_ATTEMPTS = int(os.environ.get("MAPPING_MAX_ATTEMPTS", 3))
+MAPPING_CONCURRENCY = int(os.environ.get("MAPPING_CONCURRENCY", 8))  # mappings a batch requests at once
+MAPPING_MAX_IN_FLIGHT = int(os.environ.get("MAPPING_MAX_IN_FLIGHT", 16))  # model attempts running at once
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 4.0
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("MAPPING_BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("MAPPING_BREAKER_RESET_SECONDS", 30))
+
+# Attempts outlive the call that gave up on them (until their own timeout), so a
+# slot is taken before submitting: the pool never queues, and every attempt starts
+# at once with the budget its caller had left.
+_attempt_pool = ThreadPoolExecutor(max_workers=MAPPING_MAX_IN_FLIGHT, thread_name_prefix="mapping-model")
+_attempt_slots = threading.BoundedSemaphore(MAPPING_MAX_IN_FLIGHT)
+
+class ModelBusyError(RuntimeError):
+    """Every model attempt slot is taken. Says nothing about the model's health."""
+
+def _start_attempt(fn, deadline):
+    """Submits fn(remaining budget) if a slot is free; returns the future, or None."""
+    if not _attempt_slots.acquire(blocking=False):
+        return None
+
+    def attempt():
+        try:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise TimeoutError("Mapping model budget was spent before the attempt started")
+            return fn(timeout)
+        finally:
+            _attempt_slots.release()
+    return _attempt_pool.submit(attempt)
+
+def call_with_budget(fn, budget=None, hedge_after=None, max_attempts=None):
+    """
+    Calls fn(timeout) within a latency budget and returns the first successful answer.
+
+    If an attempt has not answered after hedge_after seconds another one is started
+    alongside it, and a failed attempt is retried after a jittered exponential backoff,
+    up to max_attempts in total. Each attempt gets the budget remaining when it starts
+    as its timeout. A hedge or retry waits while all MAPPING_MAX_IN_FLIGHT slots are
+    taken; a first attempt raises ModelBusyError instead. Raises TimeoutError once the
+    budget is spent, or the last error if every attempt failed.
+    """
+    budget = MAPPING_BUDGET_SECONDS if budget is None else budget
+    hedge_after = MAPPING_HEDGE_AFTER_SECONDS if hedge_after is None else hedge_after
+    max_attempts = MAPPING_MAX_ATTEMPTS if max_attempts is None else max_attempts
+
+    deadline = time.monotonic() + budget
+    next_launch = time.monotonic()
+    pending = set()
+    attempts = failures = 0
+    last_error = None
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutError(f"Mapping model gave no answer within {budget:g}s") from last_error
+        if attempts < max_attempts and now >= next_launch:
+            future = _start_attempt(fn, deadline)
+            if future is not None:
+                attempts += 1
+                if attempts > 1:
+                    logging.info(f"Starting mapping model attempt {attempts} of {max_attempts}")
+                pending.add(future)
+                next_launch = now + hedge_after
+            elif not attempts:
+                raise ModelBusyError(f"All {MAPPING_MAX_IN_FLIGHT} mapping model slots are in use")
+            else:
+                next_launch = now + RETRY_BASE_DELAY
+        if not pending:
+            if attempts >= max_attempts:
+                raise last_error
+            time.sleep(max(min(next_launch, deadline) - time.monotonic(), 0))
+            continue
+        wake_at = deadline if attempts >= max_attempts else min(next_launch, deadline)
+        done, pending = wait(pending, timeout=max(wake_at - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+            failures += 1
+            logging.warning(f"Mapping model attempt failed: {str(last_error)}")
+            backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (failures - 1)))
+            next_launch = min(next_launch, time.monotonic() + backoff)
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency. After failure_threshold consecutive failures the
+    breaker opens and callers go straight to their fallback; once reset_seconds have
+    passed one trial call is let through, which closes the breaker again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_seconds and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial:
+                    logging.warning(f"Mapping model circuit opened after {self._failures} failure(s)")
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+_model_breaker = CircuitBreaker()
+
+class MappingResult(dict):
+    """The {standard: vendor} mapping, flagged as degraded when the local fallback stood in for the model."""
+
+    def __init__(self, mapping, degraded=False, reason=None):
+        super().__init__(mapping)
+        self.degraded = degraded
+        self.reason = reason
+
+def _coalescing_key(model, standard_columns, vendor_columns):
+    return (id(model), frozenset(standard_columns), frozenset(vendor_columns))
+
+def map_fields(standard_columns, vendor_columns, offline=None, model=None):
+    """
+    Returns a MappingResult: {standard column: vendor column or UNMAPPED}.
+
+    Pairs the local scorer is confident about (high score, no close runner-up) are
+    mapped directly; the rest go to the model, ordered so that likely matches come first. Concurrent calls asking the
+    model about the same column sets share one model call, which runs under
+    call_with_budget and the module's circuit breaker. If the model fails, is
+    skipped by the open breaker, or offline is set (or MAPPER_OFFLINE=1), the local
+    assignment is used for pairs scoring at least OFFLINE_MIN_SCORE and the result
+    is marked degraded.
+
+    model is a callable (standard_columns, vendor_columns, timeout=None) -> dict and
+    defaults to Gemini.
+    """
+    model = model or _map_fields_with_model
+    if offline is None:
+        offline = os.environ.get("MAPPER_OFFLINE") == "1"
+    matches = match_columns(standard_columns, vendor_columns)
+    mapping = {match["standard"]: match["vendor"] for match in matches
+               if match["score"] >= LOCAL_MATCH_THRESHOLD and match["margin"] >= LOCAL_MIN_MARGIN}
+    best = {match["standard"]: match for match in matches}
+    rest_standard = [c for c in sorted(standard_columns, key=lambda c: -best[c]["score"] if c in best else 0)
+                     if c not in mapping]
+    used = set(mapping.values())
+    rest_vendor = [match["vendor"] for match in matches if match["vendor"] not in used]
+    rest_vendor += [c for c in vendor_columns if c not in used and c not in rest_vendor]
+    logging.info(f"Mapped {len(mapping)} of {len(standard_columns)} column(s) locally")
+
+    degraded_reason = None
+    if rest_standard and rest_vendor:
+        def ask_model():
+            try:
+                answer = call_with_budget(lambda timeout: model(rest_standard, rest_vendor, timeout=timeout))
+                if not isinstance(answer, dict):
+                    raise ValueError(f"expected a JSON object, got {type(answer).__name__}")
+            except ModelBusyError:
+                raise
+            except Exception:
+                _model_breaker.record_failure()
+                raise
+            _model_breaker.record_success()
+            return answer
+
+        model_mapping = None
+        if offline:
+            degraded_reason = "offline"
+        elif not _model_breaker.allow():
+            degraded_reason = "mapping model circuit is open"
+        else:
+            try:
+                model_mapping = _model_calls.do(_coalescing_key(model, rest_standard, rest_vendor), ask_model)
+            except Exception as e:
+                degraded_reason = str(e) or type(e).__name__
+        if model_mapping is None:
+            logging.warning(f"Mapping model unavailable, falling back to local matches: {degraded_reason}")
+            model_mapping = {c: best[c]["vendor"] for c in rest_standard
+                             if c in best and best[c]["score"] >= OFFLINE_MIN_SCORE}
+        for column in rest_standard:
+            vendor = model_mapping.get(column, UNMAPPED)
+            mapping[column] = vendor if vendor in rest_vendor else UNMAPPED
+
+    return MappingResult({column: mapping.get(column, UNMAPPED) for column in standard_columns},
+                         degraded=degraded_reason is not None, reason=degraded_reason)
+
+def _map_fields_with_model(standard_columns, vendor_columns, timeout=None):
+    genai = _configure_genai()
 
     # Create the model
     generation_config = {
@@ -106,11 +531,216 @@ def map_fields(standard_columns, vendor_columns):
     )
 
     chat_session = model.start_chat(history=[])
-    response = chat_session.send_message("Provide the JSON mapping for the given fields.")
+    response = chat_session.send_message("Provide the JSON mapping for the given fields.",
+                                         request_options={"timeout": timeout} if timeout else None)
     
-    return response.text
+    # The model is asked for JSON (response_mime_type), so the text is a JSON object.
+    return json.loads(response.text)
+
+# ==============================
+# Applying a Mapping
+# ==============================
+UNMAPPED = "UNMAPPED"
+MAPPING_FOLDER = "mappings"
+MAPPING_MAX_AGE = 7 * 24 * 3600
+OUTPUT_FOLDER = "outputs"
+# Vendor rows are read in chunks of at most APPLY_CHUNK_ROWS rows (larger chunks are
+# no faster), fewer when rows are too wide to fit in APPLY_CHUNK_SHARE of the job's
+# memory budget (see memory_budget.AdaptiveBatch).
+APPLY_CHUNK_ROWS = 100_000
+APPLY_CHUNK_MIN = 1_000
+APPLY_CHUNK_SHARE = 0.5
+OUTPUT_FORMATS = ["csv", "parquet"]
+
+def to_standard_layout(df, mapping, standard_columns):
+    """
+    Renames vendor columns to their standard names, drops UNMAPPED fields and orders
+    the columns as in standard_columns. mapping is {standard column: vendor column}.
+    """
+    selected = [(standard, mapping.get(standard, UNMAPPED)) for standard in standard_columns]
+    selected = [(standard, vendor) for standard, vendor in selected if vendor != UNMAPPED and vendor in df.columns]
+    out = df[[vendor for _, vendor in selected]]
+    out.columns = [standard for standard, _ in selected]
+    return out
+
+def save_mapping(mapping, standard_columns, folder=MAPPING_FOLDER, header_row=None):
+    """
+    Stores a mapping as JSON and returns its id. header_row is the line of the vendor
+    file that holds the vendor column names, if known. The id is a digest of the
+    document, so saving the same mapping again (every /process call for a vendor
+    whose header set was seen before) reuses the stored one.
+    """
+    content = {"mapping": mapping, "standard_columns": standard_columns, "header_row": header_row}
+    mapping_id = hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+    path = os.path.join(folder, f"{mapping_id}.json")
+    if os.path.exists(path):
+        return mapping_id
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"mapping_id": mapping_id, **content}, f)
+    os.replace(tmp_path, path)
+    return mapping_id
+
+def load_mapping(mapping_id, folder=MAPPING_FOLDER):
+    """Returns the saved mapping document, or None if there is no such mapping."""
+    path = os.path.join(folder, f"{secure_filename(mapping_id)}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+class _ParquetChunkWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet output needs the pyarrow package")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self._writer = None
+
+    def write(self, df):
+        table = self._pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+class _CsvChunkWriter:
+    def __init__(self, path):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._header = True
+
+    def write(self, df):
+        df.to_csv(self._file, header=self._header, index=False)
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+def _read_vendor_chunks(source, filename, header_row, chunks):
+    """Yields DataFrames of vendor rows, all values as strings, chunks.size rows at a time."""
+    import pandas as pd
+    extension = os.path.splitext(strip_compression_suffix(filename))[1].lower()
+    if extension in [".xls", ".xlsx"]:
+        # Workbooks cannot be read incrementally.
+        if not isinstance(source, (str, os.PathLike)) and not source.seekable():
+            source = io.BytesIO(source.read())
+        df = pd.read_excel(source, dtype=str, header=header_row, keep_default_na=False)
+        chunks.memory.hold("workbook", frame_size(df))
+        start = 0
+        while start < len(df):
+            stop = start + chunks.size
+            yield df.iloc[start:stop]
+            start = stop
+        return
+    text_stream, delimiter = open_claim_stream(source, errors="replace")
+    with text_stream, pd.read_csv(text_stream, sep=delimiter, dtype=str, header=header_row,
+                                  keep_default_na=False, chunksize=chunks.size) as reader:
+        while True:
+            try:
+                chunk = reader.get_chunk(chunks.size)
+            except StopIteration:
+                return
+            yield chunk
+
+def apply_mapping(source, filename, mapping, standard_columns, output_path, output_format="csv",
+                  header_row=0, chunk_rows=APPLY_CHUNK_ROWS):
+    """
+    Streams a vendor file (path or binary file object, optionally compressed) through
+    to_standard_layout chunk by chunk and writes a standard-format CSV or Parquet
+    file, so memory use is bounded whatever the file size: chunks have at most
+    chunk_rows rows, and fewer when that many would not fit the job's memory budget.
+    The output is written to a temporary file and moved into place when complete.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of {OUTPUT_FORMATS}")
+    tmp_path = f"{output_path}.tmp"
+    writer = _ParquetChunkWriter(tmp_path) if output_format == "parquet" else _CsvChunkWriter(tmp_path)
+    memory = JobMemory()
+    chunk_sizes = AdaptiveBatch(memory, "chunk", min(APPLY_CHUNK_MIN, chunk_rows), chunk_rows, APPLY_CHUNK_SHARE)
+    rows = chunks = 0
+    columns = missing = None
+    try:
+        for chunk in _read_vendor_chunks(source, filename, header_row, chunk_sizes):
+            if columns is None:
+                missing = [vendor for standard, vendor in mapping.items()
+                           if vendor != UNMAPPED and vendor not in chunk.columns]
+            out = to_standard_layout(chunk, mapping, standard_columns)
+            if columns is None and not len(out.columns):
+                raise ValueError(f"None of the mapped vendor columns are in header row {header_row} of {filename}")
+            columns = list(out.columns)
+            writer.write(out)
+            rows += len(out)
+            chunks += 1
+            chunk_sizes.resize(len(chunk), frame_size(chunk))
+            logging.info(f"Applied mapping to {rows} row(s) of {filename}")
+    except BaseException:
+        writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    writer.close()
+    if chunks == 0:
+        raise ValueError("Vendor file is empty")
+    os.replace(tmp_path, output_path)
+    return {"output": output_path, "format": output_format, "rows": rows, "chunks": chunks,
+            "columns": columns, "missing_columns": missing, "memory": memory.report()}
 
 # Flask View Class
+class _MappingPipe:
+    """
+    Multipart file part sink for MappingAPI.apply. The part is written into a pipe
+    that apply(stream) reads in a worker thread, so the vendor file is converted as
+    it is received instead of being spooled first. If apply stops reading (it
+    failed), the rest of the part is discarded.
+    """
+
+    def __init__(self, apply):
+        read_fd, write_fd = os.pipe()
+        self._reader = open(read_fd, "rb")
+        self._writer = open(write_fd, "wb")
+        self._broken = False
+        self.result = self.error = None
+        self._thread = threading.Thread(target=self._run, args=(apply,), name="mapping-apply", daemon=True)
+        self._thread.start()
+
+    def _run(self, apply):
+        try:
+            self.result = apply(self._reader)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._reader.close()  # unblocks a writer that is still sending
+
+    def write(self, data):
+        if not self._broken:
+            try:
+                self._writer.write(data)
+            except BrokenPipeError:
+                self._broken = True
+        return len(data)
+
+    def seek(self, *args):
+        return 0
+
+    def close(self):
+        """Ends the part and waits for apply; returns its result or raises its error."""
+        try:
+            self._writer.close()
+        except BrokenPipeError:
+            pass
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
 class ColumnMapper(MethodView):
     def post(self):
         """Handles file upload, processes column mapping using Gemini AI, and returns JSON response."""
@@ -127,23 +757,178 @@ class ColumnMapper(MethodView):
 
             # Extract column names
             standard_columns, standard_df = extract_columns(standard_df)
+            vendor_header_row = names_row(vendor_df)
             vendor_columns, vendor_df = extract_columns(vendor_df)
 
             # Get column mappings from Gemini AI
             mapped_columns = map_fields(standard_columns, vendor_columns)
+            mapping_id = save_mapping(mapped_columns, standard_columns,
+                                      current_app.config.get("MAPPING_FOLDER", MAPPING_FOLDER), vendor_header_row)
 
             # Filter and rename columns
-            filtered_vendor_df = vendor_df[list(mapped_columns.values())]
-            filtered_vendor_df.rename(columns={v: k for k, v in mapped_columns.items() if v != "UNMAPPED"}, inplace=True)
+            filtered_vendor_df = to_standard_layout(vendor_df, mapped_columns, standard_columns)
 
             # Convert to JSON response
-            return jsonify({"message": "File processed successfully", "data": filtered_vendor_df.to_dict(orient='records')}), 200
+            return jsonify({"message": "File processed successfully", "mapping_id": mapping_id,
+                            "mapping": mapped_columns, "degraded": mapped_columns.degraded,
+                            "data": filtered_vendor_df.to_dict(orient='records')}), 200
 
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
-# Register the route
-app.add_url_rule('/process', view_func=ColumnMapper.as_view('column_mapper'), methods=['POST'])
+class BatchColumnMapper(MethodView):
+    """
+    POST /process/batch with one standard_file and any number of vendor_files.
+    The standard is parsed once, vendors with the same set of columns share one
+    mapping, and the distinct mappings are requested concurrently.
+    """
+
+    def post(self):
+        standard_file = request.files.get("standard_file")
+        vendor_files = request.files.getlist("vendor_files") + request.files.getlist("vendor_file")
+        if standard_file is None or not vendor_files:
+            return jsonify({"error": "standard_file and at least one vendor_files are required"}), 400
+
+        try:
+            standard_columns = read_columns(standard_file)[0]
+        except Exception as e:
+            return jsonify({"error": f"Could not read standard_file: {str(e)}"}), 400
+
+        results = []
+        groups = {}
+        for vendor_file in vendor_files:
+            result = {"filename": vendor_file.filename}
+            results.append(result)
+            try:
+                vendor_columns, header_row = read_columns(vendor_file)
+            except Exception as e:
+                result["error"] = f"Could not read file: {str(e)}"
+                continue
+            key = (frozenset(vendor_columns), header_row)
+            if key not in groups:
+                groups[key] = {"vendor_columns": vendor_columns, "header_row": header_row, "results": []}
+            groups[key]["results"].append(result)
+
+        logging.info(f"Batch mapping {len(vendor_files)} vendor file(s) in {len(groups)} distinct header set(s)")
+        mapping_folder = current_app.config.get("MAPPING_FOLDER", MAPPING_FOLDER)
+        workers = current_app.config.get("MAPPING_CONCURRENCY", MAPPING_CONCURRENCY)
+
+        def map_group(group):
+            mapping = map_fields(standard_columns, group["vendor_columns"])
+            return mapping, save_mapping(mapping, standard_columns, mapping_folder, group["header_row"])
+
+        if groups:
+            with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as executor:
+                futures = [(group, executor.submit(map_group, group)) for group in groups.values()]
+                for index, (group, future) in enumerate(futures):
+                    try:
+                        mapping, mapping_id = future.result()
+                        outcome = {"group": index, "mapping_id": mapping_id, "mapping": mapping,
+                                   "degraded": mapping.degraded}
+                    except Exception as e:
+                        logging.error(f"Mapping failed for header set {index}: {str(e)}")
+                        outcome = {"group": index, "error": f"Mapping failed: {str(e)}"}
+                    for result in group["results"]:
+                        result.update(outcome)
+
+        return jsonify({"standard_columns": standard_columns, "vendor_count": len(vendor_files),
+                        "distinct_header_sets": len(groups), "results": results})
+
+class MappingAPI(MethodView):
+    """
+    GET  /api/mappings/<mapping_id>         the saved mapping
+    POST /api/mappings                      save {"mapping": {...}, "standard_columns": [...]}
+    POST /api/mappings/<mapping_id>/apply   convert a vendor file to the standard layout on disk.
+        The vendor file is sent as vendor_file, or named with source= if it is already in
+        UPLOAD_FOLDER (e.g. after a chunked upload). Options: format=csv|parquet,
+        header_row=<n> (default: the row the mapping was made from, else 0),
+        output_name=<name>. 400 if none of the mapped vendor columns is in the header row.
+        A vendor_file is converted while the request body is received, so with one the
+        options must be in the query string.
+    """
+
+    def get(self, mapping_id):
+        document = load_mapping(mapping_id, current_app.config.get("MAPPING_FOLDER", MAPPING_FOLDER))
+        if document is None:
+            return jsonify({"error": "Mapping not found"}), 404
+        # A saved mapping never changes under its id, so clients may keep it.
+        response = jsonify(document)
+        response.cache_control.max_age = MAPPING_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    def post(self, mapping_id=None, action=None):
+        if mapping_id is None:
+            return self.save()
+        if action == "apply":
+            return self.apply(mapping_id)
+        return jsonify({"error": "Invalid action"}), 400
+
+    def save(self):
+        data = request.get_json(silent=True) or {}
+        mapping = data.get("mapping")
+        standard_columns = data.get("standard_columns") or list((mapping or {}).keys())
+        if not isinstance(mapping, dict):
+            return jsonify({"error": "mapping must be an object of standard column -> vendor column"}), 400
+        mapping_id = save_mapping(mapping, standard_columns, current_app.config.get("MAPPING_FOLDER", MAPPING_FOLDER))
+        return jsonify({"mapping_id": mapping_id}), 201
+
+    def apply(self, mapping_id):
+        document = load_mapping(mapping_id, current_app.config.get("MAPPING_FOLDER", MAPPING_FOLDER))
+        if document is None:
+            return jsonify({"error": "Mapping not found"}), 404
+
+        multipart = request.mimetype == "multipart/form-data"
+        # Reading request.form would spool the whole vendor_file before converting it.
+        options = request.args if multipart or not request.form else request.form
+        output_format = options.get("format", "csv")
+        try:
+            header_row = int(options.get("header_row", document.get("header_row") or 0))
+        except ValueError:
+            return jsonify({"error": "header_row must be an integer"}), 400
+        output_folder = current_app.config.get("OUTPUT_FOLDER", OUTPUT_FOLDER)
+        os.makedirs(output_folder, exist_ok=True)
+
+        def apply(source, filename):
+            stem = os.path.splitext(strip_compression_suffix(filename))[0]
+            output_name = secure_filename(options.get("output_name", "")) or f"{stem}_standard.{output_format}"
+            return apply_mapping(source, filename, document["mapping"], document["standard_columns"],
+                                 os.path.join(output_folder, output_name), output_format, header_row)
+
+        filename = None
+        try:
+            if multipart:
+                boundary = request.mimetype_params.get("boundary", "").encode("ascii")
+                if not boundary:
+                    return jsonify({"error": "Missing multipart boundary"}), 400
+
+                def open_writer(name):
+                    nonlocal filename
+                    filename = secure_filename(name or "") or "vendor_file"
+                    return _MappingPipe(lambda stream: apply(stream, filename))
+
+                parser = UploadPartParser(open_writer, max_form_memory_size=request.max_form_memory_size,
+                                          max_form_parts=request.max_form_parts)
+                try:
+                    parser.parse(request.stream, boundary, request.content_length)
+                finally:
+                    result = parser.writer.close() if parser.writer is not None else None
+                if parser.writer is None:
+                    return jsonify({"error": "Provide vendor_file or the name of an uploaded file as source"}), 400
+            else:
+                filename = secure_filename(options.get("source", ""))
+                source = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+                if filename == "" or not os.path.exists(source):
+                    return jsonify({"error": "Provide vendor_file or the name of an uploaded file as source"}), 400
+                result = apply(source, filename)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logging.error(f"Error applying mapping {mapping_id} to {filename}: {str(e)}")
+            return jsonify({"error": f"Mapping could not be applied: {str(e)}"}), 500
+        result["mapping_id"] = mapping_id
+        return jsonify(result)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    from indium import create_app
+    create_app().run(debug=True)
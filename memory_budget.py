@@ -0,0 +1,159 @@
+import os
+import sys
+from itertools import islice
+
+# ==============================
+# Per-Job Memory Accounting
+# ==============================
+# Each job (validating a file, applying a mapping, reading an upload) keeps a
+# JobMemory. Stages that buffer rows report the bytes they hold, and the process
+# RSS is sampled at every batch, so the job result can show what the job used.
+# An AdaptiveBatch sizes a stage's batches from the bytes per row measured so far,
+# so that the stage stays within its share of JOB_MEMORY_BUDGET_MB whether rows
+# are narrow or wide. Batches also shrink while the process has grown past the
+# budget outside the buffers, e.g. with errors accumulated in memory.
+#
+# RSS is per process: with several jobs running in one worker, each job's figures
+# include the others' growth, which only makes the batch sizing more conservative.
+
+JOB_MEMORY_BUDGET = int(float(os.environ.get("JOB_MEMORY_BUDGET_MB", 256)) * 1024 * 1024)
+SIZE_SAMPLE = 64  # items measured to estimate the size of a batch
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def read_rss():
+    """
+    (resident, anonymous resident) bytes of this process from /proc/self/statm, or
+    (None, None) where /proc is unavailable. Pages of memory-mapped input files count
+    as resident but not anonymous; they are reclaimable, so the budget is checked
+    against anonymous memory.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            fields = f.read().split()
+        resident, shared = int(fields[1]) * PAGE_SIZE, int(fields[2]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None, None
+    return resident, resident - shared
+
+
+def row_size(row):
+    """Bytes held by a row of strings."""
+    return sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+
+
+def estimate_size(items, sizeof=sys.getsizeof, sample=SIZE_SAMPLE):
+    """
+    Estimated bytes held by a list or set and its items, measuring a sample of them
+    (evenly spaced in a list; sets are in no particular order anyway).
+    """
+    if not items:
+        return sys.getsizeof(items)
+    sampled = items[::max(len(items) // sample, 1)] if isinstance(items, list) else list(islice(items, sample))
+    return sys.getsizeof(items) + sum(map(sizeof, sampled)) * len(items) // len(sampled)
+
+
+def frame_size(df, sample=SIZE_SAMPLE * 16):
+    """Estimated bytes held by a DataFrame, measuring object columns over a sample of rows."""
+    if len(df) <= sample:
+        return int(df.memory_usage(deep=True, index=False).sum())
+    sampled = df.iloc[::len(df) // sample]
+    return int(df.memory_usage(deep=False, index=False).sum()
+               + (sampled.memory_usage(deep=True, index=False).sum()
+                  - sampled.memory_usage(deep=False, index=False).sum()) * len(df) // len(sampled))
+
+
+class JobMemory:
+    """Memory accounting of one job: peak RSS and the bytes each stage buffered."""
+
+    def __init__(self, budget=JOB_MEMORY_BUDGET):
+        self.budget = budget
+        self.stages = {}  # stage -> {"held": bytes now, "peak_bytes": most bytes held at once}
+        self.batches = {}  # stage -> AdaptiveBatch
+        self.rss_start = self.anon_start = self.peak_rss = self.peak_anon = None
+        self._start()
+
+    def _start(self):
+        self.rss_start, self.anon_start = read_rss()
+        self.peak_rss, self.peak_anon = self.rss_start, self.anon_start
+
+    def __setstate__(self, state):
+        # A checkpointed job is measured again from the process that resumes it.
+        self.__dict__.update(state)
+        self._start()
+
+    def sample(self):
+        """Updates the peaks and returns the growth of anonymous memory since the job started."""
+        rss, anon = read_rss()
+        if rss is None:
+            return None
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_anon = max(self.peak_anon, anon)
+        return anon - self.anon_start
+
+    def hold(self, stage, nbytes):
+        """Records that stage now buffers nbytes bytes."""
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = {"held": 0, "peak_bytes": 0}
+        entry["held"] = nbytes
+        entry["peak_bytes"] = max(entry["peak_bytes"], nbytes)
+
+    def buffered(self):
+        return sum(entry["held"] for entry in self.stages.values())
+
+    def available(self, share):
+        """Bytes a stage with this share of the budget may buffer now."""
+        growth = self.sample()
+        outside = max(growth - self.buffered(), 0) if growth is not None else 0
+        return max(min(self.budget * share, self.budget - outside), 0)
+
+    def report(self):
+        self.sample()
+        stages = {stage: {"peak_bytes": entry["peak_bytes"]} for stage, entry in self.stages.items()}
+        for stage, batch in self.batches.items():
+            stages.setdefault(stage, {"peak_bytes": 0}).update(batch.report())
+        return {"budget_bytes": self.budget, "rss_start_bytes": self.rss_start, "peak_rss_bytes": self.peak_rss,
+                "peak_growth_bytes": self.peak_anon - self.anon_start if self.peak_anon is not None else None,
+                "stages": stages}
+
+
+class AdaptiveBatch:
+    """
+    Rows per batch for one stage of a job. The first batch has minimum rows, so rows
+    of any width are measured before a large batch is buffered. After each batch,
+    resize() is given the bytes it held and picks the next size so the stage's buffers
+    fit in its share of the budget, up to maximum rows.
+    """
+
+    def __init__(self, memory, stage, minimum, maximum, share):
+        self.memory = memory
+        self.stage = stage
+        self.size = minimum
+        self.minimum = minimum
+        self.maximum = maximum
+        self.share = share
+        self.row_bytes = None
+        self.count = 0
+        self.smallest = self.largest = minimum
+        memory.batches[stage] = self
+
+    def resize(self, rows, nbytes):
+        """Records a batch of rows that held nbytes bytes and returns the next batch size."""
+        self.memory.hold(self.stage, nbytes)
+        if rows:
+            row_bytes = nbytes / rows
+            # Follow wider rows at once, narrower ones gradually.
+            if self.row_bytes is not None and row_bytes < self.row_bytes:
+                row_bytes = (row_bytes + self.row_bytes) / 2
+            self.row_bytes = row_bytes
+            self.count += 1
+            self.size = min(max(int(self.memory.available(self.share) / row_bytes), self.minimum), self.maximum)
+            self.smallest = min(self.smallest, self.size)
+            self.largest = max(self.largest, self.size)
+        self.memory.hold(self.stage, 0)
+        return self.size
+
+    def report(self):
+        return {"batches": self.count, "batch_rows_min": self.smallest, "batch_rows_max": self.largest,
+                "bytes_per_row": round(self.row_bytes) if self.row_bytes is not None else None}
@@ -0,0 +1,322 @@
+import os
+import csv
+import io
+import uuid
+import zlib
+import sqlite3
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import request, jsonify, Response
+from flask.views import MethodView
+
+# ==============================
+# Validation Result Store
+# ==============================
+# Validation runs and their errors are kept in a local SQLite database, indexed by
+# run, row and column, so support can page through one file's errors instead of
+# downloading the whole log. Runs older than RESULT_RETENTION_DAYS are deleted with
+# their errors, checked at most every PRUNE_INTERVAL seconds when a run starts.
+
+RESULT_DB = os.environ.get("RESULT_DB", "validation_results.db")
+INSERT_BATCH_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 5000
+RESULT_RETENTION_DAYS = float(os.environ.get("RESULT_RETENTION_DAYS", 30))  # 0 keeps every run
+PRUNE_INTERVAL = 3600
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    claim_count INTEGER,
+    error_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_runs_file ON runs (file, started_at);
+CREATE TABLE IF NOT EXISTS errors (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    row INTEGER,
+    column_name TEXT,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_errors_run_row ON errors (run_id, row);
+CREATE INDEX IF NOT EXISTS idx_errors_run_column ON errors (run_id, column_name, row);
+"""
+
+
+def _like_pattern(text):
+    """A LIKE pattern (with ESCAPE '\\') matching values that contain text literally."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class ResultStore:
+    def __init__(self, db_path=RESULT_DB, retention_days=RESULT_RETENTION_DAYS):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._prune_lock = threading.Lock()
+        self._last_prune = None
+        with self._connect() as conn:
+            conn.executescript(SCHEMA_SQL)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited from the parent of a forked worker must not be reused.
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Closes the calling thread's connection; its next call opens a new one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def ping(self):
+        self._connect().execute("SELECT 1").fetchone()
+
+    # ---- writing ----
+    def start_run(self, file, run_id=None):
+        self._maybe_prune()
+        run_id = run_id or uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("INSERT INTO runs (run_id, file, started_at) VALUES (?, ?, ?)",
+                         (run_id, file, datetime.now().isoformat(timespec="seconds")))
+        return run_id
+
+    def add_errors(self, run_id, errors):
+        """errors is an iterable of (row, column, message); row and column may be None."""
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO errors (run_id, row, column_name, message) VALUES (?, ?, ?, ?)",
+                             ((run_id, row, column, message) for row, column, message in errors))
+
+    def finish_run(self, run_id, claim_count, error_count):
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET finished_at = ?, claim_count = ?, error_count = ? WHERE run_id = ?",
+                         (datetime.now().isoformat(timespec="seconds"), claim_count, error_count, run_id))
+
+    def discard_errors_after(self, run_id, error_id):
+        """Deletes the errors recorded for a run after error_id, e.g. past the checkpoint it resumes from."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM errors WHERE run_id = ? AND id > ?", (run_id, error_id or 0))
+
+    def recorder(self, file, run_id=None, resume=False):
+        return RunRecorder(self, file, run_id, resume)
+
+    def prune_runs(self, max_age_days):
+        """Deletes the runs started more than max_age_days ago, with their errors. Returns how many runs."""
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+        with self._connect() as conn:
+            conn.execute("DELETE FROM errors WHERE run_id IN (SELECT run_id FROM runs WHERE started_at < ?)",
+                         (cutoff,))
+            count = conn.execute("DELETE FROM runs WHERE started_at < ?", (cutoff,)).rowcount
+        if count:
+            logging.info(f"Deleted {count} validation run(s) older than {max_age_days:g} day(s)")
+        return count
+
+    def _maybe_prune(self):
+        if not self.retention_days:
+            return
+        now = time.monotonic()
+        with self._prune_lock:
+            if self._last_prune is not None and now - self._last_prune < PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+        try:
+            self.prune_runs(self.retention_days)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not delete old validation runs: {str(e)}")
+
+    # ---- reading ----
+    def last_error_id(self, run_id):
+        return self._connect().execute("SELECT MAX(id) FROM errors WHERE run_id = ?", (run_id,)).fetchone()[0]
+
+    def get_run(self, run_id):
+        row = self._connect().execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_runs(self, file=None, page=1, per_page=DEFAULT_PAGE_SIZE):
+        where, params = ("WHERE file LIKE ? ESCAPE '\\'", [_like_pattern(file)]) if file else ("", [])
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM runs {where}", params).fetchone()[0]
+        rows = conn.execute(f"SELECT * FROM runs {where} ORDER BY started_at DESC LIMIT ? OFFSET ?",
+                            params + [per_page, (page - 1) * per_page]).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def _error_filter(self, run_id, column=None, row_from=None, row_to=None, search=None):
+        clauses, params = ["run_id = ?"], [run_id]
+        if column is not None:
+            clauses.append("column_name = ?")
+            params.append(column)
+        if row_from is not None:
+            clauses.append("row >= ?")
+            params.append(row_from)
+        if row_to is not None:
+            clauses.append("row <= ?")
+            params.append(row_to)
+        if search:
+            clauses.append("message LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(search))
+        return " AND ".join(clauses), params
+
+    def query_errors(self, run_id, page=1, per_page=DEFAULT_PAGE_SIZE, **filters):
+        where, params = self._error_filter(run_id, **filters)
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM errors WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT row, column_name, message FROM errors WHERE {where} ORDER BY row, id LIMIT ? OFFSET ?",
+            params + [per_page, (page - 1) * per_page]).fetchall()
+        return total, [{"row": r["row"], "column": r["column_name"], "message": r["message"]} for r in rows]
+
+    def column_counts(self, run_id):
+        rows = self._connect().execute(
+            "SELECT column_name, COUNT(*) AS n FROM errors WHERE run_id = ? GROUP BY column_name ORDER BY n DESC",
+            (run_id,)).fetchall()
+        return [{"column": r["column_name"], "count": r["n"]} for r in rows]
+
+    def iter_errors(self, run_id, **filters):
+        where, params = self._error_filter(run_id, **filters)
+        cursor = self._connect().execute(
+            f"SELECT row, column_name, message FROM errors WHERE {where} ORDER BY row, id", params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+
+class RunRecorder:
+    """
+    Buffers the errors of one validation run and writes them to the store in batches.
+    With resume=True it continues run_id, which was started by an earlier process.
+    """
+
+    def __init__(self, store, file, run_id=None, resume=False):
+        self.store = store
+        self.run_id = run_id if resume else store.start_run(file, run_id)
+        self._buffer = []
+
+    def __call__(self, row, column, message):
+        self._buffer.append((row, column, message))
+        if len(self._buffer) >= INSERT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.store.add_errors(self.run_id, self._buffer)
+            self._buffer = []
+
+    def finish(self, claim_count, error_count):
+        self.flush()
+        self.store.finish_run(self.run_id, claim_count, error_count)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """Process-wide ResultStore for RESULT_DB."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore(RESULT_DB)
+        return _store
+
+
+def close_result_store():
+    """Closes the calling thread's connection to the process-wide store, if it was opened."""
+    if _store is not None:
+        _store.close()
+
+
+# ==============================
+# API Views
+# ==============================
+def _int_arg(name, default=None, minimum=None, maximum=None):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return default
+    value = int(value)
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+def _export_csv_gz(rows):
+    """Yields a gzip-compressed CSV of (row, column, message) as it is produced."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["row", "column", "message"])
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([row["row"], row["column_name"], row["message"]])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield compressor.compress(buffer.getvalue().encode("utf-8"))
+            buffer.seek(0)
+            buffer.truncate()
+    yield compressor.compress(buffer.getvalue().encode("utf-8"))
+    yield compressor.flush()
+
+
+class ValidationResultsAPI(MethodView):
+    def get(self, run_id=None, action=None):
+        try:
+            if run_id is None:
+                return self.list_runs()
+            store = get_result_store()
+            run = store.get_run(run_id)
+            if run is None:
+                return jsonify({"error": "Run not found"}), 404
+            if action is None:
+                return jsonify(run)
+            if action == "errors":
+                return self.errors(store, run)
+            if action == "columns":
+                return jsonify({"run_id": run_id, "columns": store.column_counts(run_id)})
+            if action == "export":
+                return self.export(store, run)
+            return jsonify({"error": "Invalid action"}), 400
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+    def list_runs(self):
+        page = _int_arg("page", 1, minimum=1)
+        per_page = _int_arg("per_page", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+        total, runs = get_result_store().list_runs(request.args.get("file"), page, per_page)
+        return jsonify({"page": page, "per_page": per_page, "total": total, "runs": runs})
+
+    def _filters(self):
+        return {
+            "column": request.args.get("column"),
+            "row_from": _int_arg("row_from"),
+            "row_to": _int_arg("row_to"),
+            "search": request.args.get("q"),
+        }
+
+    def errors(self, store, run):
+        page = _int_arg("page", 1, minimum=1)
+        per_page = _int_arg("per_page", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+        total, errors = store.query_errors(run["run_id"], page, per_page, **self._filters())
+        return jsonify({"run_id": run["run_id"], "file": run["file"], "page": page, "per_page": per_page,
+                        "total": total, "errors": errors})
+
+    def export(self, store, run):
+        logging.info(f"Exporting errors for run {run['run_id']}")
+        rows = store.iter_errors(run["run_id"], **self._filters())
+        return Response(_export_csv_gz(rows), mimetype="application/gzip",
+                        headers={"Content-Disposition": f"attachment; filename=errors_{run['run_id']}.csv.gz"})
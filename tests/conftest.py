@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules are flat files at the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """A fresh mapping-model circuit breaker, so tests do not trip each other's."""
+    import mapper
+    breaker = mapper.CircuitBreaker(failure_threshold=2, reset_seconds=0.2)
+    monkeypatch.setattr(mapper, "_model_breaker", breaker)
+    monkeypatch.delenv("MAPPER_OFFLINE", raising=False)
+    return breaker
+
+
+# A claim row that passes every field check and cross-field rule.
+CLAIM_ROW = ("CLM,1,AB-2024-1001,,G1,,,,123-45-6789,P1,Doe,Jo,,,,CA,90210,1,1980-01-01,,Pharm,R,2024-01-02,,"
+             "2024-01-03,I,NDC1,Lab,B,10mg,30,60,,Y,32709.15,4768.99,5.00,19.85,3.80,28.65,2024-01-05,A").split(",")
+
+
+def claim(number, claim_id=None, **values):
+    """A valid claim row with RecordNumber number, ClaimID claim_id (default AB-2024-<number>) and values by column name."""
+    from error_logger import CLAIM_SCHEMA
+    row = list(CLAIM_ROW)
+    row[1] = str(number)
+    row[2] = claim_id or f"AB-2024-{number}"
+    for name, value in values.items():
+        row[[field["name"] for field in CLAIM_SCHEMA].index(name.replace("__", " "))] = value
+    return row
+
+
+@pytest.fixture
+def claim_file(tmp_path):
+    """Writes rows (lists of fields) as a claim file with a trailer and returns its path."""
+    def write(name, rows, trailer=True):
+        path = tmp_path / name
+        lines = [",".join(row) for row in rows]
+        if trailer:
+            lines.append(f"TRL,{len(rows)}")
+        path.write_text("\n".join(lines) + "\n")
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The Flask app, run in tmp_path with its own upload folder and result store."""
+    monkeypatch.chdir(tmp_path)  # importing indium builds an app, with its folders, in the working directory
+    import indium
+    import result_store
+    monkeypatch.setattr(result_store, "_store", result_store.ResultStore(str(tmp_path / "results.db")))
+    return indium.create_app({"UPLOAD_FOLDER": str(tmp_path / "uploads")})
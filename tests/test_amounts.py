@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+import pytest
+
+from error_logger import AMOUNT_PRECISION, format_amount, parse_amount, parse_amounts
+
+ACCEPTED = [
+    "0", "0.00", "-0", "12", "12.5", "12.50", "-3.07", "+3.07", "+0.01", "-0.01", ".5", "-.5", "5.",
+    "00012.30", "32709.15", "-32709.15", "9999999999999.99", "-9999999999999.99",
+    "0000000000000000000001.00",  # longer than the precision, but only leading zeros
+]
+REJECTED = [
+    "", ".", "-", "+", "+-1", "--1", "1-", "1.2.3", "1.234", "0.001", "-1.005",  # more than 2 decimal places
+    "1,234.56", "1,234", "1 234.56", "1_234.56", " 12", "12 ", "$12",  # separators, padding, symbols
+    "1e5", "1E5", "1e-2", "nan", "NaN", "inf", "-inf", "Infinity", "0x10",  # float() would take these
+    "١٢", "１２", "12\x00", "10000000000000.00", "99999999999999999",  # non-ASCII digits, NUL, too many digits
+]
+
+
+@pytest.mark.parametrize("value", ACCEPTED)
+def test_accepted_amounts_are_exact_cents(value):
+    units, err = parse_amount(value)
+    assert err is None
+    assert units == Decimal(value) * 100
+    assert Decimal(format_amount(units)) == Decimal(value)
+
+
+@pytest.mark.parametrize("value", REJECTED)
+def test_rejected_amounts(value):
+    units, err = parse_amount(value)
+    assert units is None and err
+
+
+def test_column_parse_agrees_with_parse_amount():
+    values = ACCEPTED + REJECTED
+    units, valid = parse_amounts(values)
+    for value, column_units, column_valid in zip(values, units.tolist(), valid.tolist()):
+        expected, err = parse_amount(value)
+        assert column_valid == (err is None), value
+        if column_valid:
+            assert column_units == expected, value
+
+
+@pytest.mark.parametrize("scale, value, expected", [
+    (0, "12", 12), (0, "12.", 12), (0, "12.5", None),
+    (4, "1.2345", 12345), (4, "-0.0001", -1), (4, "1.23456", None),
+])
+def test_other_scales(scale, value, expected):
+    units, err = parse_amount(value, scale=scale)
+    assert units == expected and (err is None) == (expected is not None)
+    column_units, column_valid = parse_amounts([value], scale=scale)
+    assert bool(column_valid[0]) == (expected is not None)
+    if expected is not None:
+        assert int(column_units[0]) == expected
+
+
+def test_precision_limit():
+    largest = "9" * (AMOUNT_PRECISION - 2) + ".99"
+    assert parse_amount(largest)[1] is None
+    assert parse_amount("1" + "0" * (AMOUNT_PRECISION - 2) + ".00")[1] is not None
+    assert parse_amount("123.45", precision=4)[1] is not None
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+import mapper
+from test_coalescing import STANDARD, VENDOR
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(mapper, "_attempt_slots", slots)
+    return slots
+
+
+def test_abandoned_attempt_holds_its_slot_not_the_next_budget(one_slot):
+    release = threading.Event()
+
+    def stuck(timeout):
+        release.wait(5)
+        return "late"
+    with pytest.raises(TimeoutError):
+        mapper.call_with_budget(stuck, budget=0.05, hedge_after=10, max_attempts=1)
+
+    with pytest.raises(mapper.ModelBusyError):
+        mapper.call_with_budget(lambda timeout: "ok", budget=1, max_attempts=1)
+
+    release.set()
+    assert one_slot.acquire(timeout=5)
+    one_slot.release()
+    timeouts = []
+    assert mapper.call_with_budget(lambda timeout: timeouts.append(timeout) or "ok", budget=1) == "ok"
+    assert timeouts[0] > 0.9
+
+
+def test_hedge_waits_for_a_free_slot(one_slot):
+    calls = []
+
+    def slow(timeout):
+        calls.append(timeout)
+        time.sleep(0.2)
+        return "ok"
+    assert mapper.call_with_budget(slow, budget=2, hedge_after=0.05, max_attempts=2) == "ok"
+    assert len(calls) == 1
+
+
+def test_busy_model_does_not_trip_the_breaker(one_slot, breaker):
+    one_slot.acquire()
+    try:
+        for _ in range(breaker.failure_threshold + 1):
+            result = mapper.map_fields(STANDARD, VENDOR, model=lambda *args, timeout=None: {})
+            assert result.degraded and "slots are in use" in result.reason
+    finally:
+        one_slot.release()
+    assert breaker.state == "closed"
@@ -0,0 +1,95 @@
+import contextlib
+import io
+import pickle
+
+import pytest
+
+import error_logger
+from conftest import claim
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # checkpoints and row indexes default to relative directories
+    monkeypatch.setattr(error_logger, "CHECKPOINT_CHECK_ROWS", 5)
+    monkeypatch.setattr(error_logger.ValidationCheckpoint, "due", lambda self: True)
+
+
+def validate(path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return error_logger.process_file(path, **kwargs)
+
+
+def crash_at(monkeypatch, crash_row):
+    validate_claim = error_logger.ClaimValidator.validate_claim
+
+    def crashing(self, row, idx):
+        if idx == crash_row:
+            raise RuntimeError("worker killed")
+        return validate_claim(self, row, idx)
+    monkeypatch.setattr(error_logger.ClaimValidator, "validate_claim", crashing)
+
+
+def rows_with_errors(count=30, bad=(3, 12, 18, 25)):
+    return [claim(n, State="California") if n in bad else claim(n) for n in range(1, count + 1)]
+
+
+def test_interrupted_run_resumes_to_the_same_report(claim_file, monkeypatch):
+    path = claim_file("claims.csv", rows_with_errors())
+    expected = validate(claim_file("reference.csv", rows_with_errors()), checkpoint=False)
+
+    with monkeypatch.context() as m:
+        crash_at(m, 17)
+        assert "error" in validate(path)
+    resumed = validate(path)
+    assert (resumed["error_count"], resumed["errors"]) == (expected["error_count"],
+                                                           [e.replace("reference", "claims") for e in expected["errors"]])
+
+
+def test_checkpoint_pickle_leaves_out_messages_and_previous_index(claim_file, monkeypatch):
+    validate(claim_file("day1.csv", [claim(n) for n in range(1, 31)]), vendor="acme", checkpoint=False)
+    path = claim_file("day2.csv", rows_with_errors())
+    with monkeypatch.context() as m:
+        crash_at(m, 17)
+        validate(path, vendor="acme")
+
+    amount_columns = [field["name"] for field in error_logger.CLAIM_SCHEMA if field.get("type") == "amount"]
+    previous = error_logger.RowIndex.load("acme", amount_columns)
+    checkpoint = error_logger.ValidationCheckpoint(path, vendor="acme", row_index=previous.id)
+    with open(checkpoint.path, "rb") as f:
+        state = pickle.load(f)
+    assert state["validator"].file_errors == set()
+    assert state["validator"].diff.previous is None
+    with open(checkpoint.errors_path) as f:
+        assert len(f.readlines()) == 4  # two each for rows 3 and 12, before the checkpoint at row 15
+    assert checkpoint.path != error_logger.ValidationCheckpoint(path).path
+
+    resumed = validate(path, vendor="acme")
+    assert resumed["error_count"] == 8
+    assert resumed["differential"]["modified"] == 4 and resumed["differential"]["unchanged"] == 26
+
+
+def test_replaced_row_index_invalidates_the_checkpoint(claim_file, monkeypatch):
+    validate(claim_file("day1.csv", [claim(n) for n in range(1, 31)]), vendor="acme", checkpoint=False)
+    path = claim_file("day2.csv", rows_with_errors())
+    with monkeypatch.context() as m:
+        crash_at(m, 17)
+        validate(path, vendor="acme")
+    validate(claim_file("other.csv", [claim(n) for n in range(1, 11)]), vendor="acme", checkpoint=False)
+
+    resumed = validate(path, vendor="acme")
+    assert resumed["error_count"] == 8
+    assert resumed["differential"]["added"] == 20  # diffed against other.csv, from the start
+
+
+def test_second_run_of_a_file_does_not_share_its_checkpoint(claim_file):
+    path = claim_file("claims.csv", rows_with_errors())
+    first = error_logger.ValidationCheckpoint(path)
+    assert first.acquire()
+    try:
+        assert not error_logger.ValidationCheckpoint(path).acquire()
+        assert error_logger.ValidationCheckpoint(path, summary=True).acquire()
+        assert validate(path)["error_count"] == 8
+    finally:
+        first.release()
+    assert error_logger.ValidationCheckpoint(path).acquire()
@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import mapper
+
+# Names the local scorer cannot match, so every call goes to the model.
+STANDARD = ["Alpha", "Bravo", "Charlie"]
+VENDOR = ["Xray", "Yank", "Zulu"]
+ANSWER = {"Alpha": "Xray", "Bravo": "Yank", "Charlie": "Zulu"}
+
+
+class StubModel:
+    """Model callable that blocks until released and counts its calls."""
+
+    def __init__(self, answer=ANSWER, error=None):
+        self.answer = answer
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, standard_columns, vendor_columns, timeout=None):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+def map_concurrently(model, callers, columns=None):
+    columns = columns or [(STANDARD, VENDOR)] * callers
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        futures = [pool.submit(mapper.map_fields, standard, vendor, model=model) for standard, vendor in columns]
+        assert model.started.wait(5)
+        deadline = time.monotonic() + 5
+        while sum(call.waiters for call in mapper._model_calls._calls.values()) < callers - 1:
+            assert time.monotonic() < deadline, "callers did not join the in-flight call"
+            time.sleep(0.01)
+        model.release.set()
+        return [future.result(5) for future in futures]
+
+
+def test_identical_requests_share_one_model_call(breaker):
+    model = StubModel()
+    results = map_concurrently(model, 8)
+    assert model.calls == 1
+    assert all(result == ANSWER and not result.degraded for result in results)
+    assert mapper._model_calls.in_flight() == 0
+
+
+def test_column_order_does_not_split_coalescing(breaker):
+    model = StubModel()
+    results = map_concurrently(model, 2, [(STANDARD, VENDOR), (STANDARD[::-1], VENDOR[::-1])])
+    assert model.calls == 1
+    assert results[0] == results[1] == ANSWER
+
+
+def test_model_error_reaches_every_waiter(breaker, monkeypatch):
+    monkeypatch.setattr(mapper, "MAPPING_MAX_ATTEMPTS", 1)
+    model = StubModel(error=RuntimeError("model exploded"))
+    results = map_concurrently(model, 4)
+    assert model.calls == 1
+    assert all(result.degraded and result.reason == "model exploded" for result in results)
+    # A coalesced call is one failure for the breaker, however many callers shared it.
+    assert breaker._failures == 1
+    assert mapper._model_calls.in_flight() == 0
+
+
+def test_waiter_timeout_leaves_the_call_running():
+    flight = mapper.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", slow)
+        assert started.wait(5)
+        with pytest.raises(TimeoutError):
+            flight.do("key", slow, timeout=0.05)
+        patient = pool.submit(flight.do, "key", slow)
+        release.set()
+        assert leader.result(5) == "answer"
+        assert patient.result(5) == "answer"
+    assert flight.in_flight() == 0
+
+
+def test_later_calls_are_not_served_a_finished_result():
+    flight = mapper.SingleFlight()
+    answers = iter(["first", "second"])
+    assert flight.do("key", lambda: next(answers)) == "first"
+    assert flight.do("key", lambda: next(answers)) == "second"
@@ -0,0 +1,53 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import mapper
+
+
+def best_total(scores):
+    n, m = scores.shape
+    if n > m:
+        return best_total(scores.T)
+    return max(sum(scores[i, p[i]] for i in range(n)) for p in itertools.permutations(range(m), n))
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (2, 5), (5, 2), (4, 4), (6, 5)])
+def test_assignment_is_optimal(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        scores = rng.random(shape).round(2)
+        pairs = mapper._assign(scores)
+        assert len(pairs) == min(shape)
+        assert len({row for row, _ in pairs}) == len({col for _, col in pairs}) == len(pairs)
+        assert sum(scores[row, col] for row, col in pairs) == pytest.approx(best_total(scores))
+
+
+def test_assignment_beats_greedy():
+    # Greedy takes the 0.9 pair first and is left with 0.1.
+    scores = np.array([[0.9, 0.8], [0.8, 0.1]])
+    assert sorted(mapper._assign(scores)) == [(0, 1), (1, 0)]
+
+
+def test_close_runner_up_goes_to_the_model(breaker):
+    calls = []
+
+    def model(standard_columns, vendor_columns, timeout=None):
+        calls.append((standard_columns, vendor_columns))
+        return {"Member ID": "Member_ID"}
+    result = mapper.map_fields(["Member ID", "Zip Code"], ["MemberID", "Member_ID", "ZipCode"], model=model)
+    assert result == {"Member ID": "Member_ID", "Zip Code": "ZipCode"}
+    assert calls == [(["Member ID"], ["MemberID", "Member_ID"])]
+
+    calls.clear()
+    assert mapper.map_fields(["Zip Code"], ["ZipCode", "Member_ID"], model=model) == {"Zip Code": "ZipCode"}
+    assert calls == []
+
+
+def test_margin_is_against_the_best_other_column():
+    matches = {match["standard"]: match for match in mapper.match_columns(["Zip Code", "Zip"], ["ZipCode", "Zip"])}
+    assert matches["Zip Code"]["margin"] > 0 and matches["Zip"]["margin"] > 0
+    # One vendor column for two standard ones: the loser is left out, the winner's margin is its lead.
+    (only,) = mapper.match_columns(["Zip Code", "Zip"], ["ZipCode"])
+    assert only["standard"] == "Zip Code" and only["margin"] == only["score"]
@@ -0,0 +1,137 @@
+import contextlib
+import io
+import random
+from datetime import datetime
+
+import pytest
+
+import error_logger
+from conftest import claim
+from error_logger import CLAIM_RULES, CLAIM_SCHEMA, ColumnBatch, CrossFieldRules, format_amount, parse_amount
+
+DATES = ["2024-01-02", "2024-01-03", "2024-01-05", "2023-12-31", "1980-01-01", "2024-1-4",
+         "", "2024-13-01", "2024-02-30", "01/02/2024", "2024-01"]
+AMOUNTS = ["0.00", "5.00", "19.85", "3.80", "28.65", "28.66", "28.64", "-1.00", "1.5", "", "abc", "1e3", "0.001"]
+DATE_COLUMNS = ["DoB", "Date_of_Service", "Prescription_Filled_Date", "Paid_Date"]
+AMOUNT_COLUMNS = ["Member_Copay_Coins", "Member_Deductible", "Member_Other_Cost", "Member_Total_Paid_Amount"]
+INDEX = {field["name"]: i for i, field in enumerate(CLAIM_SCHEMA)}
+
+
+def random_rows(count, seed=3, dates=DATES):
+    rng = random.Random(seed)
+    rows = []
+    for n in range(1, count + 1):
+        values = {}
+        for name in rng.sample(DATE_COLUMNS, rng.randint(0, 2)):
+            values[name] = rng.choice(dates)
+        for name in rng.sample(AMOUNT_COLUMNS, rng.randint(0, 2)):
+            values[name] = rng.choice(AMOUNTS)
+        rows.append(claim(n, **values))
+    return rows
+
+
+def row_failures(row, position):
+    """CLAIM_RULES read one row at a time, with strptime and parse_amount."""
+    def date(name):
+        try:
+            return datetime.strptime(row[INDEX[name]].strip(), "%Y-%m-%d")
+        except ValueError:
+            return None
+
+    failures = []
+    for rule in CLAIM_RULES:
+        if rule["check"] == "order":
+            for before, after in zip(rule["columns"], rule["columns"][1:]):
+                a, b = date(before), date(after)
+                if a is None or b is None or (a < b if rule.get("strict") else a <= b):
+                    continue
+                relation = "after" if rule.get("strict") else "on or after"
+                failures.append((position, after, f"Rule '{rule['name']}': {after} ({row[INDEX[after]].strip()}) "
+                                                  f"must be {relation} {before} ({row[INDEX[before]].strip()})."))
+        else:
+            units = [parse_amount(row[INDEX[name]].strip())[0] for name in [rule["total"]] + rule["parts"]]
+            if None in units or abs(units[0] - sum(units[1:])) <= rule["tolerance"] * 100:
+                continue
+            total = rule["total"]
+            failures.append((position, total, f"Rule '{rule['name']}': {total} ({row[INDEX[total]].strip()}) "
+                                              f"does not equal {' + '.join(rule['parts'])} ({format_amount(sum(units[1:]))})."))
+    return failures
+
+
+def test_template_row_passes_every_rule():
+    assert CrossFieldRules().check_batch([claim(1)]) == []
+
+
+@pytest.mark.parametrize("values, column, message", [
+    ({"Paid_Date": "2024-01-02"}, "Paid_Date",
+     "Rule 'service_fill_paid_order': Paid_Date (2024-01-02) must be on or after Prescription_Filled_Date (2024-01-03)."),
+    ({"Date_of_Service": "2024-01-04"}, "Prescription_Filled_Date",
+     "Rule 'service_fill_paid_order': Prescription_Filled_Date (2024-01-03) must be on or after Date_of_Service (2024-01-04)."),
+    ({"DoB": "2024-01-02"}, "Date_of_Service",
+     "Rule 'born_before_service': Date_of_Service (2024-01-02) must be after DoB (2024-01-02)."),
+    ({"Member_Total_Paid_Amount": "28.66"}, "Member_Total_Paid_Amount",
+     "Rule 'member_total_paid': Member_Total_Paid_Amount (28.66) does not equal "
+     "Member_Copay_Coins + Member_Deductible + Member_Other_Cost (28.65)."),
+])
+def test_each_rule_reports_the_failing_column(values, column, message):
+    assert CrossFieldRules().check_batch([claim(1), claim(2, **values)]) == [(1, column, message)]
+
+
+@pytest.mark.parametrize("values", [
+    {"Paid_Date": "", "Prescription_Filled_Date": "2024-01-09"},  # missing: the schema reports it
+    {"DoB": "2024-13-01"},
+    {"Member_Other_Cost": "abc"},
+    {"Member_Total_Paid_Amount": "28.654"},
+    {"Prescription_Filled_Date": "2024-01-02", "Paid_Date": "2024-01-02"},  # equal dates are in order
+])
+def test_missing_or_invalid_values_are_left_to_the_schema(values):
+    assert CrossFieldRules().check_batch([claim(1, **values)]) == []
+
+
+def test_column_wise_rules_match_the_row_wise_reading():
+    rows = random_rows(3000)
+    expected = [failure for position, row in enumerate(rows) for failure in row_failures(row, position)]
+    assert len(expected) > 300  # every rule fails somewhere, and passes elsewhere
+    assert {message.split("'")[1] for _, _, message in expected} == {rule["name"] for rule in CLAIM_RULES}
+    rules = CrossFieldRules()
+    assert sorted(rules.check_batch(rows)) == sorted(expected)
+    assert sorted(rules.check_batch(ColumnBatch(rows))) == sorted(expected)
+    # Well-formed dates only: each column converts in one numpy call instead of value by value.
+    rows = random_rows(3000, dates=["2024-01-02", "2024-01-03", "2024-01-05", "2023-12-31", "1980-01-01", ""])
+    expected = [failure for position, row in enumerate(rows) for failure in row_failures(row, position)]
+    assert sorted(rules.check_batch(rows)) == sorted(expected)
+
+
+def test_column_batch_converts_like_the_row_validators():
+    rows = random_rows(500)
+    batch = ColumnBatch(rows)
+    for name in DATE_COLUMNS:
+        dates, valid = batch.typed(name)
+        for row, date, ok in zip(rows, dates.tolist(), valid.tolist()):
+            assert ok == error_logger.is_valid_date(row[INDEX[name]].strip())[0]
+            if ok:
+                assert date == datetime.strptime(row[INDEX[name]].strip(), "%Y-%m-%d").date()
+    for name in AMOUNT_COLUMNS:
+        units, valid = batch.typed(name)
+        for row, value, ok in zip(rows, units.tolist(), valid.tolist()):
+            expected, err = parse_amount(row[INDEX[name]].strip())
+            assert ok == (err is None) and (not ok or value == expected)
+
+
+def validate(path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return error_logger.process_file(path, checkpoint=False)
+
+
+def test_file_errors_do_not_depend_on_the_rule_batch_size(claim_file, monkeypatch):
+    rows = random_rows(1500)
+    path = claim_file("claims.csv", rows)
+    default = validate(path)
+    rule_errors = [err for err in default["errors"] if ": Rule '" in err]
+    assert len(rule_errors) == sum(len(row_failures(row, 0)) for row in rows)
+
+    monkeypatch.setattr(error_logger, "RULE_BATCH_MIN", 7)
+    monkeypatch.setattr(error_logger, "RULE_BATCH_SIZE", 7)
+    small = validate(path)
+    assert small["errors"] == default["errors"]
+    assert small["amount_totals"] == default["amount_totals"]
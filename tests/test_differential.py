@@ -0,0 +1,69 @@
+import contextlib
+import io
+
+import pytest
+
+import error_logger
+from conftest import claim
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # RowIndex keeps its files in ./row_indexes by default
+    return tmp_path / error_logger.DIFF_INDEX_DIR
+
+
+def validate(path, vendor="acme"):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return error_logger.process_file(path, vendor=vendor, checkpoint=False)
+
+
+def test_second_file_is_diffed_against_the_first(claim_file, index_dir):
+    day1 = [claim(n) for n in range(1, 21)]
+    first = validate(claim_file("day1.csv", day1))
+    assert first["error_count"] == 0
+    assert first["differential"]["added"] == 20 and first["differential"]["index_updated"]
+
+    day2 = [claim(n) for n in range(1, 20)]  # AB-2024-20 removed
+    day2[4] = claim(5, Days_Supply="31")  # AB-2024-5 modified
+    day2.append(claim(20, claim_id="AB-2024-21"))  # AB-2024-21 added
+    second = validate(claim_file("day2.csv", day2))
+    diff = second["differential"]
+    assert (diff["added"], diff["modified"], diff["unchanged"], diff["removed"]) == (1, 1, 18, 1)
+    assert (diff["added_claims"], diff["modified_claims"], diff["removed_claims"]) == (["AB-2024-21"], ["AB-2024-5"], ["AB-2024-20"])
+    assert diff["rows_revalidated"] == 2
+
+    full = validate(claim_file("day2_full.csv", day2), vendor=None)
+    assert (second["claim_count"], second["error_count"], second["amount_totals"]) == \
+        (full["claim_count"], full["error_count"], full["amount_totals"])
+
+
+def test_rejected_file_does_not_replace_the_index(claim_file):
+    validate(claim_file("day1.csv", [claim(n) for n in range(1, 11)]))
+    bad = [claim(n) for n in range(1, 11)]
+    bad[2] = claim(3, State="California")
+    rejected = validate(claim_file("bad.csv", bad))
+    assert rejected["error_count"] and not rejected["differential"]["index_updated"]
+
+    # Still diffed against day1: the bad row counts as modified again and is reported again.
+    again = validate(claim_file("bad_again.csv", bad))
+    assert again["differential"]["modified_claims"] == ["AB-2024-3"]
+    assert again["errors"] == rejected["errors"]
+
+
+def test_inherited_rows_still_check_record_numbers(claim_file):
+    validate(claim_file("day1.csv", [claim(n) for n in range(1, 6)]))
+    rows = [claim(n) for n in range(1, 6)]
+    rows[3] = claim(3, claim_id="AB-2024-4")  # unchanged content, RecordNumber repeated
+    result = validate(claim_file("day2.csv", rows))
+    assert result["differential"]["unchanged"] == 5
+    assert any("Duplicate RecordNumber 3" in err for err in result["errors"])
+
+
+def test_index_file_is_not_a_pickle(claim_file, index_dir):
+    validate(claim_file("day1.csv", [claim(n) for n in range(1, 4)]))
+    (index_file,) = index_dir.iterdir()
+    assert index_file.read_bytes().startswith(b'{"format": 1')
+
+    index_file.write_bytes(b"\x80\x04garbage")
+    assert error_logger.RowIndex.load("acme", ["Total_Billed_Amount"]) is None
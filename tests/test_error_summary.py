@@ -0,0 +1,83 @@
+import contextlib
+import io
+
+import error_logger
+from conftest import claim
+from error_logger import ErrorSummary
+
+MISSING = "Field 'State' is required but missing."
+
+
+def test_counts_per_column_code_and_pair():
+    summary = ErrorSummary(seed=1)
+    for row in range(1, 31):
+        summary.add(row, "State", MISSING)
+    for row in range(1, 11):
+        summary.add(row, "DoB", "Invalid date format (expected YYYY-MM-DD): 01/02/2024")
+    summary.add(4, None, "Expected 42 columns, found 3 columns.")
+    summary.add(None, None, "Trailer record count mismatch.")
+    report = summary.report(top=2)
+    assert summary.total == 42
+    assert report["by_column"] == {"State": 30, "DoB": 10, "(row)": 1, "(file)": 1}
+    assert list(report["by_code"].items())[:2] == [("required", 30), ("invalid_date", 10)]
+    assert report["distinct_error_types"] == 4
+    assert [(e["column"], e["code"], e["count"]) for e in report["top_errors"]] == \
+        [("State", "required", 30), ("DoB", "invalid_date", 10)]
+
+
+def test_small_groups_keep_every_example_in_row_order():
+    summary = ErrorSummary(examples=5)
+    for row in (9, 3, 7):
+        summary.add(row, "State", MISSING)
+    summary.add(None, "State", MISSING)
+    (entry,) = summary.report()["top_errors"]
+    assert [e["row"] for e in entry["examples"]] == [3, 7, 9, None]
+
+
+def test_reservoir_is_bounded_and_drawn_from_the_group():
+    summary = ErrorSummary(examples=5, seed=0)
+    for row in range(1, 100001):
+        summary.add(row, "State", MISSING)
+    (entry,) = summary.report()["top_errors"]
+    rows = [e["row"] for e in entry["examples"]]
+    assert entry["count"] == 100000 and len(set(rows)) == 5
+    assert all(1 <= row <= 100000 for row in rows)
+    assert max(rows) > 5  # not just the first errors seen
+
+
+def test_every_error_is_equally_likely_to_be_an_example():
+    errors, examples, seeds = 20, 4, 2000
+    picked = [0] * errors
+    for seed in range(seeds):
+        summary = ErrorSummary(examples=examples, seed=seed)
+        for row in range(errors):
+            summary.add(row, "State", MISSING)
+        for example in summary.report()["top_errors"][0]["examples"]:
+            picked[example["row"]] += 1
+    expected = seeds * examples / errors  # 400, standard deviation about 18
+    assert all(abs(count - expected) < 80 for count in picked), picked
+
+
+def test_same_seed_same_examples():
+    def report(seed):
+        summary = ErrorSummary(examples=3, seed=seed)
+        for row in range(1000):
+            summary.add(row, "State", MISSING)
+        return summary.report()
+    assert report(5) == report(5)
+    assert report(5) != report(6)
+
+
+def test_summary_run_counts_the_same_errors_as_a_full_run(claim_file):
+    rows = [claim(n, State="California") if n % 3 == 0 else claim(n) for n in range(1, 301)]
+    rows[10] = rows[10][:5]
+    path = claim_file("claims.csv", rows)
+    with contextlib.redirect_stdout(io.StringIO()):
+        full = error_logger.process_file(path, checkpoint=False)
+        summarized = error_logger.process_file(path, checkpoint=False, summary=True)
+    summary = summarized["summary"]
+    assert summarized["error_count"] == full["error_count"] == sum(summary["by_column"].values())
+    assert summary["by_column"]["State"] == sum("Column 'State'" in err for err in full["errors"])
+    for entry in summary["top_errors"]:
+        assert 0 < len(entry["examples"]) <= error_logger.SUMMARY_EXAMPLES
+        assert all(example["message"] in full["errors"] for example in entry["examples"])
@@ -0,0 +1,52 @@
+from error_logger import CLAIM_SCHEMA, FieldValidationCache, validate_field
+
+STATE = next(field for field in CLAIM_SCHEMA if field["name"] == "State")
+WINDOW = FieldValidationCache.SAMPLE_SIZE
+
+
+def lookups(cache, values):
+    for value in values:
+        assert list(cache.validate(value)) == list(validate_field(STATE, value))
+
+
+def distinct(count, start=0):
+    return [f"X{n}" for n in range(start, start + count)]
+
+
+def test_repetitive_column_stays_cached():
+    cache = FieldValidationCache(STATE)
+    lookups(cache, ["CA", "NY", "California", ""] * WINDOW)
+    stats = cache.stats()
+    assert stats["enabled"] and stats["hit_rate"] > 0.99 and stats["entries"] == 4
+
+
+def test_cache_pauses_for_a_window_when_hit_rate_drops_then_resumes():
+    cache = FieldValidationCache(STATE)
+    lookups(cache, distinct(WINDOW))
+    assert not cache.enabled and cache.stats()["entries"] == 0
+
+    lookups(cache, distinct(WINDOW - 1, WINDOW))
+    assert not cache.enabled and cache.misses == WINDOW  # bypassed, not counted
+    lookups(cache, ["CA"])
+    assert cache.enabled
+
+    lookups(cache, ["CA", "NY"] * (WINDOW // 2))  # a good window after the pause
+    assert cache.enabled and cache.hits >= WINDOW - 2
+
+
+def test_pause_doubles_while_values_keep_missing():
+    cache = FieldValidationCache(STATE)
+    start = 0
+    for pause in (1, 2, 4):
+        lookups(cache, distinct(WINDOW, start))
+        start += WINDOW
+        assert not cache.enabled
+        lookups(cache, distinct(pause * WINDOW, start))
+        start += pause * WINDOW
+        assert cache.enabled
+
+
+def test_unique_column_is_never_cached():
+    cache = FieldValidationCache({**STATE, "unique": True})
+    lookups(cache, ["CA"] * (3 * WINDOW))
+    assert not cache.enabled and cache.hits == cache.misses == 0
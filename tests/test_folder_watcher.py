@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import claim
+from folder_watcher import FolderWatcher, Inotify
+
+SETTLE = 0.2
+
+
+def csv_text(rows):
+    return "".join(",".join(row) + "\n" for row in rows) + f"TRL,{len(rows)}\n"
+
+
+CLEAN = csv_text([claim(n) for n in range(1, 11)])
+BAD = csv_text([claim(n, State="California") if n == 4 else claim(n) for n in range(1, 11)])
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+@pytest.fixture(params=[False, True], ids=["inotify", "poll"])
+def watcher(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # validation checkpoints are kept in the working directory
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    watcher = FolderWatcher(str(inbox), workers=2, settle_seconds=SETTLE, poll_interval=0.05, poll=request.param)
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    wait_for(lambda: (inbox / "quarantine").is_dir())
+    yield watcher
+    watcher.stop()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def inotify_available(folder):
+    try:
+        Inotify(folder).close()
+    except OSError:
+        return False
+    return True
+
+
+def handled(watcher):
+    return watcher.counts["processed"] + watcher.counts["quarantined"] + watcher.counts["failed"]
+
+
+def record(path):
+    with open(f"{path}.result.json") as f:
+        return json.load(f)
+
+
+def test_clean_file_is_processed_and_bad_file_quarantined(watcher):
+    inbox = watcher.folder
+    with open(os.path.join(inbox, "clean.csv"), "w") as f:
+        f.write(CLEAN)
+    with open(os.path.join(inbox, "bad.csv"), "w") as f:
+        f.write(BAD)
+    wait_for(lambda: handled(watcher) == 2)
+    assert watcher.counts == {"processed": 1, "quarantined": 1, "failed": 0}
+    assert sorted(os.listdir(inbox)) == ["processed", "quarantine"]
+
+    processed = os.path.join(watcher.processed_dir, "clean.csv")
+    assert open(processed).read() == CLEAN
+    assert record(processed)["status"] == "processed" and record(processed)["result"]["error_count"] == 0
+
+    quarantined = os.path.join(watcher.quarantine_dir, "bad.csv")
+    assert open(quarantined).read() == BAD
+    result = record(quarantined)
+    assert result["status"] == "quarantined" and result["result"]["summary"]["by_column"] == {"State": 2}
+
+
+def test_file_is_not_picked_up_while_it_keeps_changing(watcher):
+    path = os.path.join(watcher.folder, "growing.csv")
+    with open(path, "w") as f:
+        for line in CLEAN.splitlines(keepends=True):  # 11 lines over more than twice the settle time
+            f.write(line)
+            f.flush()
+            time.sleep(SETTLE / 4)
+            assert os.path.exists(path)
+    wait_for(lambda: handled(watcher) == 1)
+    assert open(os.path.join(watcher.processed_dir, "growing.csv")).read() == CLEAN
+
+
+def test_open_file_waits_for_its_writer(watcher):
+    if watcher.poll or not inotify_available(watcher.folder):
+        pytest.skip("polling cannot tell whether a writer still has the file open")
+    path = os.path.join(watcher.folder, "slow.csv")
+    lines = CLEAN.splitlines(keepends=True)
+    with open(path, "w") as f:
+        f.writelines(lines[:5])
+        f.flush()
+        time.sleep(SETTLE * 3)  # unchanged for longer than the settle time, but not closed
+        assert os.path.exists(path)
+        f.writelines(lines[5:])
+    wait_for(lambda: handled(watcher) == 1)
+    assert open(os.path.join(watcher.processed_dir, "slow.csv")).read() == CLEAN
+
+
+def test_partial_downloads_and_hidden_files_are_ignored(watcher):
+    for name in ("claims.csv.part", ".claims.csv", "claims.tmp"):
+        with open(os.path.join(watcher.folder, name), "w") as f:
+            f.write(CLEAN)
+    with open(os.path.join(watcher.folder, "marker.csv"), "w") as f:
+        f.write(CLEAN)
+    wait_for(lambda: handled(watcher) == 1)
+    time.sleep(SETTLE * 2)
+    assert handled(watcher) == 1
+    assert sorted(os.listdir(watcher.folder)) == [".claims.csv", "claims.csv.part", "claims.tmp", "processed", "quarantine"]
+
+
+def test_unreadable_file_is_quarantined_with_a_reason(watcher):
+    with open(os.path.join(watcher.folder, "empty.csv"), "w"):
+        pass
+    wait_for(lambda: handled(watcher) == 1)
+    quarantined = os.path.join(watcher.quarantine_dir, "empty.csv")
+    assert record(quarantined)["result"] == {"error": "File could not be read or is empty"}
+
+
+def test_same_name_twice_keeps_both(watcher):
+    path = os.path.join(watcher.folder, "daily.csv")
+    for expected in (1, 2):
+        with open(path, "w") as f:
+            f.write(CLEAN)
+        wait_for(lambda: handled(watcher) == expected)
+    names = [name for name in os.listdir(watcher.processed_dir) if not name.endswith(".result.json")]
+    assert len(names) == 2 and "daily.csv" in names
+
+
+def test_files_already_in_the_folder_are_picked_up(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    (inbox / "waiting.csv").write_text(CLEAN)
+    watcher = FolderWatcher(str(inbox), workers=1, settle_seconds=SETTLE, poll_interval=0.05)
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    try:
+        wait_for(lambda: handled(watcher) == 1)
+    finally:
+        watcher.stop()
+        thread.join(10)
+    assert (inbox / "processed" / "waiting.csv").read_text() == CLEAN
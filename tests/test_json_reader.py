@@ -0,0 +1,30 @@
+import io
+import json
+
+import pytest
+
+import input_stream
+from input_stream import JsonRecordReader
+
+RECORDS = [{"ClaimID": f"C{i}", "Amount": 12.5, "Paid": -1000, "Flag": i % 2 == 0, "Note": "é\\u00e9" * (i % 7)}
+           for i in range(200)]
+
+
+def read(data, read_size):
+    return list(JsonRecordReader(io.BytesIO(data), read_size=read_size))
+
+
+@pytest.mark.parametrize("read_size", [1, 3, 7, 64, 1024, 1 << 20])
+def test_records_do_not_depend_on_chunk_size(read_size):
+    expected = read(json.dumps(RECORDS).encode(), 1 << 20)
+    assert read(json.dumps(RECORDS).encode(), read_size) == expected
+    assert expected[0]["Amount"] == "12.5" and expected[0]["Paid"] == "-1000" and expected[0]["Flag"] is True
+
+
+def test_syntax_error_is_reported_where_it_is(monkeypatch):
+    monkeypatch.setattr(input_stream, "MAX_JSON_RECORD_SIZE", 4096)
+    data = b'[{"a": }' + b',{"b": 1}' * 100_000 + b"]"
+    reader = JsonRecordReader(io.BytesIO(data), read_size=256)
+    with pytest.raises(ValueError, match="at character 7: Expecting value"):
+        list(reader)
+    assert reader._offset + len(reader._buffer) <= 512  # the rest of the input was never read
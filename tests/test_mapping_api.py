@@ -0,0 +1,61 @@
+import io
+import os
+
+import pytest
+from flask import Flask
+
+import mapper
+
+MAPPING = {"Patient_Last_Name": "LAST", "Patient_First_Name": "FIRST", "State": mapper.UNMAPPED}
+STANDARD = list(MAPPING)
+ROWS = 20_000  # well past a pipe buffer, so the upload is converted while it is being sent
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    app.config.update(MAPPING_FOLDER=str(tmp_path / "mappings"), OUTPUT_FOLDER=str(tmp_path / "outputs"),
+                      UPLOAD_FOLDER=str(tmp_path / "uploads"))
+    view = mapper.MappingAPI.as_view("mapping_api")
+    app.add_url_rule("/api/mappings/<mapping_id>/<string:action>", view_func=view, methods=["POST"])
+    return app.test_client()
+
+
+def vendor_csv(header="ID,LAST,FIRST"):
+    lines = [header] + [f"{n},Doe{n},Jo" for n in range(ROWS)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def test_saving_the_same_mapping_reuses_its_id(tmp_path):
+    folder = str(tmp_path)
+    first = mapper.save_mapping(MAPPING, STANDARD, folder, header_row=1)
+    assert mapper.save_mapping(dict(reversed(MAPPING.items())), STANDARD, folder, header_row=1) == first
+    assert mapper.save_mapping(MAPPING, STANDARD, folder, header_row=0) != first
+    assert len(os.listdir(folder)) == 2
+    assert mapper.load_mapping(first, folder)["mapping"] == MAPPING
+
+
+def test_apply_streams_a_multipart_vendor_file(client, tmp_path):
+    mapping_id = mapper.save_mapping(MAPPING, STANDARD, str(tmp_path / "mappings"))
+    response = client.post(f"/api/mappings/{mapping_id}/apply?header_row=0&output_name=out.csv",
+                           data={"vendor_file": (io.BytesIO(vendor_csv()), "vendor.csv")})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["rows"] == ROWS
+    with open(tmp_path / "outputs" / "out.csv") as f:
+        assert f.readline().strip() == "Patient_Last_Name,Patient_First_Name"
+        assert f.readline().strip() == "Doe0,Jo"
+
+
+def test_apply_error_does_not_stall_the_upload(client, tmp_path):
+    mapping_id = mapper.save_mapping(MAPPING, STANDARD, str(tmp_path / "mappings"))
+    response = client.post(f"/api/mappings/{mapping_id}/apply?header_row=0",
+                           data={"vendor_file": (io.BytesIO(vendor_csv("ID,SURNAME,GIVEN")), "vendor.csv")})
+    assert response.status_code == 400
+    assert "None of the mapped vendor columns" in response.get_json()["error"]
+    assert not os.listdir(tmp_path / "outputs")
+
+
+def test_apply_without_a_vendor_file(client, tmp_path):
+    mapping_id = mapper.save_mapping(MAPPING, STANDARD, str(tmp_path / "mappings"))
+    response = client.post(f"/api/mappings/{mapping_id}/apply", data={"format": "csv"})
+    assert response.status_code == 400
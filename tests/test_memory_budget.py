@@ -0,0 +1,102 @@
+import contextlib
+import functools
+import io
+import sys
+
+import pytest
+
+import error_logger
+import memory_budget
+from conftest import claim
+from memory_budget import AdaptiveBatch, JobMemory, estimate_size, row_size
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """Anonymous memory of the process as the tests set it, starting at 100 MB."""
+    current = {"anon": 100 * MB}
+    monkeypatch.setattr(memory_budget, "read_rss", lambda: (current["anon"] + 50 * MB, current["anon"]))
+    return current
+
+
+def test_first_batch_is_the_minimum_then_fills_the_share(rss):
+    batch = AdaptiveBatch(JobMemory(budget=4 * MB), "rows", 100, 100000, 0.25)
+    assert batch.size == 100
+    assert batch.resize(100, 100 * 100) == MB // 100  # 100 bytes a row in 1 MB
+    assert batch.resize(batch.size, batch.size * 100) == MB // 100
+
+
+def test_size_stays_between_minimum_and_maximum(rss):
+    batch = AdaptiveBatch(JobMemory(budget=4 * MB), "rows", 100, 5000, 0.25)
+    assert batch.resize(100, 100 * 10) == 5000  # narrow rows: capped at the maximum
+    wide = AdaptiveBatch(JobMemory(budget=4 * MB), "wide", 100, 5000, 0.25)
+    assert wide.resize(100, 100 * MB) == 100  # 1 MB rows: never below the minimum
+
+
+def test_wider_rows_are_followed_at_once_narrower_ones_gradually(rss):
+    batch = AdaptiveBatch(JobMemory(budget=4 * MB), "rows", 10, 100000, 0.25)
+    batch.resize(10, 10 * 1000)
+    assert batch.resize(10, 10 * 4000) == MB // 4000
+    assert batch.row_bytes == 4000
+    assert batch.resize(10, 10 * 1000) == int(MB / 2500)  # halfway back
+    assert batch.resize(10, 10 * 1000) == int(MB / 1750)
+
+
+def test_growth_outside_the_buffers_shrinks_batches(rss):
+    memory = JobMemory(budget=4 * MB)
+    batch = AdaptiveBatch(memory, "rows", 10, 100000, 0.25)
+    assert batch.resize(10, 10 * 100) == MB // 100
+    rss["anon"] += 3.5 * MB  # e.g. errors kept in memory: half a MB of the budget is left
+    assert batch.resize(10, 10 * 100) == (MB // 2 + 10 * 100) // 100  # the batch's own bytes are not outside
+    rss["anon"] += 10 * MB
+    assert batch.resize(10, 10 * 100) == 10
+    rss["anon"] -= 13.5 * MB
+    assert batch.resize(10, 10 * 100) == MB // 100
+
+
+def test_without_proc_the_share_of_the_budget_is_used(monkeypatch):
+    monkeypatch.setattr(memory_budget, "read_rss", lambda: (None, None))
+    batch = AdaptiveBatch(JobMemory(budget=4 * MB), "rows", 10, 100000, 0.5)
+    assert batch.resize(10, 10 * 100) == 2 * MB // 100
+
+
+def test_empty_batch_keeps_the_size_and_report(rss):
+    memory = JobMemory(budget=4 * MB)
+    batch = AdaptiveBatch(memory, "rows", 10, 100000, 0.25)
+    batch.resize(10, 10 * 200)
+    batch.resize(batch.size, batch.size * 300)
+    assert batch.resize(0, 0) == MB // 300
+    stage = memory.report()["stages"]["rows"]
+    assert stage == {"peak_bytes": (MB // 200) * 300, "batches": 2, "batch_rows_min": 10,
+                     "batch_rows_max": MB // 200, "bytes_per_row": 300}
+    assert memory.buffered() == 0  # a batch's bytes are released once it has been measured
+
+
+def test_estimates_are_close_to_measured_sizes():
+    rows = [claim(n) for n in range(5000)]
+    exact = sum(map(row_size, rows))
+    assert abs(estimate_size(rows, row_size) - exact) < exact * 0.05
+    values = {f"AB-2024-{n}" for n in range(5000)}
+    exact = sys.getsizeof(values) + sum(map(sys.getsizeof, values))
+    assert abs(estimate_size(values) - exact) < exact * 0.05
+
+
+def validate(path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return error_logger.process_file(path, checkpoint=False)
+
+
+def test_validation_batches_follow_the_job_budget(claim_file, monkeypatch):
+    path = claim_file("claims.csv", [claim(n) for n in range(1, 6001)])
+    roomy = validate(path)["memory"]["stages"]["rule_batch"]
+    assert roomy["batch_rows_min"] == error_logger.RULE_BATCH_MIN
+    assert roomy["batch_rows_max"] == error_logger.RULE_BATCH_SIZE
+
+    monkeypatch.setattr(error_logger, "JobMemory", functools.partial(JobMemory, budget=4 * MB))
+    tight = validate(path)
+    stage = tight["memory"]["stages"]["rule_batch"]
+    assert error_logger.RULE_BATCH_MIN <= stage["batch_rows_max"] < error_logger.RULE_BATCH_SIZE
+    assert stage["peak_bytes"] <= 4 * MB * error_logger.RULE_BATCH_SHARE * 1.5
+    assert tight["claim_count"] == 6000 and tight["error_count"] == 0
@@ -0,0 +1,125 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+import mapper
+
+STANDARD = ["Alpha", "Bravo", "Charlie"]
+VENDOR = ["Xray", "Yank", "Zulu"]
+ANSWER = {"Alpha": "Xray", "Bravo": "Yank", "Charlie": "Zulu"}
+
+
+class FaultyGemini(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in for the Gemini REST API. Each request takes the next fault from
+    plan: ("ok", delay) answers with ANSWER after delay seconds, ("error", 0) answers 500.
+    Requests beyond the plan are answered at once.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.plan = []
+        self.hits = []
+        self._lock = threading.Lock()
+
+    def next_fault(self):
+        with self._lock:
+            fault = self.plan.pop(0) if self.plan else ("ok", 0)
+            self.hits.append(fault[0])
+        return fault
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        mode, delay = self.server.next_fault()
+        time.sleep(delay)
+        if mode == "error":
+            body, status = b'{"error": {"code": 500, "message": "injected"}}', 500
+        else:
+            text = json.dumps(ANSWER)
+            body = json.dumps({"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                               "finishReason": "STOP", "index": 0}]}).encode()
+            status = 200
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client gave up on a slow answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gemini(monkeypatch, breaker):
+    server = FaultyGemini()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("GEMINI_API_ENDPOINT", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(mapper, "MAPPING_BUDGET_SECONDS", 2.0)
+    monkeypatch.setattr(mapper, "MAPPING_HEDGE_AFTER_SECONDS", 0.5)
+    monkeypatch.setattr(mapper, "MAPPING_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(mapper, "RETRY_BASE_DELAY", 0.05)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def map_with(server, plan):
+    server.plan[:] = plan
+    server.hits.clear()
+    started = time.monotonic()
+    result = mapper.map_fields(STANDARD, VENDOR)
+    return result, time.monotonic() - started
+
+
+def test_healthy_model(gemini):
+    result, _ = map_with(gemini, [("ok", 0)])
+    assert result == ANSWER and not result.degraded
+    assert gemini.hits == ["ok"]
+
+
+def test_slow_answer_is_hedged(gemini):
+    result, elapsed = map_with(gemini, [("ok", 3), ("ok", 0)])
+    assert result == ANSWER and not result.degraded
+    assert gemini.hits == ["ok", "ok"]
+    assert elapsed < 2
+
+
+def test_server_error_is_retried(gemini):
+    result, _ = map_with(gemini, [("error", 0), ("ok", 0)])
+    assert result == ANSWER and not result.degraded
+    assert gemini.hits[:2] == ["error", "ok"]
+
+
+def test_budget_falls_back_to_local_matches(gemini):
+    result, elapsed = map_with(gemini, [("ok", 5)] * 3)
+    assert result.degraded and "within 2s" in result.reason
+    assert set(result.values()) == {mapper.UNMAPPED}
+    assert elapsed < 3
+
+
+def test_breaker_opens_and_recovers(gemini, breaker):
+    for _ in range(breaker.failure_threshold):
+        result, _ = map_with(gemini, [("error", 0)] * 3)
+        assert result.degraded
+    assert breaker.state == "open"
+
+    result, _ = map_with(gemini, [("ok", 0)])
+    assert result.degraded and result.reason == "mapping model circuit is open"
+    assert gemini.hits == []
+
+    time.sleep(breaker.reset_seconds)
+    result, _ = map_with(gemini, [("ok", 0)])
+    assert result == ANSWER and not result.degraded
+    assert breaker.state == "closed"
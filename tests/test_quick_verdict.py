@@ -0,0 +1,70 @@
+import gzip
+
+import pytest
+
+from conftest import claim
+from error_logger import quick_verdict
+
+ROWS = 5000
+
+
+def claims(bad=()):
+    bad = set(bad)
+    return [claim(n, State="California") if n in bad else claim(n) for n in range(1, ROWS + 1)]
+
+
+def verdict(path, **kwargs):
+    return quick_verdict(path, seed=7, **kwargs)
+
+
+def test_clean_file_is_accepted_from_a_sample(claim_file):
+    result = verdict(claim_file("clean.csv", claims()), sample_size=500)
+    assert result["verdict"] == "accept"
+    assert result["sampled_rows"] == 500
+    assert result["row_error_rate"]["rate"] == 0 and result["columns"] == []
+    assert result["trailer_record_count"] == ROWS
+    assert abs(result["estimated_claim_count"] - ROWS) < ROWS * 0.02
+
+
+def test_error_rate_is_estimated_per_column(claim_file):
+    result = verdict(claim_file("bad.csv", claims(bad=range(1, ROWS + 1, 5))))  # every fifth row
+    assert result["verdict"] == "reject"
+    (state,) = result["columns"]
+    assert state["column"] == "State"
+    assert state["low"] <= 0.2 <= state["high"]
+    assert any("Row error rate is above" in reason for reason in result["reasons"])
+    assert result["examples"] and all("Column 'State'" in example for example in result["examples"])
+
+
+def test_sample_covers_the_end_of_the_file(claim_file):
+    # Only the last tenth is bad; a sample from the start of the file would miss it.
+    result = verdict(claim_file("tail.csv", claims(bad=range(ROWS * 9 // 10, ROWS + 1))), sample_size=300)
+    assert result["verdict"] == "reject"
+
+
+def test_small_error_rate_is_uncertain_not_accepted(claim_file):
+    result = verdict(claim_file("some.csv", claims(bad=range(1, ROWS + 1, 100))), sample_size=300)
+    assert result["verdict"] in ("uncertain", "reject")
+    assert result["row_error_rate"]["high"] > 0.01
+
+
+def test_trailer_count_far_from_the_estimate(claim_file):
+    path = claim_file("short.csv", claims(), trailer=False)
+    with open(path, "a") as f:
+        f.write(f"TRL,{ROWS * 2}\n")
+    result = verdict(path, sample_size=200)
+    assert any(reason.startswith(f"Trailer count {ROWS * 2} is far") for reason in result["reasons"])
+
+
+def test_same_seed_same_sample(claim_file):
+    path = claim_file("bad.csv", claims(bad=range(1, ROWS + 1, 7)))
+    first, second = verdict(path, sample_size=200), verdict(path, sample_size=200)
+    first.pop("elapsed_seconds"), second.pop("elapsed_seconds")
+    assert first == second
+
+
+def test_compressed_file_is_refused(tmp_path):
+    path = tmp_path / "claims.csv.gz"
+    path.write_bytes(gzip.compress(b"CLM,1\nTRL,1\n"))
+    with pytest.raises(ValueError, match="uncompressed"):
+        quick_verdict(str(path))
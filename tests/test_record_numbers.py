@@ -0,0 +1,22 @@
+import pytest
+
+from error_logger import RecordNumberSet
+
+
+@pytest.mark.parametrize("other", ["+7", "-7", " 7", "7 ", "٧", "7_0", "7.0", "70", str(7 + (1 << 64))])
+def test_only_plain_digits_are_numbers(other):
+    numbers = RecordNumberSet()
+    assert numbers.add("7")
+    assert numbers.add(other)
+    assert not numbers.add(other)
+    assert "7" in numbers and other in numbers
+    assert len(numbers) == 2
+
+
+@pytest.mark.parametrize("values", [range(1, 5000), range(0, 10 ** 12, 10 ** 8)], ids=["sequential", "sparse"])
+def test_duplicates_are_found_in_bitmap_and_runs(values):
+    numbers = RecordNumberSet(expected_count=len(values))
+    assert all(numbers.add(str(value)) for value in values)
+    assert not any(numbers.add(str(value)) for value in values)
+    assert len(numbers) == len(values)
+    assert str(values[-1] + 1) not in numbers
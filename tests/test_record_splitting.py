@@ -0,0 +1,66 @@
+import csv
+import gzip
+import io
+
+import pytest
+
+from input_stream import IncrementalRowParser, MappedClaimFile
+
+# Quoted newlines (LF and CRLF), doubled quotes, quotes that are data (5", O"Brien),
+# a quoted field ending a line, an empty quoted field and CRLF line ends. Fed in
+# every chunk size below, each of these lands on a chunk boundary somewhere.
+LINES = [
+    'RecordID,Name,Note,Size',
+    'CLM,"Doe, Jo","line one\nline two",5"',
+    'CLM,O"Brien,"said ""hi""\r\nand left",10',
+    'CLM,"","",""',
+    'CLM,"multi\n\n\nline","x"",""y",7',
+    'CLM,plain,"ends quoted"',
+    'CLM,"a\r\nb\r\n",c,"d"',
+    'TRL,6',
+]
+CHUNK_SIZES = [1, 2, 3, 4, 5, 7, 11, 16, 64, 4096]
+
+
+def expected_rows(text):
+    return list(csv.reader(io.StringIO(text, newline="")))
+
+
+def feed(data, chunk_size):
+    parser = IncrementalRowParser()
+    rows = []
+    for start in range(0, len(data), chunk_size):
+        rows.extend(parser.feed(data[start:start + chunk_size]))
+    rows.extend(parser.close())
+    return rows
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"], ids=["lf", "crlf"])
+@pytest.mark.parametrize("compress", [False, True], ids=["plain", "gzip"])
+def test_streamed_rows_do_not_depend_on_chunk_size(newline, compress):
+    text = newline.join(LINES) + newline
+    data = text.encode()
+    if compress:
+        data = gzip.compress(data)
+    expected = expected_rows(text)
+    assert len(expected) == len(LINES)
+    for chunk_size in CHUNK_SIZES:
+        assert feed(data, chunk_size) == expected, f"chunk size {chunk_size}"
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"], ids=["lf", "crlf"])
+def test_mapped_rows_match_csv(tmp_path, newline):
+    text = newline.join(LINES) + newline
+    path = tmp_path / "claims.csv"
+    path.write_bytes(text.encode())
+    with MappedClaimFile(str(path)) as claim_file:
+        rows = [row for row, _ in claim_file.rows(0, claim_file.size)]
+        assert claim_file.last_record()[0] == ["TRL", "6"]
+    assert rows == expected_rows(text)
+
+
+def test_unterminated_quote_at_the_end_is_one_record():
+    data = b'CLM,"open\nstill open\n'
+    expected = expected_rows(data.decode())
+    for chunk_size in CHUNK_SIZES:
+        assert feed(data, chunk_size) == expected
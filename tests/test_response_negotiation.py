@@ -0,0 +1,79 @@
+import gzip
+
+import pytest
+from flask import jsonify
+
+import indium
+
+ROWS = [{"row": n, "message": f"Row {n}, Column 'State': Field 'State' is required but missing."} for n in range(200)]
+
+
+@pytest.fixture
+def client(app):
+    app.add_url_rule("/report", "report", lambda: jsonify(ROWS))
+    app.add_url_rule("/small", "small", lambda: jsonify({"status": "ok"}))
+    return app.test_client()
+
+
+def test_etag_answers_a_matching_if_none_match_with_304(client):
+    first = client.get("/report")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and "no-cache" in first.headers["Cache-Control"]
+    again = client.get("/report", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b""
+    assert client.get("/report", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_gzip_when_accepted(client):
+    plain = client.get("/report")
+    assert "Content-Encoding" not in plain.headers and "Accept-Encoding" in plain.headers["Vary"]
+    compressed = client.get("/report", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.data) == plain.data
+    assert len(compressed.data) < len(plain.data) // 5
+    # Same representation, so the compressed response keeps the ETag, weakened.
+    assert compressed.headers["ETag"] == "W/" + plain.headers["ETag"]
+    revalidated = client.get("/report", headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+
+@pytest.mark.parametrize("accept", ["identity", "gzip;q=0", "deflate", ""])
+def test_identity_when_gzip_is_not_accepted(client, accept):
+    response = client.get("/report", headers={"Accept-Encoding": accept})
+    assert "Content-Encoding" not in response.headers
+    assert response.json == ROWS
+
+
+def test_brotli_is_preferred_when_installed(client):
+    brotli = pytest.importorskip("brotli")
+    response = client.get("/report", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(response.data) == client.get("/report").data
+
+
+def test_br_only_client_gets_identity_without_brotli(client):
+    try:
+        import brotli  # noqa: F401
+        pytest.skip("brotli is installed")
+    except ImportError:
+        pass
+    assert "Content-Encoding" not in client.get("/report", headers={"Accept-Encoding": "br"}).headers
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers and response.json == {"status": "ok"}
+
+
+def test_log_download_is_conditional_and_streamed_gzipped(client, tmp_path, monkeypatch):
+    log = tmp_path / "download.log"
+    log.write_text("".join(f"line {n}: upload accepted\n" for n in range(5000)))
+    monkeypatch.setattr(indium, "LOG_FILE", str(log))
+    compressed = client.get("/download-log", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip" and compressed.is_streamed
+    assert gzip.decompress(compressed.data) == log.read_bytes()
+    etag = compressed.headers["ETag"]
+    assert etag.startswith("W/")
+    assert client.get("/download-log", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+    plain = client.get("/download-log")
+    assert "Content-Encoding" not in plain.headers and plain.data == log.read_bytes()
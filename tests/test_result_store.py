@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import result_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    return result_store.ResultStore(str(tmp_path / "results.db"), retention_days=0)
+
+
+def record(store, file, errors):
+    recorder = store.recorder(file)
+    for error in errors:
+        recorder(*error)
+    recorder.finish(len(errors), len(errors))
+    return recorder.run_id
+
+
+def test_search_treats_like_wildcards_literally(store):
+    run_id = record(store, "file a_b%.csv", [(1, "Amount", "Value '10%' is invalid"),
+                                             (2, "Amount", "Value '105' is invalid"),
+                                             (3, "Claim_ID", "Missing Claim_ID"),
+                                             (4, "ClaimXID", "Missing ClaimXID")])
+    record(store, "file axb5.csv", [])
+    assert store.query_errors(run_id, search="10%")[0] == 1
+    assert store.query_errors(run_id, search="Claim_ID")[0] == 1
+    assert store.query_errors(run_id, search="value '")[0] == 2  # LIKE ignores ASCII case
+    total, runs = store.list_runs("a_b%")
+    assert total == 1 and runs[0]["run_id"] == run_id
+
+
+def test_prune_deletes_old_runs_and_their_errors(store):
+    old = record(store, "file old.csv", [(1, "State", "bad")])
+    new = record(store, "file new.csv", [(1, "State", "bad")])
+    started = (datetime.now() - timedelta(days=40)).isoformat(timespec="seconds")
+    with store._connect() as conn:
+        conn.execute("UPDATE runs SET started_at = ? WHERE run_id = ?", (started, old))
+
+    assert store.prune_runs(30) == 1
+    assert store.get_run(old) is None and store.query_errors(old)[0] == 0
+    assert store.get_run(new) is not None and store.query_errors(new)[0] == 1
+
+
+def test_request_teardown_closes_the_thread_connection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # importing indium builds an app, with its folders, in the working directory
+    import indium
+    store = result_store.ResultStore(str(tmp_path / "results.db"))
+    monkeypatch.setattr(result_store, "_store", store)
+    app = indium.create_app({"UPLOAD_FOLDER": str(tmp_path / "uploads")})
+
+    response = app.test_client().get("/api/runs")
+    assert response.status_code == 200
+    assert store._local.conn is None
@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start of the app factory, without the views' heavy dependencies.
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 1.0))
+
+STARTUP = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+import indium
+indium.create_app()
+elapsed = time.perf_counter() - started
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in indium.HEAVY_MODULES + ["numpy"] if m in sys.modules]}))
+"""
+
+
+def test_create_app_stays_within_the_startup_budget(tmp_path):
+    # A fresh interpreter, so nothing is imported already; run in tmp_path for the logs directory.
+    out = subprocess.run([sys.executable, "-c", STARTUP, ROOT], cwd=tmp_path, capture_output=True, text=True,
+                         check=True)
+    startup = json.loads(out.stdout.strip().splitlines()[-1])
+    assert startup["loaded"] == []
+    assert startup["elapsed"] < STARTUP_BUDGET_SECONDS
@@ -0,0 +1,30 @@
+import io
+import os
+
+import result_store
+from conftest import claim
+
+
+def claim_bytes(rows):
+    return ("\n".join(",".join(row) for row in rows) + f"\nTRL,{len(rows)}\n").encode()
+
+
+def upload(app, filename, data):
+    return app.test_client().post("/api/upload-file", data={"vendor_file": (io.BytesIO(data), filename)})
+
+
+def test_multipart_upload_is_validated_and_kept(app):
+    response = upload(app, "claims.csv", claim_bytes([claim(n) for n in range(1, 4)]))
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result["claim_count"], result["error_count"]) == (3, 0)
+    assert os.listdir(app.config["UPLOAD_FOLDER"]) == ["claims.csv"]
+    assert result_store.get_result_store().get_run(result["run_id"])["claim_count"] == 3
+
+
+def test_file_name_with_nothing_safe_left_is_refused(app):
+    response = upload(app, "..", claim_bytes([claim(1)]))
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid file name: '..'"
+    assert os.listdir(app.config["UPLOAD_FOLDER"]) == []
+    assert result_store.get_result_store().list_runs()[0] == 0
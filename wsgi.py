@@ -0,0 +1,12 @@
+"""
+Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built and warmed up when this module is imported. With preload_app
+(see gunicorn.conf.py) that happens once in the master, before the workers are
+forked, so imported modules and compiled validators are shared copy-on-write.
+"""
+from indium import app, warm_up
+
+warm_up(app)